@@ -0,0 +1,292 @@
+# Benchmarks for the console and control-plane hot paths.
+#
+#   python benchmarks/run.py [--quick] [--output results.json] [--only subprocess,encode,ws_fanout,read,start_stop] [--loop asyncio|uvloop]
+#
+# Runs inside a throwaway working directory (configs, logs, cache and Servers are created there) and prints the
+# results as JSON. The start/stop benchmark needs bin/restic and bin/rclone in the repository root and is reported
+# as skipped otherwise; it uses an rclone alias remote pointing to a local folder and a fresh restic repository.
+# JSON console fan-out is measured with every available encoder (json, orjson); run once per --loop to compare event loops.
+
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import argparse
+import platform
+import tempfile
+import asyncio
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentiles(values: list) -> dict:
+  if not values:
+    return {}
+  values = sorted(values)
+  pick = lambda p: values[min(int(len(values) * p), len(values) - 1)]
+  return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": values[-1], "mean": statistics.fmean(values)}
+
+
+async def wait_for(condition, timeout: float):
+  deadline = time.perf_counter() + timeout
+  while not condition():
+    if time.perf_counter() > deadline:
+      raise TimeoutError("benchmark condition not reached")
+    await asyncio.sleep(0.001)
+
+
+# ---------- SUBPROCESS ----------
+
+CHILD_PRINTER = """
+import sys, time
+for i in range(int(sys.argv[1])):
+  sys.stdout.write(f"{time.time():.6f} line {i}\\n")
+  sys.stdout.flush()
+"""
+
+async def bench_subprocess(lines: int) -> dict:
+  # Line throughput and child-write -> listener latency of SubprocessHandler with a fast printing child
+  from libraries.SubprocessHandler import SubprocessHandler
+  with open("printer.py", "w") as f:
+    f.write(CHILD_PRINTER)
+
+  latencies = []
+
+  async def listener(line):
+    latencies.append((time.time() - float(line.split(" ", 1)[0])) * 1000)
+
+  process = SubprocessHandler([sys.executable, "printer.py", str(lines)])
+  process.register_listener(listener)
+  started = time.perf_counter()
+  process.start()
+  await wait_for(lambda: len(latencies) >= lines, 120)
+  elapsed = time.perf_counter() - started
+  await process.wait_until_done()
+  return {"lines": lines, "seconds": elapsed, "lines_per_second": lines / elapsed, "latency_ms": percentiles(latencies)}
+
+
+# ---------- HTTP / WEBSOCKET ----------
+
+async def start_app(app):
+  import uvicorn
+  with socket.socket() as s:
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+  server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+  task = asyncio.create_task(server.serve())
+  await wait_for(lambda: server.started, 30)
+  return server, task, f"127.0.0.1:{port}"
+
+def bench_encode(messages: int) -> list:
+  # Encoding speed of a console message for each available Serializer backend
+  from libraries.Serializer import Serializer, orjson
+  results = []
+  payloads = [{"console": f"[12:00:00] [Server thread/INFO]: benchmark line {i} äöü"} for i in range(messages)]
+  for fast in ([False, True] if orjson is not None else [False]):
+    Serializer.configure(fast)
+    started = time.perf_counter()
+    for payload in payloads:
+      Serializer.dumps(payload)
+    elapsed = time.perf_counter() - started
+    results.append({"encoder": Serializer.backend(), "messages": messages, "seconds": elapsed, "messages_per_second": messages / elapsed})
+  return results
+
+async def bench_ws_fanout(main, address: str, clients: int, messages: int, mode: str) -> dict:
+  # Time until every client received all messages pushed by the server (mode: json or binary)
+  import aiohttp
+  from libraries.Serializer import Serializer
+  received = [0] * clients
+  expected = messages if mode == "json" else None
+  payloads = [f"[12:00:00] [Server thread/INFO]: benchmark line {i}" for i in range(messages)]
+  expected_bytes = sum(len(p) + 1 for p in payloads)
+  query = "?console=binary" if mode == "binary" else ""
+
+  async with aiohttp.ClientSession() as session:
+    sockets = [await session.ws_connect(f"ws://{address}/ws{query}") for _ in range(clients)]
+    ready = asyncio.Event()
+
+    async def reader(index, ws):
+      await ready.wait()
+      async for msg in ws:
+        if msg.type == aiohttp.WSMsgType.TEXT:
+          data = json.loads(msg.data)
+          if isinstance(data.get("console"), str):
+            received[index] += 1
+        elif msg.type == aiohttp.WSMsgType.BINARY:
+          received[index] += len(msg.data) - 12
+
+    await asyncio.sleep(0.2)   # let the initial history messages pass
+    readers = [asyncio.create_task(reader(i, ws)) for i, ws in enumerate(sockets)]
+    main.sm.console_stream.written = main.sm.console_stream.sent = 0   # start with an empty binary backlog
+    ready.set()
+
+    target = expected if mode == "json" else expected_bytes
+    started = time.perf_counter()
+    if mode == "json":
+      for payload in payloads:
+        await main.forward_to_websockets({"console": payload})
+    else:
+      for payload in payloads:
+        main.sm.console_stream.append(payload.encode() + b"\n")
+    await wait_for(lambda: all(r >= target for r in received), 300)
+    elapsed = time.perf_counter() - started
+
+    for ws in sockets:
+      await ws.close()
+    for task in readers:
+      task.cancel()
+
+  return {"mode": mode, "encoder": Serializer.backend() if mode == "json" else None, "clients": clients, "messages": messages, "seconds": elapsed, "messages_per_second": messages * clients / elapsed}
+
+async def bench_read(main, address: str, sizes: list, repeats: int) -> list:
+  # /server/read (whole buffer) against /server/console (tail page) for growing console buffers
+  import aiohttp
+  from libraries.SubprocessHandler import SubprocessHandler
+  results = []
+  async with aiohttp.ClientSession() as session:
+    for size in sizes:
+      process = SubprocessHandler([sys.executable, "--version"])
+      for i in range(size):
+        process.total_output.append(f"[12:00:00] [Server thread/INFO]: benchmark line {i}")
+      main.sm.server_process = process
+
+      for path, body in (("/server/read", None), ("/server/console", {"tail": 500})):
+        timings = []
+        response_bytes = 0
+        for _ in range(repeats):
+          started = time.perf_counter()
+          async with session.post(f"http://{address}{path}", json=body) as resp:
+            response_bytes = len(await resp.read())
+          timings.append((time.perf_counter() - started) * 1000)
+        results.append({"endpoint": path, "buffer_lines": size, "response_bytes": response_bytes, "ms": percentiles(timings)})
+  main.sm.server_process = None
+  return results
+
+
+# ---------- START / STOP ----------
+
+IDLE_SERVER = """
+import sys
+print("Done! benchmark server ready", flush=True)
+for line in sys.stdin:
+  if line.strip() == "stop":
+    break
+"""
+
+async def bench_start_stop(main, address: str, cycles: int, world_mb: int) -> dict:
+  # End-to-end /server/start and /server/stop against an rclone alias remote on the local filesystem
+  import aiohttp
+  for binary in ("restic", "rclone"):
+    if not os.path.exists(os.path.join(ROOT, "bin", binary, binary)):
+      return {"skipped": f"bin/{binary}/{binary} not found"}
+
+  os.symlink(os.path.join(ROOT, "bin"), "bin")
+  os.makedirs("remote", exist_ok=True)
+  with open("configs/rclone.conf", "w") as f:
+    f.write(f"[bench]\ntype = alias\nremote = {os.path.abspath('remote')}\n")
+
+  world = os.path.join("Servers", "bench")
+  os.makedirs(os.path.join(world, "region"), exist_ok=True)
+  with open(os.path.join(world, "idle.py"), "w") as f:
+    f.write(IDLE_SERVER)
+  for i in range(world_mb):
+    with open(os.path.join(world, "region", f"r.{i}.mca"), "wb") as f:
+      f.write(os.urandom(1024 * 1024))
+
+  results = {"world_mb": world_mb, "start_seconds": [], "stop_seconds": []}
+  async with aiohttp.ClientSession() as session:
+    async def post(path, body=None):
+      async with session.post(f"http://{address}{path}", json=body) as resp:
+        return await resp.json()
+
+    await post("/server/create", {"server_name": "bench", "endpoint": "bench", "start_cmd_win": "", "start_cmd_linux": f"{sys.executable} idle.py", "stop_cmd": "stop", "port": 25565, "env": {}, "commands": []})
+    await post("/config/set", {"client_id": main.config.getClientId(), "endpoint": "bench", "server_name": "bench"})
+
+    for cycle in range(cycles + 1):   # the first cycle only seeds the repository
+      started = time.perf_counter()
+      start_result = await post("/server/start")
+      start_seconds = time.perf_counter() - started
+      started = time.perf_counter()
+      stop_result = await post("/server/stop")
+      stop_seconds = time.perf_counter() - started
+      if "error" in start_result or "error" in stop_result:
+        return {"error": [start_result, stop_result]}
+      if cycle > 0:
+        results["start_seconds"].append(start_seconds)
+        results["stop_seconds"].append(stop_seconds)
+
+  results["start"] = percentiles(results.pop("start_seconds"))
+  results["stop"] = percentiles(results.pop("stop_seconds"))
+  return results
+
+
+# ---------- RUNNER ----------
+
+async def run(args) -> dict:
+  import main
+  results = {}
+  only = set(args.only.split(",")) if args.only else None
+  enabled = lambda name: only is None or name in only
+
+  from libraries.Serializer import Serializer, orjson
+  results["loop"] = type(asyncio.get_running_loop()).__module__.split(".")[0]
+  if enabled("subprocess"):
+    results["subprocess"] = await bench_subprocess(20000 if args.quick else 200000)
+  if enabled("encode"):
+    results["encode"] = bench_encode(20000 if args.quick else 200000)
+
+  server, task, address = await start_app(main.app)
+  try:
+    if enabled("ws_fanout"):
+      results["ws_fanout"] = []
+      for clients in ([1, 10] if args.quick else [1, 10, 50]):
+        for fast in ([False, True] if orjson is not None else [False]):
+          Serializer.configure(fast)
+          results["ws_fanout"].append(await bench_ws_fanout(main, address, clients, 2000 if args.quick else 10000, "json"))
+        results["ws_fanout"].append(await bench_ws_fanout(main, address, clients, 2000 if args.quick else 10000, "binary"))
+    if enabled("read"):
+      results["read"] = await bench_read(main, address, [1000, 10000] if args.quick else [1000, 10000, 50000], 3 if args.quick else 10)
+    if enabled("start_stop"):
+      results["start_stop"] = await bench_start_stop(main, address, 1 if args.quick else 3, 8 if args.quick else 64)
+  finally:
+    server.should_exit = True
+    await task
+  return results
+
+def main_cli():
+  parser = argparse.ArgumentParser(description="CS-System benchmark suite")
+  parser.add_argument("--quick", action="store_true", help="smaller workloads, for a fast smoke run")
+  parser.add_argument("--output", help="also write the JSON results to this file")
+  parser.add_argument("--only", help="comma separated list of benchmarks to run")
+  parser.add_argument("--loop", choices=["asyncio", "uvloop"], default="asyncio", help="event loop to run the benchmarks on")
+  args = parser.parse_args()
+  if args.output:
+    args.output = os.path.abspath(args.output)   # relative to where the script was started, not the work directory below
+  if args.loop == "uvloop":
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+  workdir = tempfile.mkdtemp(prefix="cssystem-bench-")
+  os.chdir(workdir)   # main.py and the libraries work relative to the current directory
+  try:
+    results = asyncio.run(run(args))
+  finally:
+    os.chdir(ROOT)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+  report = {
+    "meta": {"time": time.time(), "python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count(), "quick": args.quick, "loop": args.loop},
+    "results": results
+  }
+  output = json.dumps(report, indent=2)
+  print(output)
+  if args.output:
+    with open(args.output, "w") as f:
+      f.write(output)
+
+if __name__ == "__main__":
+  main_cli()
@@ -0,0 +1,115 @@
+import os
+import glob
+from fnmatch import fnmatchcase
+
+class BackupFilter:
+  # Per-server backup rules from server_config.json ("backup_filter"), turned into restic arguments:
+  #   include: globs relative to the server directory that are backed up instead of everything
+  #   exclude: restic --exclude patterns, without a leading "/" they match at any depth (e.g. "logs" or "*.log"),
+  #            with one they are anchored at the server directory (e.g. "/world/session.lock")
+  #   exclude_if_present: marker file names, a directory containing one is skipped
+  #   max_file_size: files larger than this many bytes are skipped (0 = no limit)
+  def __init__(self, include: list = None, exclude: list = None, exclude_if_present: list = None, max_file_size: int = 0):
+    self.include = include or []
+    self.exclude = exclude or []
+    self.exclude_if_present = exclude_if_present or []
+    self.max_file_size = max_file_size
+
+  @classmethod
+  def from_config(cls, server_config: dict):
+    rules = server_config.get("backup_filter") or {}
+    return cls(rules.get("include"), rules.get("exclude"), rules.get("exclude_if_present"), rules.get("max_file_size", 0))
+
+  def is_empty(self) -> bool:
+    # Without rules a snapshot holds the whole server directory. With rules a restore must not use --delete,
+    # it would remove the local files the rules keep out of the backup.
+    return self.include == [] and self.exclude == [] and self.exclude_if_present == [] and not self.max_file_size
+
+  def targets(self, server_dir: str) -> list:
+    # Backup targets relative to server_dir, "." unless includes are set
+    if self.include == []:
+      return ["."]
+    matches = set()
+    for pattern in self.include:
+      matches.update(os.path.relpath(path, server_dir) for path in glob.glob(os.path.join(glob.escape(server_dir), pattern), recursive=True))
+    return sorted(matches) or ["."]   # nothing matched: back up everything rather than an empty snapshot
+
+  def restic_args(self, server_dir: str) -> list:
+    # restic anchors "/" patterns at the filesystem root, so they get the absolute server directory in front
+    args = []
+    for pattern in self.exclude:
+      args += ["--exclude", os.path.join(os.path.abspath(server_dir), pattern.lstrip("/")) if pattern.startswith("/") else pattern]
+    for marker in self.exclude_if_present:
+      args += ["--exclude-if-present", marker]
+    if self.max_file_size:
+      args += ["--exclude-larger-than", str(self.max_file_size)]
+    return args
+
+  @staticmethod
+  def _matches(pattern: str, parts: list) -> bool:
+    # Approximates restic's matching: anchored patterns match from the top, others against any trailing part of the path
+    pattern_parts = pattern.strip("/").split("/")
+    starts = [0] if pattern.startswith("/") else range(len(parts))
+    for start in starts:
+      candidate = parts[start:start + len(pattern_parts)]
+      if len(candidate) == len(pattern_parts) and all(fnmatchcase(part, glob_part) for part, glob_part in zip(candidate, pattern_parts)):
+        return True
+    return False
+
+  def dry_run(self, server_dir: str) -> dict:
+    # Walks server_dir and reports how many files/bytes each rule keeps out of the backup (blocking, run it in a worker thread).
+    # A file that several rules exclude counts for the first one in the order include, exclude_if_present, exclude, max_file_size.
+    rules = {}
+    def count(rule: str, size: int):
+      entry = rules.setdefault(rule, {"rule": rule, "files": 0, "bytes": 0})
+      entry["files"] += 1
+      entry["bytes"] += size
+
+    included = [os.path.normpath(os.path.join(server_dir, target)) for target in self.targets(server_dir)]
+    total_files, total_bytes, kept_files, kept_bytes = 0, 0, 0, 0
+    for directory, directories, files in os.walk(server_dir):
+      directories.sort()
+      marker = next((name for name in self.exclude_if_present if name in files), None)
+      for name in sorted(files):
+        path = os.path.join(directory, name)
+        try:
+          size = os.lstat(path).st_size
+        except OSError:
+          continue
+        total_files += 1
+        total_bytes += size
+        parts = os.path.relpath(path, server_dir).split(os.sep)
+        if not any(os.path.normpath(path) == target or os.path.normpath(path).startswith(target + os.sep) for target in included):
+          count("include", size)
+        elif marker is not None:
+          count(f"exclude_if_present:{marker}", size)
+        elif (pattern := next((pattern for pattern in self.exclude if any(self._matches(pattern, parts[:end]) for end in range(1, len(parts) + 1))), None)) is not None:
+          count(f"exclude:{pattern}", size)
+        elif self.max_file_size and size > self.max_file_size:
+          count("max_file_size", size)
+        else:
+          kept_files += 1
+          kept_bytes += size
+      if marker is not None:
+        # restic doesn't descend into marked directories, their subdirectories are excluded by the same rule
+        for subdirectory, _, subfiles in os.walk(directory):
+          if subdirectory == directory:
+            continue
+          for name in subfiles:
+            try:
+              size = os.lstat(os.path.join(subdirectory, name)).st_size
+            except OSError:
+              continue
+            total_files += 1
+            total_bytes += size
+            count(f"exclude_if_present:{marker}", size)
+        directories.clear()
+
+    return {
+      "total_files": total_files,
+      "total_bytes": total_bytes,
+      "kept_files": kept_files,
+      "kept_bytes": kept_bytes,
+      "saved_bytes": total_bytes - kept_bytes,
+      "rules": sorted(rules.values(), key=lambda rule: rule["bytes"], reverse=True)
+    }
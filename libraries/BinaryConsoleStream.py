@@ -0,0 +1,96 @@
+import struct
+import asyncio
+import threading
+
+class BinaryConsoleStream:
+  # Raw console output for binary WebSocket clients. Output bytes are kept exactly as the process wrote them in a
+  # memoryview backed ring buffer. Every frame is built once and the same bytes object is sent to all clients.
+  # Frame layout: 8 byte stream offset of the first payload byte (big endian), 4 byte payload length, payload.
+  # The offset doubles as sequence number: a client expecting offset X that receives a larger one knows it missed data.
+  HEADER = struct.Struct(">QI")
+  MAX_FRAME_PAYLOAD = 256 * 1024
+
+  def __init__(self, capacity: int = 4 * 1024 * 1024):
+    self.capacity = capacity
+    self._buffer = bytearray(capacity)
+    self._view = memoryview(self._buffer)
+    self.written = 0   # stream offset of the next byte appended
+    self.sent = 0   # stream offset up to which frames were broadcast
+    self.clients = {}
+    self.loop = None
+    self._lock = threading.Lock()
+    self._flushing = False
+
+  def append(self, data: bytes):
+    # Called from the stdout reader thread with the raw line bytes.
+    with self._lock:
+      if len(data) > self.capacity:
+        self.written += len(data) - self.capacity
+        data = data[-self.capacity:]
+      position = self.written % self.capacity
+      first = min(len(data), self.capacity - position)
+      self._view[position:position + first] = data[:first]
+      self._view[:len(data) - first] = data[first:]
+      self.written += len(data)
+
+      if self._flushing or self.loop is None or not self.clients:
+        return
+      self._flushing = True
+    self.loop.call_soon_threadsafe(asyncio.ensure_future, self._flush())
+
+  def _frame(self, start: int, end: int) -> bytes:
+    # Needs self._lock; start must still be inside the ring buffer
+    position = start % self.capacity
+    length = end - start
+    if position + length <= self.capacity:
+      parts = (self._view[position:position + length],)
+    else:
+      parts = (self._view[position:], self._view[:length - (self.capacity - position)])
+    return b"".join((self.HEADER.pack(start, length), *parts))
+
+  def _next_frame(self, start: int, end: int):
+    start = max(start, self.written - self.capacity)   # older bytes were overwritten
+    if start >= end:
+      return None, end
+    stop = min(end, start + self.MAX_FRAME_PAYLOAD)
+    return self._frame(start, stop), stop
+
+  async def _flush(self):
+    try:
+      while True:
+        with self._lock:
+          frame, self.sent = self._next_frame(self.sent, self.written)
+          if frame is None:
+            self._flushing = False   # under the lock, an append right after this schedules the next flush
+            return
+          clients = list(self.clients.items())
+        for ws_id, websocket in clients:
+          try:
+            await websocket.send_bytes(frame)
+          except Exception:
+            self.clients.pop(ws_id, None)
+    except BaseException:
+      # Cancelled or failed: without the reset no flush would ever be scheduled again
+      with self._lock:
+        self._flushing = False
+      raise
+
+  async def attach(self, ws_id, websocket):
+    # Sends what is still in the ring buffer, then adds the client to the broadcast without a gap in between.
+    self.loop = asyncio.get_running_loop()
+    position = 0
+    while True:
+      with self._lock:
+        frame, position = self._next_frame(position, self.sent)
+        if frame is None:
+          self.clients[ws_id] = websocket
+          pending = self.written > self.sent and not self._flushing
+          if pending:
+            self._flushing = True
+          break
+      await websocket.send_bytes(frame)
+    if pending:
+      await self._flush()
+
+  def detach(self, ws_id):
+    self.clients.pop(ws_id, None)
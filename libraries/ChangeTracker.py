@@ -0,0 +1,138 @@
+import os
+import sys
+import ctypes
+import ctypes.util
+import struct
+import select
+import threading
+
+class ChangeTracker:
+  # Records which paths below root change while a server runs (Linux inotify, one watch per directory).
+  # If the kernel event queue overflows or a watch can't be added, the recorded changes are incomplete
+  # and the next backup has to scan everything again.
+  IN_MODIFY = 0x2
+  IN_ATTRIB = 0x4
+  IN_CLOSE_WRITE = 0x8
+  IN_MOVED_FROM = 0x40
+  IN_MOVED_TO = 0x80
+  IN_CREATE = 0x100
+  IN_DELETE = 0x200
+  IN_DELETE_SELF = 0x400
+  IN_Q_OVERFLOW = 0x4000
+  IN_IGNORED = 0x8000
+  IN_ISDIR = 0x40000000
+  IN_NONBLOCK = 0x800
+  IN_CLOEXEC = 0x80000
+  WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+  EVENT_HEADER = struct.Struct("iIII")   # wd, mask, cookie, length of the name that follows
+
+  def __init__(self, root: str):
+    self.root = os.path.abspath(root)
+    self.changed = set()   # paths relative to root
+    self.incomplete = False
+    self.watches = {}   # watch descriptor -> absolute directory path
+    self._lock = threading.Lock()
+    self._fd = None
+    self._libc = None
+    self._thread = None
+    self._running = False
+
+  @staticmethod
+  def supported() -> bool:
+    return sys.platform.startswith("linux")
+
+  def start(self) -> bool:
+    # Blocking (walks the whole tree to add the watches), run it in a worker thread. Returns False if inotify isn't usable.
+    if not self.supported():
+      return False
+    self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+    if fd < 0:
+      return False
+    self._fd = fd
+    self._watch_tree(self.root)
+    self._running = True
+    self._thread = threading.Thread(target=self._read_events, daemon=True)
+    self._thread.start()
+    return True
+
+  def stop(self):
+    self._running = False
+    if self._thread is not None:
+      self._thread.join()
+      self._thread = None
+    if self._fd is not None:
+      os.close(self._fd)
+      self._fd = None
+    self.watches.clear()
+
+  def _add_watch(self, path: str):
+    wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), self.WATCH_MASK)
+    if wd < 0:
+      self.incomplete = True   # usually fs.inotify.max_user_watches reached
+    else:
+      self.watches[wd] = path
+
+  def _watch_tree(self, path: str, mark_changed: bool = False):
+    # mark_changed is used for directories that appeared while running, their files may predate the watch
+    for directory, _, files in os.walk(path):
+      self._add_watch(directory)
+      if mark_changed:
+        with self._lock:
+          self.changed.add(os.path.relpath(directory, self.root))
+          self.changed.update(os.path.relpath(os.path.join(directory, name), self.root) for name in files)
+
+  def _read_events(self):
+    while self._running:
+      ready, _, _ = select.select([self._fd], [], [], 0.5)
+      if not ready:
+        continue
+      try:
+        data = os.read(self._fd, 256 * 1024)
+      except BlockingIOError:
+        continue
+      offset = 0
+      while offset < len(data):
+        wd, mask, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+        offset += self.EVENT_HEADER.size
+        name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+        offset += length
+        self._handle_event(wd, mask, name)
+
+  def _handle_event(self, wd: int, mask: int, name: str):
+    if mask & self.IN_Q_OVERFLOW:
+      self.incomplete = True
+      return
+    if mask & self.IN_IGNORED:
+      self.watches.pop(wd, None)
+      return
+    directory = self.watches.get(wd)
+    if directory is None:
+      return
+    path = os.path.join(directory, name) if name else directory
+    if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+      self._watch_tree(path, mark_changed=True)
+      return
+    if mask & self.IN_ISDIR and mask & self.IN_MOVED_FROM:
+      self.incomplete = True   # the watches below it still carry the old path
+    with self._lock:
+      self.changed.add(os.path.relpath(path, self.root))
+
+  def has_changes(self) -> bool:
+    return self.incomplete or self.changed != set()
+
+  def take(self) -> tuple[set, bool]:
+    # Hands the changes since the last take() to a backup and starts recording from scratch
+    with self._lock:
+      changes, incomplete = self.changed, self.incomplete
+      self.changed, self.incomplete = set(), False
+    return changes, incomplete
+
+  def put_back(self, changes: set, incomplete: bool):
+    # For a backup that failed, its changes still have to go into the next one
+    with self._lock:
+      self.changed |= changes
+      self.incomplete = self.incomplete or incomplete
+
+  def get_status(self) -> dict:
+    return {"root": self.root, "running": self._running, "watches": len(self.watches), "changed": len(self.changed), "incomplete": self.incomplete}
@@ -17,10 +17,13 @@ class ConfigManager:
     self.client_id = config_json["client_id"]
     self.endpoint = config_json["endpoint"]
     self.server_name = config_json["server_name"]
+    self.standby_enabled = config_json.get("standby_enabled", False)
+    self.standby_interval = config_json.get("standby_interval", 300)
+    self.fast_runtime = config_json.get("fast_runtime", True)   # uvloop + orjson when installed, read once at startup
 
   def _save_config(self):
     with open("./configs/client_config.json", "w") as f:
-      f.write(json.dumps({"client_id": self.client_id, "endpoint": self.endpoint, "server_name": self.server_name}))
+      f.write(json.dumps({"client_id": self.client_id, "endpoint": self.endpoint, "server_name": self.server_name, "standby_enabled": self.standby_enabled, "standby_interval": self.standby_interval, "fast_runtime": self.fast_runtime}))
 
   def getClientId(self):
     return self.client_id
@@ -31,6 +34,21 @@ class ConfigManager:
   def getServerName(self):
     return self.server_name
 
+  def getStandby(self):
+    return self.standby_enabled, self.standby_interval
+
+  def setStandby(self, enabled: bool, interval: int):
+    self.standby_enabled = enabled
+    self.standby_interval = interval
+    self._save_config()
+
+  def getFastRuntime(self):
+    return self.fast_runtime
+
+  def setFastRuntime(self, enabled: bool):
+    self.fast_runtime = enabled
+    self._save_config()
+
   def setClientId(self, client_id):
     self.client_id = client_id
     self._save_config()
@@ -0,0 +1,94 @@
+import re
+
+from .Serializer import Serializer
+
+class ConsoleBuffer:
+  # Keeps console lines in memory together with a running sequence number, so clients can page through the history.
+  # Past max_lines the oldest lines are only skipped by moving self.head and are deleted in chunks of trim_lines,
+  # deleting from the front of the list on every append would move the whole list each time.
+  def __init__(self, max_lines: int = 0):
+    self.max_lines = max_lines   # 0 = keep everything
+    self.trim_lines = max(max_lines // 4, 1)
+    self.lines = []
+    self.head = 0   # index of the oldest kept line in self.lines
+    self.first_seq = 0   # sequence number of self.lines[self.head]
+
+  def append(self, line: str) -> int:
+    self.lines.append(line)
+    if self.max_lines and len(self.lines) - self.head > self.max_lines:
+      self.head += 1
+      self.first_seq += 1
+      if self.head >= self.trim_lines:
+        del self.lines[:self.head]
+        self.head = 0
+    return self.next_seq() - 1
+
+  def __len__(self) -> int:
+    return len(self.lines) - self.head
+
+  def next_seq(self) -> int:
+    return self.first_seq + len(self)
+
+  def text(self) -> str:
+    return "".join(line + "\n" for line in self.lines[self.head:])
+
+  def _bounds(self, since_seq: int = None, before_seq: int = None) -> tuple:
+    # Translates sequence numbers into list indices of self.lines
+    start = self.head if since_seq is None else self.head + max(since_seq - self.first_seq, 0)
+    end = len(self.lines) if before_seq is None else self.head + max(min(before_seq - self.first_seq, len(self)), 0)
+    return start, max(start, end)
+
+  @staticmethod
+  def _matcher(pattern: str = None, regex: bool = False, ignore_case: bool = False):
+    if not pattern:
+      return None
+    if regex:
+      return re.compile(pattern, re.IGNORECASE if ignore_case else 0).search
+    if ignore_case:
+      pattern = pattern.lower()
+      return lambda line: pattern in line.lower()
+    return lambda line: pattern in line
+
+  def query(self, offset: int = 0, limit: int = None, since_seq: int = None, before_seq: int = None, tail: int = None, pattern: str = None, regex: bool = False, ignore_case: bool = False) -> dict:
+    # Returns the lines in [since_seq, before_seq), filtered by pattern, then cut down by tail or offset/limit (raises re.error on invalid regex)
+    start, end = self._bounds(since_seq, before_seq)
+    match = self._matcher(pattern, regex, ignore_case)
+
+    offset_seq = self.first_seq - self.head   # seq = index + offset_seq
+    if match is None:
+      seqs = range(start + offset_seq, end + offset_seq)
+    else:
+      seqs = [i + offset_seq for i in range(start, end) if match(self.lines[i])]
+
+    matched = len(seqs)
+    if tail is not None:
+      seqs = seqs[max(matched - tail, 0):]
+    else:
+      seqs = seqs[offset:] if limit is None else seqs[offset:offset + limit]
+
+    return {
+      "lines": [{"seq": seq, "line": self.lines[seq - offset_seq]} for seq in seqs],
+      "matched": matched,
+      "first_seq": self.first_seq,
+      "next_seq": self.next_seq()
+    }
+
+  def iter_ndjson(self, since_seq: int = None, before_seq: int = None, pattern: str = None, regex: bool = False, ignore_case: bool = False, chunk_lines: int = 1000):
+    # Yields the matching lines as newline delimited JSON, chunk_lines records per chunk.
+    # The range is fixed at call time, so lines appended during the export are not included.
+    start, end = self._bounds(since_seq, before_seq)
+    offset_seq = self.first_seq - self.head
+    match = self._matcher(pattern, regex, ignore_case)
+    chunk = []
+    for seq in range(start + offset_seq, end + offset_seq):
+      index = seq - self.first_seq + self.head
+      if index < self.head:   # already dropped by max_lines
+        continue
+      line = self.lines[index]
+      if match is None or match(line):
+        chunk.append(Serializer.dumps({"seq": seq, "line": line}) + "\n")
+        if len(chunk) >= chunk_lines:
+          yield "".join(chunk)
+          chunk = []
+    if chunk:
+      yield "".join(chunk)
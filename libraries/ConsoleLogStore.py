@@ -0,0 +1,225 @@
+import os
+import re
+import gzip
+import json
+import time
+import asyncio
+import threading
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+from .LogHelper import LogHelper
+
+
+def _search_segment(path: str, pattern: str, regex: bool, ignore_case: bool, start_line: int, end_line: int, limit: int) -> list:
+  # Runs inside a worker process, so it has to stay a plain module level function.
+  if regex:
+    search = re.compile(pattern, re.IGNORECASE if ignore_case else 0).search
+  elif ignore_case:
+    lowered = pattern.lower()
+    search = lambda line: lowered in line.lower()
+  else:
+    search = lambda line: pattern in line
+
+  matches = []
+  try:
+    with gzip.open(path, "rt", encoding="utf-8", errors="replace") as f:
+      for line_no, line in enumerate(f):
+        if line_no < start_line:
+          continue
+        if end_line is not None and line_no >= end_line:
+          break
+        line = line.rstrip("\n")
+        if search(line):
+          matches.append((line_no, line))
+          if limit and len(matches) >= limit:
+            break
+  except (EOFError, OSError):
+    pass   # segment still being written (no end-of-stream marker yet) or truncated by a crash
+  return matches
+
+
+class ConsoleLogStore:
+  # Writes the console of every server run into gzip compressed, rotated segment files under ./logs/servers/<name>/
+  # index.json maps run ids to their segments and keeps (timestamp, line) marks per segment for time based lookups.
+  BASE_DIR = "./logs/servers"
+  _pool = None
+
+  def __init__(self, server_name: str, segment_bytes: int = 8 * 1024 * 1024, max_segments: int = 200, mark_lines: int = 1000, mark_seconds: float = 60):
+    self.server_name = server_name
+    self.directory = os.path.join(self.BASE_DIR, server_name)
+    self.index_path = os.path.join(self.directory, "index.json")
+    self.segment_bytes = segment_bytes   # uncompressed bytes per segment before rotating
+    self.max_segments = max_segments
+    self.mark_lines = mark_lines
+    self.mark_seconds = mark_seconds
+    self.run_id = None
+    self._file = None
+    self._segment = None
+    self._segment_written = 0
+    self._lock = threading.Lock()
+    self.logger = LogHelper()
+    os.makedirs(self.directory, exist_ok=True)
+    self.index = self._load_index()
+
+  def _load_index(self) -> dict:
+    try:
+      with open(self.index_path, "r") as f:
+        return json.loads(f.read())
+    except (FileNotFoundError, json.JSONDecodeError):
+      return {"runs": {}, "segments": {}}
+
+  def _save_index(self):
+    tmp_path = self.index_path + ".tmp"
+    with open(tmp_path, "w") as f:
+      f.write(json.dumps(self.index))
+    os.replace(tmp_path, self.index_path)
+
+  def start_run(self) -> str:
+    # Starts a new run (one server process lifetime) and returns its id
+    with self._lock:
+      if self.run_id is not None:
+        self.index["runs"][self.run_id]["end"] = time.time()
+      self._close_segment()
+      base_id = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+      self.run_id = base_id
+      suffix = 1
+      while self.run_id in self.index["runs"]:   # two runs started within the same second
+        suffix += 1
+        self.run_id = f"{base_id}-{suffix}"
+      self.index["runs"][self.run_id] = {"start": time.time(), "end": None, "segments": [], "next_segment": 0}
+      self._open_segment()
+      self._save_index()
+    return self.run_id
+
+  def _open_segment(self):
+    run = self.index["runs"][self.run_id]
+    number = run["next_segment"]
+    run["next_segment"] += 1
+    self._segment = f"{self.run_id}_{number:04d}.log.gz"
+    self._file = gzip.open(os.path.join(self.directory, self._segment), "wt", encoding="utf-8")
+    self._segment_written = 0
+    now = time.time()
+    self.index["segments"][self._segment] = {"run_id": self.run_id, "start": now, "end": now, "lines": 0, "marks": [[now, 0]]}
+    run["segments"].append(self._segment)
+
+  def _close_segment(self):
+    if self._file is None:
+      return
+    self._file.close()
+    self._file = None
+    self._segment = None
+    self._rotate_out_old_segments()
+
+  def _rotate_out_old_segments(self):
+    segments = sorted(self.index["segments"].items(), key=lambda item: item[1]["start"])
+    for name, segment in segments[:max(len(segments) - self.max_segments, 0)]:
+      try:
+        os.remove(os.path.join(self.directory, name))
+      except FileNotFoundError:
+        pass
+      del self.index["segments"][name]
+      run = self.index["runs"].get(segment["run_id"])
+      if run is not None:
+        run["segments"].remove(name)
+        if not run["segments"] and run["end"] is not None:
+          del self.index["runs"][segment["run_id"]]
+
+  def write(self, line: str):
+    # Called from the stdout reader thread of the server process, so it never touches the event loop.
+    with self._lock:
+      if self._file is None:
+        return
+      self._file.write(line + "\n")
+      self._segment_written += len(line) + 1
+
+      now = time.time()
+      segment = self.index["segments"][self._segment]
+      segment["lines"] += 1
+      segment["end"] = now
+      last_mark = segment["marks"][-1]
+      if segment["lines"] - last_mark[1] >= self.mark_lines or now - last_mark[0] >= self.mark_seconds:
+        segment["marks"].append([now, segment["lines"]])
+
+      if self._segment_written >= self.segment_bytes:
+        self._close_segment()
+        self._open_segment()
+        self._save_index()
+
+  def flush(self):
+    # Makes everything written so far readable for searches
+    with self._lock:
+      if self._file is not None:
+        self._file.flush()
+      self._save_index()
+
+  def close(self):
+    with self._lock:
+      if self.run_id is not None and self.run_id in self.index["runs"]:
+        self.index["runs"][self.run_id]["end"] = time.time()
+      self._close_segment()
+      self._save_index()
+      self.run_id = None
+
+  def get_runs(self) -> list:
+    # The reader thread changes the index while writing, so everything is copied under the lock
+    with self._lock:
+      return [{"run_id": run_id, **run, "segments": list(run["segments"])} for run_id, run in sorted(self.index["runs"].items())]
+
+  @staticmethod
+  def _line_range(segment: dict, since: float = None, until: float = None) -> tuple:
+    # Uses the timestamp marks to narrow down which lines of a segment have to be scanned
+    start_line, end_line = 0, None
+    for mark_time, mark_line in segment["marks"]:
+      if since is not None and mark_time <= since:
+        start_line = mark_line
+      if until is not None and mark_time > until:
+        end_line = mark_line
+        break
+    return start_line, end_line
+
+  @classmethod
+  def _get_pool(cls) -> ProcessPoolExecutor:
+    # Spawned, not forked: a fork would copy the event loop, the reader threads and their held locks into the workers.
+    # The workers keep the working directory they started in, so they get absolute paths.
+    if cls._pool is None:
+      cls._pool = ProcessPoolExecutor(max_workers=max((os.cpu_count() or 2) - 1, 1), mp_context=multiprocessing.get_context("spawn"))
+    return cls._pool
+
+  @classmethod
+  def shutdown_pool(cls):
+    # Called on app shutdown, the search workers would otherwise outlive uvicorn
+    if cls._pool is not None:
+      cls._pool.shutdown(wait=False, cancel_futures=True)
+      cls._pool = None
+
+  async def search(self, pattern: str, regex: bool = False, ignore_case: bool = False, run_id: str = None, since: float = None, until: float = None, limit: int = 1000) -> list:
+    # Scans all matching segments in parallel worker processes (raises re.error on invalid regex)
+    if regex:
+      re.compile(pattern)
+    await self.logger.passLog(2, f"Searching console logs of '{self.server_name}' for '{pattern}'.")
+
+    with self._lock:   # snapshot of the segments, the reader thread adds, rotates and deletes them meanwhile
+      segments = [(name, {**segment, "marks": list(segment["marks"])}) for name, segment in self.index["segments"].items()]
+    jobs = []
+    for name, segment in sorted(segments, key=lambda item: item[1]["start"]):
+      if run_id is not None and segment["run_id"] != run_id:
+        continue
+      if (since is not None and segment["end"] < since) or (until is not None and segment["start"] > until):
+        continue
+      start_line, end_line = self._line_range(segment, since, until)
+      jobs.append((name, segment["run_id"], start_line, end_line))
+
+    loop = asyncio.get_running_loop()
+    pool = self._get_pool()
+    results = await asyncio.gather(*[
+      loop.run_in_executor(pool, _search_segment, os.path.abspath(os.path.join(self.directory, name)), pattern, regex, ignore_case, start_line, end_line, limit)
+      for name, _, start_line, end_line in jobs
+    ])
+
+    matches = []
+    for (name, segment_run_id, _, _), segment_matches in zip(jobs, results):
+      for line_no, line in segment_matches:
+        matches.append({"run_id": segment_run_id, "segment": name, "line_no": line_no, "line": line})
+    return matches[:limit] if limit else matches
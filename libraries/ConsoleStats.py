@@ -0,0 +1,120 @@
+import re
+import time
+import asyncio
+import threading
+from collections import deque
+
+class ConsoleStats:
+  # Turns console lines into live stats with per-server rules from server_config.json ("console_stats"). Rule types:
+  #   counter:    counts matching lines (total and per minute), e.g. errors or tick lag warnings
+  #   gauge:      stores the number in capture group "group" (name or index, default 1), e.g. TPS
+  #   set_add / set_remove: adds/removes the captured text to/from a set, e.g. online players (the count is the gauge)
+  # "contains" is an optional literal that must appear in the line before the regex runs, a cheap filter for busy consoles.
+  # Rules are compiled once; process_line() runs in the reader thread of the server process.
+  DEFAULT_RULES = [   # vanilla/Paper style Minecraft logs, used when a server has no rules configured
+    {"name": "players", "type": "set_add", "contains": "joined the game", "pattern": r"\]: (\w+) joined the game"},
+    {"name": "players", "type": "set_remove", "contains": "left the game", "pattern": r"\]: (\w+) left the game"},
+    {"name": "tps", "type": "gauge", "contains": "TPS from last", "pattern": r"TPS from last 1m, 5m, 15m: \D*([\d.]+)"},
+    {"name": "tick_lag", "type": "counter", "contains": "Can't keep up", "pattern": r"Can't keep up!"},
+    {"name": "errors", "type": "counter", "contains": "ERROR", "pattern": r"/ERROR\]|\[ERROR\]"},
+    {"name": "warnings", "type": "counter", "contains": "WARN", "pattern": r"/WARN\]|\[WARN\]"}
+  ]
+  TYPES = {"counter", "gauge", "set_add", "set_remove"}
+  RATE_WINDOW = 60
+
+  def __init__(self, rules: list = None):
+    self.rules = self.compile(self.DEFAULT_RULES if rules is None else rules)
+    self._lock = threading.Lock()
+    self.version = 0   # bumped on every change, the push loop only sends when it moved
+    self._task = None
+    self.reset()
+
+  @classmethod
+  def compile(cls, rules: list) -> list:
+    # Raises re.error for invalid patterns and ValueError for unknown types and for gauge/set groups the pattern doesn't have
+    compiled = []
+    for rule in rules:
+      if rule["type"] not in cls.TYPES:
+        raise ValueError(f"unknown rule type '{rule['type']}'")
+      group = rule.get("group", 1)
+      if group is None:
+        group = 1   # the API sends null for an omitted group
+      group = int(group) if str(group).isdigit() else group
+      pattern = re.compile(rule["pattern"])
+      if rule["type"] != "counter" and ((group > pattern.groups) if isinstance(group, int) else (group not in pattern.groupindex)):
+        raise ValueError(f"pattern of rule '{rule['name']}' has no group '{group}'")
+      compiled.append((rule["name"], rule["type"], rule.get("contains") or None, pattern, group))
+    return compiled
+
+  def reset(self):
+    self.counters = {name: {"total": 0, "events": deque()} for name, kind, *_ in self.rules if kind == "counter"}
+    self.gauges = {name: {"value": None, "updated": None} for name, kind, *_ in self.rules if kind == "gauge"}
+    self.sets = {name: set() for name, kind, *_ in self.rules if kind in ("set_add", "set_remove")}
+    self.version += 1
+
+  def clear_sets(self):
+    # After a restart nobody is connected anymore
+    with self._lock:
+      for members in self.sets.values():
+        members.clear()
+      self.version += 1
+
+  def process_line(self, line: str):
+    for name, kind, contains, pattern, group in self.rules:
+      if contains is not None and contains not in line:
+        continue
+      match = pattern.search(line)
+      if match is None:
+        continue
+      with self._lock:
+        if kind == "counter":
+          counter = self.counters[name]
+          now = time.time()
+          counter["total"] += 1
+          counter["events"].append(now)
+          while now - counter["events"][0] > self.RATE_WINDOW:
+            counter["events"].popleft()
+        elif kind == "gauge":
+          try:
+            self.gauges[name] = {"value": float(match.group(group)), "updated": time.time()}
+          except (IndexError, TypeError, ValueError):
+            continue
+        elif kind == "set_add":
+          self.sets[name].add(match.group(group))
+        else:
+          self.sets[name].discard(match.group(group))
+        self.version += 1
+
+  def snapshot(self) -> dict:
+    now = time.time()
+    with self._lock:
+      counters = {}
+      for name, counter in self.counters.items():
+        events = counter["events"]
+        while events and now - events[0] > self.RATE_WINDOW:
+          events.popleft()
+        counters[name] = {"total": counter["total"], "per_minute": len(events) * 60 / self.RATE_WINDOW}
+      return {
+        "counters": counters,
+        "gauges": {name: dict(gauge) for name, gauge in self.gauges.items()},
+        "sets": {name: {"count": len(members), "members": sorted(members)} for name, members in self.sets.items()},
+        "time": now
+      }
+
+  def start_push(self, callback_function, interval: float = 2):
+    # Pushes {"stats": ...} at most every interval seconds, and only when something changed
+    if self._task is None and callback_function is not None:
+      self._task = asyncio.create_task(self._push(callback_function, interval))
+
+  def stop_push(self):
+    if self._task is not None:
+      self._task.cancel()
+      self._task = None
+
+  async def _push(self, callback_function, interval: float):
+    sent = None
+    while True:
+      await asyncio.sleep(interval)
+      if self.version != sent or any(counter["events"] for counter in self.counters.values()):   # rates decay without new lines
+        sent = self.version
+        await callback_function({"stats": self.snapshot()})
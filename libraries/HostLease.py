@@ -0,0 +1,127 @@
+import json
+import time
+import asyncio
+import secrets
+
+from .LogHelper import LogHelper
+
+class HostLease:
+  # Lease on hosting a server, stored as /cssystem/<name>/lease.json on the remote.
+  # The host renews it on a timer; if the host dies the lease expires and another client can take over.
+  # Remotes have no atomic compare-and-set, so acquiring writes a lease with a random nonce, waits settle_seconds
+  # for a racing writer to land and reads it back: only the client whose nonce survived owns the lease.
+  def __init__(self, restic, server_name: str, client_id: str, ttl: float = 30, settle_seconds: float = 2, on_lost=None):
+    self.restic = restic
+    self.server_name = server_name
+    self.client_id = client_id
+    self.ttl = ttl
+    self.settle_seconds = settle_seconds
+    self.clock_skew = 5   # seconds of clock difference between clients that are tolerated
+    self.on_lost = on_lost   # called (may be async) when another client took the lease over
+    self.remote_path = f"/cssystem/{server_name}/lease.json"
+    self.lease = None
+    self.lost = False
+    self._task = None
+    self.logger = LogHelper()
+
+  async def read(self):
+    content = await asyncio.to_thread(self.restic.readRemoteFile, self.remote_path)
+    if not content:
+      return None
+    try:
+      return json.loads(content)
+    except json.JSONDecodeError:
+      return None
+
+  async def _write(self, lease: dict) -> bool:
+    return await asyncio.to_thread(self.restic.writeRemoteFile, self.remote_path, json.dumps(lease))
+
+  def is_expired(self, lease: dict) -> bool:
+    return time.time() > lease["expires"] + self.clock_skew
+
+  async def acquire(self, force: bool = False) -> bool:
+    # Compare-and-set: only succeeds if nobody else holds an unexpired lease (force skips that check)
+    current = await self.read()
+    if not force and current is not None and current["client_id"] != self.client_id and not self.is_expired(current):
+      return False
+    now = time.time()
+    lease = {
+      "client_id": self.client_id,
+      "nonce": secrets.token_hex(8),
+      "generation": (current or {}).get("generation", 0) + 1,
+      "acquired": now,
+      "renewed": now,
+      "expires": now + self.ttl
+    }
+    if not await self._write(lease):
+      return False
+    await asyncio.sleep(self.settle_seconds)
+    confirmed = await self.read()
+    if confirmed is None or confirmed.get("nonce") != lease["nonce"]:
+      await self.logger.passLog(1, f"Lost the race for the lease of '{self.server_name}'.")
+      return False
+    self.lease = lease
+    self.lost = False
+    await self.logger.passLog(2, f"Acquired lease for '{self.server_name}' (generation {lease['generation']}).")
+    return True
+
+  async def renew(self) -> bool:
+    # Returns False once the lease is lost: taken over, never acquired, or expired because renewals kept failing
+    if self.lease is None:
+      self.lost = True
+      await self.logger.passLog(0, f"No lease held for '{self.server_name}', nothing to renew.")
+      return False
+    current = await self.read()
+    if current is not None and current.get("nonce") != self.lease["nonce"]:
+      self.lost = True
+      await self.logger.passLog(0, f"Lease for '{self.server_name}' was taken over by client '{current['client_id']}'.")
+      return False
+    now = time.time()
+    renewed = {**self.lease, "renewed": now, "expires": now + self.ttl}
+    if not await self._write(renewed):
+      if now > self.lease["expires"]:
+        self.lost = True   # other clients may take over from here on
+        await self.logger.passLog(0, f"Lease for '{self.server_name}' expired, renewing failed since {self.lease['renewed']:.0f}.")
+        return False
+      await self.logger.passLog(1, f"Failed to renew lease for '{self.server_name}'.")
+      return True
+    self.lease = renewed
+    return True
+
+  def start_heartbeat(self):
+    if self._task is None:
+      self._task = asyncio.create_task(self._heartbeat())
+
+  async def _heartbeat(self):
+    while not self.lost:
+      await asyncio.sleep(self.ttl / 3)
+      try:
+        await self.renew()
+      except Exception as e:
+        await self.logger.passLog(0, f"Lease heartbeat for '{self.server_name}' failed: {str(e)}")
+    if self.on_lost is not None:
+      result = self.on_lost()
+      if asyncio.iscoroutine(result):
+        await result
+
+  async def release(self):
+    # Stops the heartbeat and lets the lease expire right away, if it is still ours
+    if self._task is not None:
+      self._task.cancel()
+      self._task = None
+    if self.lease is None or self.lost:
+      return
+    current = await self.read()
+    if current is None or current.get("nonce") == self.lease["nonce"]:
+      self.lease.update(renewed=time.time(), expires=0)
+      await self._write(self.lease)
+    self.lease = None
+
+  async def get_status(self) -> dict:
+    current = await self.read()
+    return {
+      "lease": current,
+      "expired": current is not None and self.is_expired(current),
+      "held_by_this_client": self.lease is not None and not self.lost,
+      "lost": self.lost
+    }
@@ -0,0 +1,82 @@
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from collections import deque
+
+from .LogHelper import LogHelper
+
+class LoopMonitor:
+  # Measures how late the event loop wakes up from a short sleep (scheduling delay) and keeps the recent samples.
+  # A watchdog thread notices stalls longer than slow_threshold while they happen and grabs the stack of the
+  # event loop thread, so blocking calls (subprocess.run, file I/O, ...) show up in the log with their location.
+  def __init__(self, interval: float = 0.1, slow_threshold: float = 0.25, max_samples: int = 3000):
+    self.interval = interval
+    self.slow_threshold = slow_threshold
+    self.samples = deque(maxlen=max_samples)   # (timestamp, lag in seconds)
+    self.slow_events = deque(maxlen=100)
+    self.logger = LogHelper()
+    self._heartbeat = time.perf_counter()
+    self._loop_thread_id = None
+    self._task = None
+    self._watchdog = None
+    self._running = False
+
+  def start(self):
+    if self._task is not None:
+      return
+    self._loop_thread_id = threading.get_ident()
+    self._running = True
+    self._heartbeat = time.perf_counter()
+    self._task = asyncio.create_task(self._sample())
+    self._watchdog = threading.Thread(target=self._watch, daemon=True)
+    self._watchdog.start()
+
+  def stop(self):
+    self._running = False
+    if self._task is not None:
+      self._task.cancel()
+      self._task = None
+
+  async def _sample(self):
+    while True:
+      started = time.perf_counter()
+      await asyncio.sleep(self.interval)
+      now = time.perf_counter()
+      self._heartbeat = now
+      lag = now - started - self.interval
+      self.samples.append((time.time(), lag))
+      if lag >= self.slow_threshold:
+        event = self.slow_events[-1] if self.slow_events and self.slow_events[-1]["lag_ms"] is None else None
+        if event is not None:
+          event["lag_ms"] = lag * 1000
+          where = event["stack"][-1].strip() if event["stack"] else "unknown"
+        else:
+          where = "unknown (stall ended before the watchdog saw it)"
+          self.slow_events.append({"time": time.time(), "lag_ms": lag * 1000, "stack": []})
+        await self.logger.passLog(1, f"Event loop was blocked for {lag * 1000:.0f} ms, last seen at: {where}")
+
+  def _watch(self):
+    # Runs in its own thread, so it keeps working while the event loop is blocked
+    reported = None
+    while self._running:
+      time.sleep(self.interval / 2)
+      heartbeat = self._heartbeat
+      if time.perf_counter() - heartbeat > self.interval + self.slow_threshold and reported != heartbeat:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = traceback.format_stack(frame)[-15:] if frame is not None else []
+        self.slow_events.append({"time": time.time(), "lag_ms": None, "stack": stack})   # lag_ms is filled in once the loop runs again
+        reported = heartbeat
+
+  def get_stats(self, seconds: float = 60) -> dict:
+    since = time.time() - seconds
+    lags = sorted(lag * 1000 for timestamp, lag in self.samples if timestamp >= since)
+    pick = lambda p: lags[min(int(len(lags) * p), len(lags) - 1)] if lags else None
+    return {
+      "window_seconds": seconds,
+      "samples": len(lags),
+      "lag_ms": {"p50": pick(0.50), "p90": pick(0.90), "p99": pick(0.99), "max": lags[-1] if lags else None},
+      "slow_threshold_ms": self.slow_threshold * 1000,
+      "slow_events": list(self.slow_events)[-20:]
+    }
@@ -0,0 +1,248 @@
+import time
+import socket
+import asyncio
+from collections import deque
+
+from .LogHelper import LogHelper
+
+class _UdpSession(asyncio.DatagramProtocol):
+  # One client address on the listening side, talking to the target through its own connected socket
+  def __init__(self, forwarder, client_addr):
+    self.forwarder = forwarder
+    self.client_addr = client_addr
+    self.transport = None
+    self.pending = []   # datagrams that arrived before the target socket was ready, None once flushed
+    self.stats = {"protocol": "udp", "client": f"{client_addr[0]}:{client_addr[1]}", "opened": time.time(), "last_active": time.time(), "first_reply_ms": None, "bytes_in": 0, "bytes_out": 0, "packets_in": 0, "packets_out": 0}
+
+  def connection_made(self, transport):
+    self.transport = transport
+
+  def datagram_received(self, data, addr):
+    # Reply from the target -> back to the client through the listening socket
+    listener = self.forwarder._udp_listener
+    if listener is None:
+      return   # forwarder is shutting down
+    now = time.time()
+    if self.stats["first_reply_ms"] is None:
+      self.stats["first_reply_ms"] = (now - self.stats["opened"]) * 1000
+    self.stats["last_active"] = now
+    self.stats["bytes_out"] += len(data)
+    self.stats["packets_out"] += 1
+    listener.sendto(data, self.client_addr)
+
+  def send(self, data):
+    self.stats["last_active"] = time.time()
+    self.stats["bytes_in"] += len(data)
+    self.stats["packets_in"] += 1
+    self.transport.sendto(data)
+
+  def close(self):
+    if self.transport is not None:
+      self.transport.close()
+
+
+class _UdpListener(asyncio.DatagramProtocol):
+  def __init__(self, forwarder):
+    self.forwarder = forwarder
+
+  def datagram_received(self, data, addr):
+    self.forwarder._on_udp_datagram(data, addr)
+
+
+class PortForwarder:
+  # Forwards TCP connections and UDP datagrams from listen_host:listen_port to target_host:target_port.
+  # TCP data is moved with sock_recv_into() into one preallocated buffer per direction and sent from a memoryview
+  # of it, so there is no new bytes object per read. Stats are kept for active and the most recent closed connections.
+  def __init__(self, target_host: str, target_port: int, listen_host: str = "0.0.0.0", listen_port: int = 0, tcp: bool = True, udp: bool = False, max_connections: int = 256, buffer_size: int = 256 * 1024, udp_idle_timeout: float = 60):
+    self.target_host = target_host
+    self.target_port = target_port
+    self.listen_host = listen_host
+    self.listen_port = listen_port
+    self.tcp = tcp
+    self.udp = udp
+    self.max_connections = max_connections
+    self.buffer_size = buffer_size
+    self.udp_idle_timeout = udp_idle_timeout
+    self.logger = LogHelper()
+    self._tcp_listener = None
+    self._udp_listener = None
+    self._tasks = set()
+    self._tcp_connections = {}
+    self._udp_sessions = {}
+    self.closed_connections = deque(maxlen=100)
+    self.rejected = 0
+    self.running = False
+
+  def _spawn(self, coroutine):
+    task = asyncio.create_task(coroutine)
+    self._tasks.add(task)
+    task.add_done_callback(self._tasks.discard)
+    return task
+
+  async def start(self):
+    # Raises OSError if a port can't be bound, whatever was opened before is closed again so a retry can bind
+    loop = asyncio.get_running_loop()
+    self.running = True
+    try:
+      if self.tcp:
+        self._tcp_listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._tcp_listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._tcp_listener.bind((self.listen_host, self.listen_port))
+        self._tcp_listener.listen(128)
+        self._tcp_listener.setblocking(False)
+        self.listen_port = self._tcp_listener.getsockname()[1]   # resolves port 0
+        self._spawn(self._accept_loop())
+      if self.udp:
+        self._udp_listener, _ = await loop.create_datagram_endpoint(lambda: _UdpListener(self), local_addr=(self.listen_host, self.listen_port))
+        self.listen_port = self._udp_listener.get_extra_info("sockname")[1]
+        self._spawn(self._udp_cleanup_loop())
+    except BaseException:
+      await self.stop()
+      raise
+    await self.logger.passLog(2, f"Forwarding {self.listen_host}:{self.listen_port} -> {self.target_host}:{self.target_port} (tcp={self.tcp}, udp={self.udp}).")
+
+  async def stop(self):
+    self.running = False
+    if self._tcp_listener is not None:
+      self._tcp_listener.close()
+      self._tcp_listener = None
+    for client, upstream, _ in list(self._tcp_connections.values()):
+      client.close()
+      upstream.close()
+    for session in list(self._udp_sessions.values()):
+      session.close()
+    self._udp_sessions.clear()
+    if self._udp_listener is not None:
+      self._udp_listener.close()
+      self._udp_listener = None
+    for task in list(self._tasks):
+      task.cancel()
+    await asyncio.gather(*self._tasks, return_exceptions=True)
+    await self.logger.passLog(2, f"Stopped forwarding of port {self.listen_port}.")
+
+  # ---------- TCP ----------
+
+  async def _accept_loop(self):
+    loop = asyncio.get_running_loop()
+    while self.running:
+      try:
+        client, address = await loop.sock_accept(self._tcp_listener)
+      except (OSError, AttributeError):
+        break   # listener closed
+      if len(self._tcp_connections) >= self.max_connections:
+        self.rejected += 1
+        client.close()
+        continue
+      client.setblocking(False)
+      self._spawn(self._handle_tcp(client, address))
+
+  async def _handle_tcp(self, client, address):
+    loop = asyncio.get_running_loop()
+    stats = {"protocol": "tcp", "client": f"{address[0]}:{address[1]}", "opened": time.time(), "connect_ms": None, "first_reply_ms": None, "bytes_in": 0, "bytes_out": 0}
+    upstream = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    upstream.setblocking(False)
+    key = id(client)
+    self._tcp_connections[key] = (client, upstream, stats)
+    try:
+      started = time.perf_counter()
+      await loop.sock_connect(upstream, (self.target_host, self.target_port))
+      stats["connect_ms"] = (time.perf_counter() - started) * 1000
+      for sock in (client, upstream):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+      await asyncio.gather(
+        self._pipe(client, upstream, stats, "bytes_in"),
+        self._pipe(upstream, client, stats, "bytes_out")
+      )
+    except OSError as e:
+      stats["error"] = str(e)
+    finally:
+      client.close()
+      upstream.close()
+      del self._tcp_connections[key]
+      self._finish(stats)
+
+  async def _pipe(self, source, destination, stats: dict, counter: str):
+    loop = asyncio.get_running_loop()
+    view = memoryview(bytearray(self.buffer_size))
+    try:
+      while True:
+        received = await loop.sock_recv_into(source, view)
+        if received == 0:
+          break
+        if counter == "bytes_out" and stats["first_reply_ms"] is None:
+          stats["first_reply_ms"] = (time.time() - stats["opened"]) * 1000
+        await loop.sock_sendall(destination, view[:received])
+        stats[counter] += received
+    except OSError:
+      pass
+    try:
+      destination.shutdown(socket.SHUT_WR)   # pass the half close on
+    except OSError:
+      pass
+
+  # ---------- UDP ----------
+
+  def _on_udp_datagram(self, data, addr):
+    session = self._udp_sessions.get(addr)
+    if session is None:
+      if len(self._udp_sessions) >= self.max_connections:
+        self.rejected += 1
+        return
+      session = _UdpSession(self, addr)
+      self._udp_sessions[addr] = session
+      session.pending.append(data)
+      self._spawn(self._open_udp_session(session))
+    elif session.pending is not None:
+      session.pending.append(data)
+    else:
+      session.send(data)
+
+  async def _open_udp_session(self, session):
+    loop = asyncio.get_running_loop()
+    try:
+      await loop.create_datagram_endpoint(lambda: session, remote_addr=(self.target_host, self.target_port))
+    except OSError as e:
+      session.stats["error"] = str(e)
+      self._udp_sessions.pop(session.client_addr, None)
+      self._finish(session.stats)
+      return
+    for data in session.pending:
+      session.send(data)
+    session.pending = None
+
+  async def _udp_cleanup_loop(self):
+    while self.running:
+      await asyncio.sleep(min(self.udp_idle_timeout, 5))
+      now = time.time()
+      for addr, session in list(self._udp_sessions.items()):
+        if now - session.stats["last_active"] > self.udp_idle_timeout:
+          session.close()
+          del self._udp_sessions[addr]
+          self._finish(session.stats)
+
+  # ---------- STATS ----------
+
+  @staticmethod
+  def _with_rates(stats: dict, end: float) -> dict:
+    duration = max(end - stats["opened"], 1e-6)
+    return {**stats, "duration": duration, "throughput_in": stats["bytes_in"] / duration, "throughput_out": stats["bytes_out"] / duration}
+
+  def _finish(self, stats: dict):
+    stats["closed"] = time.time()
+    self.closed_connections.append(self._with_rates(stats, stats["closed"]))
+
+  def get_stats(self) -> dict:
+    now = time.time()
+    active = [self._with_rates(stats, now) for _, _, stats in self._tcp_connections.values()]
+    active += [self._with_rates(session.stats, now) for session in self._udp_sessions.values()]
+    return {
+      "running": self.running,
+      "listen": f"{self.listen_host}:{self.listen_port}",
+      "target": f"{self.target_host}:{self.target_port}",
+      "tcp": self.tcp,
+      "udp": self.udp,
+      "max_connections": self.max_connections,
+      "rejected": self.rejected,
+      "active": active,
+      "recent": list(self.closed_connections)
+    }
@@ -0,0 +1,86 @@
+import io
+import sys
+import time
+import marshal
+import pstats
+import asyncio
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter
+
+class Profiler:
+  # On-demand, time-boxed profiles of the running process. Only one profile can run at a time.
+  MAX_SECONDS = 300
+  _lock = asyncio.Lock()
+
+  @classmethod
+  def busy(cls) -> bool:
+    return cls._lock.locked()
+
+  @classmethod
+  async def cprofile(cls, seconds: float, as_text: bool = False) -> bytes:
+    # Deterministic profile of the event loop thread (every callback and coroutine step that runs in the window).
+    # Returns a pstats dump (load with pstats / snakeviz) or a text report sorted by cumulative time.
+    async with cls._lock:
+      profile = cProfile.Profile()
+      profile.enable()
+      try:
+        await asyncio.sleep(min(seconds, cls.MAX_SECONDS))
+      finally:
+        profile.disable()
+
+    if as_text:
+      output = io.StringIO()
+      pstats.Stats(profile, stream=output).sort_stats("cumulative").print_stats(100)
+      return output.getvalue().encode()
+    profile.create_stats()
+    return marshal.dumps(profile.stats)
+
+  @staticmethod
+  def _sample_stacks(seconds: float, interval: float) -> Counter:
+    own_thread = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stacks = Counter()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+      for thread_id, frame in sys._current_frames().items():
+        if thread_id == own_thread:
+          continue
+        frames = []
+        while frame is not None:
+          frames.append(f"{frame.f_code.co_name} ({frame.f_code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+          frame = frame.f_back
+        stacks[";".join([names.get(thread_id, str(thread_id)), *reversed(frames)])] += 1
+      time.sleep(interval)
+    return stacks
+
+  @classmethod
+  async def sample(cls, seconds: float, interval: float = 0.005) -> bytes:
+    # Sampling profile of all threads, in collapsed stack format ("thread;outer;...;inner count"),
+    # which flamegraph.pl and speedscope read directly. Runs in a worker thread, so it sees a blocked loop too.
+    async with cls._lock:
+      stacks = await asyncio.to_thread(cls._sample_stacks, min(seconds, cls.MAX_SECONDS), interval)
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common()).encode()
+
+  @classmethod
+  async def tracemalloc_top(cls, seconds: float, top: int = 25) -> bytes:
+    # Top allocation sites by size. If tracing wasn't active yet it is started for the window and stopped afterwards,
+    # so the report then only contains memory allocated (and still held) during the window.
+    async with cls._lock:
+      started_here = not tracemalloc.is_tracing()
+      if started_here:
+        tracemalloc.start(10)
+        await asyncio.sleep(min(seconds, cls.MAX_SECONDS))
+      snapshot = tracemalloc.take_snapshot()
+      current, peak = tracemalloc.get_traced_memory()
+      if started_here:
+        tracemalloc.stop()
+
+    snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+    lines = [f"traced memory: current {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB", ""]
+    for index, stat in enumerate(snapshot.statistics("lineno")[:top], 1):
+      lines.append(f"#{index}: {stat.traceback[0].filename}:{stat.traceback[0].lineno}: {stat.size / 1024:.1f} KiB in {stat.count} blocks")
+      for line in stat.traceback.format()[-4:]:
+        lines.append(f"    {line}")
+    return ("\n".join(lines) + "\n").encode()
@@ -0,0 +1,116 @@
+import time
+import asyncio
+
+from .ResticManager import ResticManager
+from .TransferProfile import TransferProfile
+from .LogHelper import LogHelper
+
+class Replicator:
+  # Keeps replica endpoints of a server's repository in sync with the primary endpoint and picks the fastest source for restores.
+  # Uploads only go to the primary (local files are scanned once), afterwards "restic copy" brings every replica up to date
+  # in the background. Host history, config and lease stay on the primary only.
+  PACK_SIZE = 16 * 1024 * 1024   # restic's default pack size, used to weigh latency against throughput
+
+  def __init__(self, primary: str, server_name: str, replicas: list):
+    self.primary = primary
+    self.server_name = server_name
+    self.remote_path = f"/cssystem/{server_name}/repo"
+    self.primary_restic = ResticManager(primary)
+    self.replicas = {}
+    self.state = {}
+    self.last_probe = []
+    self.profile = TransferProfile.from_config({}, "gentle")   # copies run in the background, next to the game server
+    self._task = None
+    self._pending = False
+    self._lock = asyncio.Lock()   # scheduled and manual runs share the ResticManagers, only one may run at a time
+    self.logger = LogHelper()
+    self.set_replicas(replicas)
+
+  def set_replicas(self, replicas: list):
+    wanted = [endpoint for endpoint in dict.fromkeys(replicas) if endpoint != self.primary]
+    self.replicas = {endpoint: self.replicas.get(endpoint) or ResticManager(endpoint) for endpoint in wanted}   # own instances, copies run side by side
+    self.state = {endpoint: self.state.get(endpoint) or {"status": "unknown", "last_success": None, "seconds": None, "last_error": None} for endpoint in wanted}
+
+  def schedule(self):
+    # Called after every successful upload. Only one replication runs at a time, uploads during one queue another run.
+    if self._task is not None and not self._task.done():
+      self._pending = True
+      return
+    self._task = asyncio.create_task(self._run())
+
+  async def _run(self):
+    while True:
+      self._pending = False
+      await self.replicate()
+      if not self._pending:
+        break
+
+  async def replicate(self) -> dict:
+    async with self._lock:
+      await asyncio.gather(*(self._replicate(endpoint) for endpoint in list(self.replicas)))
+    return self.state
+
+  async def _replicate(self, endpoint: str):
+    restic = self.replicas[endpoint]
+    state = self.state[endpoint]
+    state["status"] = "copying"
+    started = time.time()
+    try:
+      if not await asyncio.to_thread(restic.initCopyRepo, self.remote_path, self.primary):
+        raise RuntimeError("repository can't be read or created")
+      await restic.copyRepo(self.remote_path, self.primary, profile=self.profile)
+      returncode = await restic.wait_until_done()
+      if returncode != 0:
+        raise RuntimeError(f"restic copy exited with code {returncode}")
+      state.update(status="in_sync", last_success=time.time(), seconds=time.time() - started, last_error=None)
+      await self.logger.passLog(2, f"Replica '{endpoint}' of '{self.server_name}' is in sync ({state['seconds']:.1f}s).")
+    except Exception as e:
+      state.update(status="failed", last_error=str(e))
+      await self.logger.passLog(0, f"Replicating '{self.server_name}' to '{endpoint}' failed: {str(e)}")
+
+  async def stop(self):
+    if self._task is not None:
+      self._task.cancel()
+      self._task = None
+    for restic in self.replicas.values():
+      await restic.stop()
+
+  async def probe(self) -> list:
+    # Latency and throughput of the primary and every replica, measured concurrently
+    managers = [self.primary_restic, *self.replicas.values()]
+    self.last_probe = list(await asyncio.gather(*(asyncio.to_thread(restic.probeRepo, self.remote_path) for restic in managers)))
+    # Endpoints without a throughput sample (no pack in data/00) are assumed to be as slow as the slowest measured one
+    measured = [result["throughput"] for result in self.last_probe if result["throughput"] is not None]
+    for result in self.last_probe:
+      result["probed"] = time.time()
+      result["estimated_seconds_per_pack"] = self._cost(result, min(measured) if measured else None)
+    return self.last_probe
+
+  def _cost(self, probe: dict, fallback_throughput: float = None) -> float:
+    if probe["latency_ms"] is None:
+      return None
+    throughput = probe["throughput"] or fallback_throughput
+    if throughput is None:
+      return probe["latency_ms"] / 1000
+    return probe["latency_ms"] / 1000 + self.PACK_SIZE / throughput
+
+  async def choose_source(self, snapshot_id: str) -> tuple[str, str]:
+    # Returns (endpoint, snapshot id on that endpoint) of the fastest endpoint that has snapshot_id or a copy of it.
+    # Replicas that lag behind are skipped; the primary is the fallback.
+    if self.replicas == {}:
+      return self.primary, snapshot_id
+    probes, *snapshot_lists = await asyncio.gather(
+      self.probe(),
+      *(asyncio.to_thread(restic.listSnapshots, self.remote_path) for restic in self.replicas.values())
+    )
+    candidates = {self.primary: snapshot_id}
+    for endpoint, snapshots in zip(self.replicas, snapshot_lists):
+      copy = next((snapshot for snapshot in snapshots if snapshot_id in (snapshot["id"], snapshot.get("original"))), None)
+      if copy is not None:
+        candidates[endpoint] = copy["id"]
+    ranked = sorted((probe for probe in probes if probe["endpoint"] in candidates and probe["estimated_seconds_per_pack"] is not None), key=lambda probe: probe["estimated_seconds_per_pack"])
+    endpoint = ranked[0]["endpoint"] if ranked else self.primary
+    return endpoint, candidates[endpoint]
+
+  def get_status(self) -> dict:
+    return {"primary": self.primary, "replicas": self.state, "replicating": self._task is not None and not self._task.done(), "last_probe": self.last_probe}
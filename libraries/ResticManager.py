@@ -1,10 +1,12 @@
 import os
 import re
+import time
 import asyncio
 import json
 import configparser
 from io import StringIO
 from .SubprocessHandler import SubprocessHandler
+from .TransferProfile import TransferProfile
 from .LogHelper import LogHelper
 
 class ResticManager:
@@ -21,34 +23,76 @@ class ResticManager:
     self.env = {"RCLONE_CONFIG": self.rclone_config_path}
     self.logger = LogHelper()
   
-  async def backupRepo(self, local_path: str, remote_path: str, callback_function=None, cwd: str = os.getcwd()):
-    # Uploads/backups a certain file/folder (specified as path) into a remote repository (can't be used simultaniously with restoreRepo())
-    await self.logger.passLog(2, f"Starting backup from '{local_path}' to '{remote_path}'")
+  async def backupRepo(self, local_path, remote_path: str, callback_function=None, cwd: str = os.getcwd(), parent: str = None, exit_callback=None, extra_args: list = None, profile: TransferProfile = None):
+    # Uploads/backups a certain file/folder (specified as path, or a list of paths) into a remote repository (can't be used simultaniously with restoreRepo())
+    # With parent, files whose size and mtime match that snapshot aren't read again, even if their inode/ctime changed (as after a restore).
+    # extra_args are passed on to restic backup (exclude rules), profile limits the resources restic and rclone may use.
+    await self.logger.passLog(2, f"Starting backup from '{local_path}' to '{remote_path}'" + (f", profile '{profile.name}'" if profile is not None else ""))
     async with self._lock:
-      self.process = SubprocessHandler([self.restic_binary_path, "-r", f"rclone:{self.endpoint}:{remote_path}", "--insecure-no-password", "--option", f"rclone.program={self.rclone_binary_path}", "--json", "backup", local_path], self.env, cwd)
+      local_paths = [local_path] if isinstance(local_path, str) else local_path
+      command = [self.restic_binary_path, "-r", f"rclone:{self.endpoint}:{remote_path}", "--insecure-no-password", "--option", f"rclone.program={self.rclone_binary_path}", "--json", "backup", *local_paths]
+      if parent is not None:
+        command += ["--parent", parent, "--ignore-inode"]
+      if extra_args:
+        command += extra_args
+      command, env = self._apply_profile(command, profile)
+      self.process = SubprocessHandler(command, env, cwd)
       if callback_function is not None:
         self.process.register_listener(callback_function)
+      if exit_callback is not None:
+        self.process.register_exit_listener(exit_callback)
       self.process.start()
       await self.logger.passLog(2, f"Backup process started for '{local_path}'")
 
-  async def restoreRepo(self, remote_path: str, local_path: str, callback_function=None, cwd: str = os.getcwd(), snapshot: str="latest"):
+  async def restoreRepo(self, remote_path: str, local_path: str, callback_function=None, cwd: str = os.getcwd(), snapshot: str="latest", delete: bool = False, profile: TransferProfile = None, endpoint: str = None, include: list = None):
     # Downloads/restores a certain file/folder (specified as path) from a remote repository (can't be used simultaniously with backupRepo())
-    await self.logger.passLog(2, f"Starting restore from '{remote_path}' to '{local_path}', snapshot='{snapshot}'")
+    # Files that already match the snapshot are skipped, delete=True also removes local files that aren't part of it.
+    # endpoint restores from a replica instead of this manager's endpoint, include limits the restore to these snapshot paths.
+    endpoint = endpoint or self.endpoint
+    await self.logger.passLog(2, f"Starting restore from '{endpoint}:{remote_path}' to '{local_path}', snapshot='{snapshot}'" + (f", profile '{profile.name}'" if profile is not None else ""))
     async with self._lock:
-      self.process = SubprocessHandler([self.restic_binary_path, "-r", f"rclone:{self.endpoint}:{remote_path}", "--insecure-no-password", "--option", f"rclone.program={self.rclone_binary_path}", "--json", "restore", snapshot, "--target", local_path], self.env, cwd)
+      command = [self.restic_binary_path, "-r", f"rclone:{endpoint}:{remote_path}", "--insecure-no-password", "--option", f"rclone.program={self.rclone_binary_path}", "--json", "restore", snapshot, "--target", local_path]
+      if delete:
+        command.append("--delete")
+      for path in include or []:
+        command += ["--include", path]
+      command, env = self._apply_profile(command, profile)
+      self.process = SubprocessHandler(command, env, cwd)
       if callback_function is not None:
         self.process.register_listener(callback_function)
       self.process.start()
       await self.logger.passLog(2, f"Restore process started for '{remote_path}'")
 
+  async def copyRepo(self, remote_path: str, from_endpoint: str, callback_function=None, profile: TransferProfile = None):
+    # Copies all snapshots of the repository at remote_path on from_endpoint that are missing here (restic copy, only new data is transferred)
+    await self.logger.passLog(2, f"Starting copy of '{remote_path}' from '{from_endpoint}' to '{self.endpoint}'")
+    async with self._lock:
+      command, env = self._apply_profile([self.restic_binary_path, "-r", f"rclone:{self.endpoint}:{remote_path}", "--insecure-no-password", "--option", f"rclone.program={self.rclone_binary_path}", "--json", "copy", "--from-repo", f"rclone:{from_endpoint}:{remote_path}", "--from-insecure-no-password"], profile)
+      self.process = SubprocessHandler(command, env)
+      if callback_function is not None:
+        self.process.register_listener(callback_function)
+      self.process.start()
+
   async def set_endpoint(self, endpoint):
     self.endpoint = endpoint
 
+  async def stop(self):
+    # Aborts the running backup/restore process
+    if self.process is not None:
+      await self.process.stop()
+
+  def _apply_profile(self, command: list, profile: TransferProfile = None) -> tuple[list, dict]:
+    # Command and environment with the profile's nice/ionice wrapper and limits, unchanged without a profile
+    if profile is None:
+      return command, self.env
+    return profile.prefix() + command, {**self.env, **profile.env()}
+
   async def wait_until_done(self):
-    # use this function in combination with await, to wait till the program is done.
+    # use this function in combination with await, to wait till the program is done. Returns the exit code.
     await self.logger.passLog(3, "Waiting for process to complete...")
-    await self.process.wait_until_done()
+    returncode = await self.process.wait_until_done()
     await self.logger.passLog(2, "Process completed.")
+    return returncode
 
   def deleteRemotePath(self, remote_path: str):
     asyncio.create_task(self.logger.passLog(2, f"Removing remote path '{remote_path}'"))
@@ -78,6 +122,16 @@ class ResticManager:
     asyncio.create_task(self.logger.passLog(2, f"Uploading path '{local_path}' to '{remote_path}'"))
     SubprocessHandler.run_once([self.rclone_binary_path, "sync", "--checksum", "--size-only", "--no-update-modtime", local_path, f"{self.endpoint}:{remote_path}"], self.env)
 
+  def readRemoteFile(self, remote_path: str):
+    # Returns the content of a small remote file, None if it doesn't exist or can't be read. Doesn't log, so it can run in worker threads.
+    code, output = SubprocessHandler.run_once_with_code([self.rclone_binary_path, "cat", f"{self.endpoint}:{remote_path}"], self.env)
+    return output if code == 0 else None
+
+  def writeRemoteFile(self, remote_path: str, content: str) -> bool:
+    # Writes content straight to a remote file (rclone rcat, a single upload without listing the folder first)
+    code, _ = SubprocessHandler.run_once_with_code([self.rclone_binary_path, "rcat", f"{self.endpoint}:{remote_path}"], self.env, content)
+    return code == 0
+
   @staticmethod
   def getEndpointsFromConfig() -> list[str]:
     # Returns all names of the endpoints located in the rclone config and returns them in a list
@@ -93,6 +147,81 @@ class ResticManager:
     asyncio.create_task(self.logger.passLog(2, f"Getting snapshots from '{remote_path}'"))
     return json.loads(SubprocessHandler.run_once([self.restic_binary_path, "-r", f"rclone:{self.endpoint}:{remote_path}", "--insecure-no-password", "--option", f"rclone.program={self.rclone_binary_path}", "--json", "snapshots"], self.env))
 
+  def getLatestSnapshotId(self, remote_path: str):
+    # Returns the id of the newest snapshot or None if the repository has none (or can't be read)
+    output = SubprocessHandler.run_once([self.restic_binary_path, "-r", f"rclone:{self.endpoint}:{remote_path}", "--insecure-no-password", "--option", f"rclone.program={self.rclone_binary_path}", "--json", "snapshots", "--latest", "1"], self.env)
+    try:
+      snapshots = json.loads(output)
+    except json.JSONDecodeError:
+      return None
+    if not isinstance(snapshots, list) or snapshots == []:
+      return None
+    return max(snapshots, key=lambda snapshot: snapshot["time"])["id"]
+
+  def listSnapshots(self, remote_path: str) -> list:
+    # Like getSnapshots(), but returns [] on errors and doesn't log, so it can run in worker threads
+    code, output = SubprocessHandler.run_once_with_code([self.restic_binary_path, "-r", f"rclone:{self.endpoint}:{remote_path}", "--insecure-no-password", "--option", f"rclone.program={self.rclone_binary_path}", "--json", "snapshots"], self.env)
+    try:
+      snapshots = json.loads(output) if code == 0 else []
+    except json.JSONDecodeError:
+      return []
+    return snapshots if isinstance(snapshots, list) else []
+
+  def listDirectory(self, remote_path: str, snapshot_id: str, path: str = "/"):
+    # Entries directly below path in a snapshot (restic ls without --recursive), None if the snapshot or path can't be read.
+    # Doesn't log (worker threads).
+    code, output = SubprocessHandler.run_once_with_code([self.restic_binary_path, "-r", f"rclone:{self.endpoint}:{remote_path}", "--insecure-no-password", "--option", f"rclone.program={self.rclone_binary_path}", "--json", "ls", snapshot_id, path], self.env)
+    if code != 0:
+      return None
+    entries = []
+    found = path == "/"
+    for line in output.splitlines():
+      try:
+        node = json.loads(line)
+      except json.JSONDecodeError:
+        continue
+      if node.get("struct_type", node.get("message_type")) != "node":
+        continue
+      if node["path"] == path:
+        found = True
+      elif os.path.dirname(node["path"]) == path:
+        found = True
+        entries.append({key: node.get(key) for key in ("name", "type", "path", "size", "mtime")})
+    return sorted(entries, key=lambda entry: (entry["type"] != "dir", entry["name"])) if found else None
+
+  def initCopyRepo(self, remote_path: str, from_endpoint: str) -> bool:
+    # Creates the repository at remote_path as a copy target of the one on from_endpoint, with the same chunker parameters
+    # so copied data deduplicates. Returns True if the repository exists afterwards. Doesn't log (worker threads).
+    repo = [self.restic_binary_path, "-r", f"rclone:{self.endpoint}:{remote_path}", "--insecure-no-password", "--option", f"rclone.program={self.rclone_binary_path}"]
+    code, _ = SubprocessHandler.run_once_with_code(repo + ["cat", "config"], self.env)
+    if code == 0:
+      return True
+    code, _ = SubprocessHandler.run_once_with_code(repo + ["init", "--from-repo", f"rclone:{from_endpoint}:{remote_path}", "--from-insecure-no-password", "--copy-chunker-params"], self.env)
+    return code == 0
+
+  def probeRepo(self, remote_path: str, sample_bytes: int = 4 * 1024 * 1024) -> dict:
+    # Measures the latency (reading the small repository config) and the throughput (reading up to sample_bytes of a pack file)
+    # of this endpoint. Values are None if the repository can't be read. Doesn't log (worker threads).
+    result = {"endpoint": self.endpoint, "latency_ms": None, "throughput": None}
+    started = time.perf_counter()
+    code, _ = SubprocessHandler.run_once_with_code([self.rclone_binary_path, "cat", f"{self.endpoint}:{remote_path}/config"], self.env)
+    if code != 0:
+      return result
+    result["latency_ms"] = (time.perf_counter() - started) * 1000
+    code, output = SubprocessHandler.run_once_with_code([self.rclone_binary_path, "lsjson", "--files-only", f"{self.endpoint}:{remote_path}/data/00"], self.env)
+    try:
+      packs = json.loads(output) if code == 0 else []
+    except json.JSONDecodeError:
+      packs = []
+    if packs == []:
+      return result
+    pack = max(packs, key=lambda entry: entry["Size"])
+    started = time.perf_counter()
+    code, _ = SubprocessHandler.run_once_with_code([self.rclone_binary_path, "cat", "--count", str(sample_bytes), "--discard", f"{self.endpoint}:{remote_path}/data/00/{pack['Path']}"], self.env)
+    if code == 0:
+      result["throughput"] = min(pack["Size"], sample_bytes) / max(time.perf_counter() - started, 1e-6)
+    return result
+
   def initRepo(self, remote_path: str):
     # creates a repository at the specified path
     asyncio.create_task(self.logger.passLog(2, f"Initializing repository at '{remote_path}'"))
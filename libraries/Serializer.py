@@ -0,0 +1,35 @@
+import json
+from fastapi.responses import JSONResponse
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+class Serializer:
+  # JSON encoding for API responses, WebSocket messages and console exports. Uses orjson when it is installed (requirements-fast.txt)
+  # and the fast runtime is enabled, the json module otherwise. Both write compact JSON and keep non-ASCII characters.
+  use_orjson = orjson is not None
+
+  @classmethod
+  def configure(cls, fast: bool):
+    cls.use_orjson = fast and orjson is not None
+
+  @classmethod
+  def backend(cls) -> str:
+    return "orjson" if cls.use_orjson else "json"
+
+  @classmethod
+  def dumps(cls, obj) -> str:
+    if cls.use_orjson:
+      try:
+        return orjson.dumps(obj).decode()
+      except TypeError:
+        pass   # e.g. integers above 64 bit or non-string keys, the json module handles those
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+class SerializerResponse(JSONResponse):
+  # Default response class of the app, encodes through Serializer
+  def render(self, content) -> bytes:
+    return Serializer.dumps(content).encode()
@@ -1,17 +1,33 @@
 import asyncio
 import os
+import re
 import json
 import time
 import inspect
 from typing import Literal
+from collections import deque
 
 from .ResticManager import ResticManager
 from .ConfigManager import ConfigManager as cm
 from .SubprocessHandler import SubprocessHandler
+from .ConsoleLogStore import ConsoleLogStore
+from .BinaryConsoleStream import BinaryConsoleStream
+from .PortForwarder import PortForwarder
+from .StandbyPrefetcher import StandbyPrefetcher
+from .HostLease import HostLease
+from .ChangeTracker import ChangeTracker
+from .BackupFilter import BackupFilter
+from .Replicator import Replicator
+from .ConsoleStats import ConsoleStats
+from .SnapshotCache import SnapshotCache
+from .TransferProfile import TransferProfile
 from .LogHelper import LogHelper
 
 class ServerManager:
-  
+  CONSOLE_MEMORY_LINES = 50000   # older lines are only kept in the persistent console logs
+  LEASE_ATTEMPTS = 3
+  RESTART_DEFAULTS = {"enabled": False, "on": "failure", "max_restarts": 5, "window": 600, "backoff_initial": 2, "backoff_max": 60, "backup_crash_state": False}
+
   def __init__(self, endpoint: str, server_name: str = "", keep_hourly: int = 0, keep_daily: int = 0, keep_weekly: int = 0):
     self.restic = ResticManager(endpoint, keep_hourly, keep_daily, keep_weekly)
     self.server_name = server_name
@@ -19,6 +35,22 @@ class ServerManager:
     self.keep_daily = keep_daily
     self.keep_weekly = keep_weekly
     self.server_process = None
+    self.console_log = None
+    self.console_stream = BinaryConsoleStream()
+    self.port_forwarder = None
+    self.standby = None
+    self.lease = None
+    self.change_tracker = None
+    self.replicator = None
+    self.process_started = None
+    self.console_stats = None
+    self.snapshot_cache = None
+    self.commands = None   # command templates from server_config.json, cached at start and updated by set_server_config()
+    self.restart_times = []   # hot restarts within the crash loop window
+    self.crash_history = deque(maxlen=50)
+    self._restart_task = None
+    self._crash_backup = None
+    self._stopping = False
     self.host_history_file = ""
     self.logger = LogHelper()
     os.makedirs("./cache", exist_ok=True)   # Creates directories if nonexistent
@@ -80,28 +112,204 @@ class ServerManager:
       open("./cache/servers.json", "w").write(json.dumps(f_json, indent=4))
     self.restic.uploadPath("./cache/servers.json", f"/cssystem/")
 
-  async def _download_server(self, callback_function=None, snapshot: str="latest"):
+  async def _download_server(self, callback_function=None, snapshot: str="latest", delete: bool = False, server_config: dict = None):
     await self.logger.passLog(2, f"Downloading server data for '{self.server_name}', snapshot: {snapshot}.")
     os.makedirs(f"./Servers/{self.server_name}", exist_ok=True)
+    remote_repo = f"/cssystem/{self.server_name}/repo"
+
+    # With replicas, the snapshot is pulled from the fastest endpoint that already has it
+    endpoint = None
+    replicator = await self._get_replicator(server_config) if server_config is not None else None
+    if replicator is not None:
+      snapshot_id = await asyncio.to_thread(self.restic.getLatestSnapshotId, remote_repo) if snapshot == "latest" else snapshot
+      if snapshot_id is not None:
+        endpoint, snapshot = await replicator.choose_source(snapshot_id)
+        await self.logger.passLog(2, f"Restoring '{self.server_name}' from endpoint '{endpoint}'.")
 
     async def convert(line):
       await callback_function({"restic": json.loads(line)})
 
-    await self.restic.restoreRepo(f"/cssystem/{self.server_name}/repo", ".", convert, f"{os.getcwd()}/Servers/{self.server_name}", snapshot)
+    profile = TransferProfile.from_config(server_config or {}, "full")   # nothing runs yet, the start waits for it
+    await self.restic.restoreRepo(remote_repo, ".", convert, f"{os.getcwd()}/Servers/{self.server_name}", snapshot, delete, profile, endpoint)
+
+  async def _get_replicator(self, server_config: dict):
+    # Replicator for the replica endpoints in server_config ("replicas"), None if there are none.
+    # A replicator for another endpoint or server is stopped first, its copies would keep running otherwise.
+    replicas = server_config.get("replicas") or []
+    stale = self.replicator is not None and (replicas == [] or self.replicator.primary != self.restic.endpoint or self.replicator.server_name != self.server_name)
+    if stale:
+      old, self.replicator = self.replicator, None
+      await old.stop()
+    if replicas == []:
+      return None
+    if self.replicator is None:
+      self.replicator = Replicator(self.restic.endpoint, self.server_name, replicas)
+    else:
+      self.replicator.set_replicas(replicas)
+    self.replicator.profile = TransferProfile.from_config(server_config, "gentle")
+    return self.replicator
+
+  async def get_replication_status(self):
+    replicator = await self._get_replicator(await self.get_server_config())
+    return replicator.get_status() if replicator is not None else None
+
+  async def probe_replicas(self):
+    replicator = await self._get_replicator(await self.get_server_config())
+    return await replicator.probe() if replicator is not None else None
+
+  async def replicate(self):
+    replicator = await self._get_replicator(await self.get_server_config())
+    return await replicator.replicate() if replicator is not None else None
+
+  async def _upload_server(self, callback_function=None, snapshot: str="latest", server_config: dict = None, tags: list = None) -> bool:
+    # While the change tracker runs, the local copy started out as the latest snapshot: without changes there is nothing
+    # to upload, otherwise that snapshot is the parent and restic only reads files whose size or mtime differ.
+    # Returns False if the upload was skipped.
+    remote_repo = f"/cssystem/{self.server_name}/repo"
+    parent = None
+    on_failure = None
+    if self.change_tracker is not None:
+      if not self.change_tracker.has_changes():
+        await self.logger.passLog(2, f"No changes in '{self.server_name}' since the last upload, skipped.")
+        return False
+      changes, incomplete = self.change_tracker.take()
+      if not incomplete:
+        parent = await asyncio.to_thread(self.restic.getLatestSnapshotId, remote_repo)
+      await self.logger.passLog(2, f"{len(changes)} changed paths in '{self.server_name}'" + (" (incomplete, full scan)." if parent is None else "."))
+      tracker = self.change_tracker
+      on_failure = lambda: tracker.put_back(changes, incomplete)
 
-  async def _upload_server(self, callback_function=None, snapshot: str="latest"):
     await self.logger.passLog(2, f"Uploading server data for '{self.server_name}'.")
+    server_dir = f"{os.getcwd()}/Servers/{self.server_name}"
+    if server_config is None:
+      server_config = await self.get_server_config()
+    backup_filter = BackupFilter.from_config(server_config)
+    profile = self._transfer_profile(server_config)
+    replicator = await self._get_replicator(server_config)
+    snapshot_cache = self._get_snapshot_cache()
+    loop = asyncio.get_running_loop()
+
+    def exit_callback(code):
+      # Called from restic's reader thread
+      if code != 0 and on_failure is not None:
+        on_failure()
+      if code == 0:
+        loop.call_soon_threadsafe(snapshot_cache.invalidate)
+      if code == 0 and replicator is not None:
+        loop.call_soon_threadsafe(replicator.schedule)
 
     async def convert(line):
       await callback_function({"restic": json.loads(line)})
 
-    await self.restic.backupRepo(".", f"/cssystem/{self.server_name}/repo", convert, f"{os.getcwd()}/Servers/{self.server_name}")
+    await self.restic.backupRepo(backup_filter.targets(server_dir), remote_repo, convert, server_dir, parent, exit_callback, backup_filter.restic_args(server_dir) + [arg for tag in tags or [] for arg in ("--tag", tag)], profile)
+    return True
+
+  def _transfer_profile(self, server_config: dict) -> TransferProfile:
+    # Transfers while the game server runs here must not starve it, the final backup at stop runs at full speed
+    return TransferProfile.from_config(server_config, "gentle" if self.server_process is not None else "full")
+
+  async def get_transfer_profiles(self) -> dict:
+    server_config = await self.get_server_config()
+    return {"active": self._transfer_profile(server_config).name, **{name: TransferProfile.from_config(server_config, name).to_dict() for name in TransferProfile.DEFAULTS}}
+
+  def _get_snapshot_cache(self):
+    if self.snapshot_cache is None or self.snapshot_cache.server_name != self.server_name or self.snapshot_cache.endpoint != self.restic.endpoint:
+      self.snapshot_cache = SnapshotCache(self.restic, self.server_name)
+    return self.snapshot_cache
+
+  async def list_snapshots(self) -> list:
+    return await self._get_snapshot_cache().get_snapshots()
+
+  async def browse_snapshot(self, snapshot_id: str, path: str = "/"):
+    # Returns (snapshot, entries), snapshot is None for unknown ids and entries None for paths that aren't in the snapshot.
+    # Raises ValueError for invalid or ambiguous ids (see SnapshotCache.find_snapshot()).
+    snapshot_cache = self._get_snapshot_cache()
+    snapshot = await snapshot_cache.find_snapshot(snapshot_id)
+    if snapshot is None:
+      return None, None
+    return snapshot, await snapshot_cache.list_directory(snapshot["id"], path)
+
+  async def restore_snapshot(self, snapshot_id: str, paths: list, callback_function=None):
+    # Restores paths (snapshot paths like "/server.properties" or "/world", everything if empty) from an older snapshot.
+    # While this client runs the server, selected paths are written into the working copy right away and go out with the next upload.
+    # Otherwise the restore is queued in server_config.json ("pending_restores") and applied by the next start: a full rollback
+    # replaces its download, selected paths are restored on top of it. Returns "restored", "queued", "failed" or None for unknown ids,
+    # raises ValueError for invalid or ambiguous ids.
+    snapshot = await self._get_snapshot_cache().find_snapshot(snapshot_id)
+    if snapshot is None:
+      return None
+    paths = list(dict.fromkeys("/" + path.strip("/") for path in paths))
+    if self.server_process is not None and paths != [] and "/" not in paths:
+      return "restored" if await self._restore_paths(snapshot["id"], paths, callback_function) else "failed"
+
+    server_config = await self.get_server_config()
+    entry = {"snapshot": snapshot["id"], "paths": [] if "/" in paths else paths, "time": time.time()}
+    # A full rollback makes earlier queued restores pointless
+    server_config["pending_restores"] = [entry] if entry["paths"] == [] else (server_config.get("pending_restores") or []) + [entry]
+    await self._save_server_config(server_config)
+    await self.logger.passLog(2, f"Queued restore of {entry['paths'] or 'everything'} from snapshot '{snapshot['short_id']}' for '{self.server_name}'.")
+    return "queued"
+
+  async def _restore_paths(self, snapshot_id: str, paths: list, callback_function=None) -> bool:
+    # Own restic instance, an upload on self.restic may be running at the same time
+    restic = ResticManager(self.restic.endpoint)
+    profile = self._transfer_profile(await self.get_server_config())
+
+    async def convert(line):
+      if callback_function is not None:
+        await callback_function({"restic": json.loads(line)})
+
+    await self.logger.passLog(2, f"Restoring {paths} from snapshot '{snapshot_id}' into '{self.server_name}'.")
+    await restic.restoreRepo(f"/cssystem/{self.server_name}/repo", ".", convert, f"{os.getcwd()}/Servers/{self.server_name}", snapshot_id, profile=profile, include=paths)
+    if await restic.wait_until_done() != 0:
+      await self.logger.passLog(0, f"Restoring {paths} from snapshot '{snapshot_id}' into '{self.server_name}' failed.")
+      return False
+    return True
+
+  async def _apply_pending_restores(self, pending: list, callback_function=None):
+    # Applies the restores queued by restore_snapshot(), called by start_server() after the download (which already covered
+    # a full rollback). Failed ones stay queued.
+    failed = [entry for entry in pending if entry["paths"] != [] and not await self._restore_paths(entry["snapshot"], entry["paths"], callback_function)]
+    server_config = await self.get_server_config()
+    server_config["pending_restores"] = [entry for entry in server_config.get("pending_restores") or [] if entry not in pending or entry in failed]
+    await self._save_server_config(server_config)
+    if failed != []:
+      await self._notify(callback_function, {"info": "restore_failed", "count": len(failed)})
+
+  async def backup_filter_dry_run(self, rules: dict = None) -> dict:
+    # Reports what the stored rules (or the given, unsaved ones) would keep out of the next upload
+    backup_filter = BackupFilter.from_config({"backup_filter": rules} if rules is not None else await self.get_server_config())
+    server_dir = f"./Servers/{self.server_name}"
+    if not os.path.isdir(server_dir):
+      return None
+    return await asyncio.to_thread(backup_filter.dry_run, server_dir)
+
+  async def _start_change_tracker(self):
+    if not ChangeTracker.supported():
+      return
+    tracker = ChangeTracker(f"./Servers/{self.server_name}")
+    if await asyncio.to_thread(tracker.start):
+      self.change_tracker = tracker
+      await self.logger.passLog(2, f"Tracking changes in '{self.server_name}' with {len(tracker.watches)} watches.")
+    else:
+      await self.logger.passLog(1, f"Change tracking for '{self.server_name}' unavailable, uploads scan everything.")
+
+  async def _stop_change_tracker(self):
+    if self.change_tracker is not None:
+      await asyncio.to_thread(self.change_tracker.stop)
+      self.change_tracker = None
+
+  async def get_change_tracker_status(self):
+    if self.change_tracker is None:
+      return {"running": False}
+    return self.change_tracker.get_status()
 
   async def wait_till_restic_done(self):
     await self.restic.wait_until_done()
 
   async def set_endpoint(self, endpoint):
     await self.restic.set_endpoint(endpoint)
+    await self._restart_standby()
 
   async def set_kept_backups(self, keep_hourly: int = 0, keep_daily: int = 0, keep_weekly: int = 0):
     self.keep_hourly = keep_hourly
@@ -110,8 +318,37 @@ class ServerManager:
 
   async def set_server_name(self, server_name):
     self.server_name = server_name
+    self.commands = None
+    await self._restart_standby()
 
-  async def create_server(self, start_command_windows: str, start_command_linux: str, stop_command: str, forward_port: int, env: dict, commands: list):
+  async def enable_standby(self, interval: int = 300):
+    await self.disable_standby()
+    if self.server_name == "":
+      return
+    try:
+      server_config = await self.get_server_config()
+    except (FileNotFoundError, json.JSONDecodeError):
+      server_config = {}   # not created yet, the defaults apply
+    profile = TransferProfile.from_config(server_config, "gentle")
+    self.standby = StandbyPrefetcher(self.restic.endpoint, self.server_name, interval, lambda: self.server_process is not None, profile, BackupFilter.from_config(server_config).is_empty())
+    self.standby.start()
+    await self.logger.passLog(2, f"Standby prefetching enabled for '{self.server_name}' every {interval}s.")
+
+  async def disable_standby(self):
+    if self.standby is not None:
+      await self.standby.stop()
+      self.standby = None
+
+  async def _restart_standby(self):
+    if self.standby is not None:
+      await self.enable_standby(self.standby.interval)
+
+  async def get_standby_status(self):
+    if self.standby is None:
+      return None
+    return self.standby.get_status()
+
+  async def create_server(self, start_command_windows: str, start_command_linux: str, stop_command: str, forward_port: int, env: dict, commands: list, extra: dict = None):
     os.makedirs(f"./Servers/{self.server_name}", exist_ok=True)
     
     if await self._is_in_server_list():
@@ -129,6 +366,7 @@ class ServerManager:
       "env": env,
       "commands": commands_dict
     }
+    conf_json.update(extra or {})   # optional per-server settings (e.g. forwarding)
     
     await self.logger.passLog(2, f"Creating server with config: {conf_json}")
 
@@ -143,8 +381,33 @@ class ServerManager:
   async def read_total_output(self):
     return await self.server_process.read_total_output()
 
+  async def query_output(self, **query) -> dict:
+    if self.server_process is None:
+      return {"lines": [], "matched": 0, "first_seq": 0, "next_seq": 0}
+    return await self.server_process.query_output(**query)
+
+  def export_output(self, **query):
+    if self.server_process is None:
+      return iter(())
+    return self.server_process.export_output(**query)
+
+  def _get_console_log(self) -> ConsoleLogStore:
+    if self.console_log is not None and self.console_log.server_name == self.server_name:
+      self.console_log.flush()
+      return self.console_log
+    return ConsoleLogStore(self.server_name)
+
+  async def get_console_runs(self) -> list:
+    return self._get_console_log().get_runs()
+
+  async def search_console_logs(self, pattern: str, regex: bool = False, ignore_case: bool = False, run_id: str = None, since: float = None, until: float = None, limit: int = 1000) -> list:
+    return await self._get_console_log().search(pattern, regex, ignore_case, run_id, since, until, limit)
+
   async def delete_server(self):
     await self.logger.passLog(2, f"Deleting server '{self.server_name}'.")
+    for endpoint in (await self.get_server_config()).get("replicas") or []:
+      if endpoint != self.restic.endpoint:
+        ResticManager(endpoint).deleteRemotePath(f"/cssystem/{self.server_name}")
     self.restic.deleteRemotePath(f"/cssystem/{self.server_name}")
     await self._edit_server_list("remove")
     await self.logger.passLog(2, f"Server '{self.server_name}' deletion completed.")
@@ -162,25 +425,33 @@ class ServerManager:
     with open("./cache/server_config.json", "r") as f:
       return json.loads(f.read())
 
-  async def set_server_config(self, start_command_windows: str, start_command_linux: str, stop_command: str, forward_port: int, env: dict, commands: list):
+  async def set_server_config(self, start_command_windows: str, start_command_linux: str, stop_command: str, forward_port: int, env: dict, commands: list, extra: dict = None):
     if await self._is_in_server_list():
       # Convert commands to list of dicts
       commands_dict = [command.dict() for command in commands] if commands else []
 
-      conf_json = {
+      conf_json = await self.get_server_config()   # keeps optional settings that are not part of this change
+      conf_json.update({
         "start_cmd_win": start_command_windows,
         "start_cmd_linux": start_command_linux,
         "stop_cmd": stop_command,
         "forward_port": forward_port,
         "env": env,
         "commands": commands_dict
-      }
+      })
+      conf_json.update(extra or {})
       
       await self.logger.passLog(2, f"Changing config for server to: {conf_json}")
+      await self._save_server_config(conf_json)
 
-      with open("./cache/server_config.json", "w") as f:
-        json.dump(conf_json, f, indent=4)
-      self.restic.uploadPath("./cache/server_config.json", f"/cssystem/{self.server_name}/")
+  async def _save_server_config(self, conf_json: dict):
+    with open("./cache/server_config.json", "w") as f:
+      json.dump(conf_json, f, indent=4)
+    self.restic.uploadPath("./cache/server_config.json", f"/cssystem/{self.server_name}/")
+    self.commands = conf_json.get("commands", [])
+    if self.standby is not None:
+      self.standby.profile = TransferProfile.from_config(conf_json, "gentle")
+      self.standby.delete = BackupFilter.from_config(conf_json).is_empty()
 
   async def get_newest_host(self) -> dict:
     self.restic.downloadPath(f"/cssystem/{self.server_name}/host_history.json", "./cache/")   # Download existing server list (even if it doesn't exist on remote)
@@ -226,45 +497,360 @@ class ServerManager:
       self.host_history_file[-1]["status"] = "uploaded"
       await self._save_host_history()
 
+  async def get_lease_status(self) -> dict:
+    lease = self.lease if self.lease is not None else HostLease(self.restic, self.server_name, cm().getClientId())
+    return await lease.get_status()
+
+  async def newest_host_lease_expired(self) -> bool:
+    # True if the newest host is still marked as hosting but stopped renewing its lease (crashed or offline).
+    # Hosts without a lease file are never considered expired, those still need forceset_newest_host_status().
+    await self._load_host_history()
+    if self.host_history_file == [] or self.host_history_file[-1]["status"] != "hosting":
+      return False
+    lease = HostLease(self.restic, self.server_name, cm().getClientId())
+    current = await lease.read()
+    return current is not None and current["client_id"] == self.host_history_file[-1]["client_id"] and lease.is_expired(current)
+
+  async def take_over_expired_host(self) -> bool:
+    if not await self.newest_host_lease_expired():
+      return False
+    lease = HostLease(self.restic, self.server_name, cm().getClientId())
+    if not await lease.acquire():
+      return False
+    lease.start_heartbeat()   # the download before the start takes longer than the lease lives
+    await self._load_host_history()
+    await self.logger.passLog(1, f"Taking over '{self.server_name}' from client '{self.host_history_file[-1]['client_id']}' after its lease expired.")
+    self.host_history_file[-1]["status"] = "uploaded"
+    self.host_history_file[-1]["lease_expired"] = True
+    await self._save_host_history()
+    self.lease = lease
+    return True
+
+  async def _hold_lease(self, callback_function=None) -> bool:
+    # Returns False if the lease can't be acquired, the server must not start then
+    async def lost():
+      await self._notify(callback_function, {"info": "lease_lost"})
+      await self._fence_server(callback_function)
+
+    if self.lease is None or self.lease.lost or self.lease.lease is None:
+      lease = HostLease(self.restic, self.server_name, cm().getClientId())
+      # Never forced: the previous host released its lease on upload, an unexpired foreign lease means another client hosts
+      for attempt in range(self.LEASE_ATTEMPTS):
+        if await lease.acquire():
+          break
+        if attempt + 1 < self.LEASE_ATTEMPTS:
+          await asyncio.sleep(2 ** attempt)
+      else:
+        await self.logger.passLog(0, f"Couldn't acquire the lease for '{self.server_name}', not starting.")
+        return False
+      self.lease = lease
+    self.lease.on_lost = lost
+    self.lease.start_heartbeat()
+    return True
+
+  async def _release_lease(self):
+    if self.lease is not None:
+      await self.lease.release()
+      self.lease = None
+
   async def start_server(self, callback_function=None):
-    await self._download_server(callback_function)
-    await self.wait_till_restic_done()
+    # Raises ValueError with an error code if the server must not start: "server_not_uploaded" if another client
+    # started hosting in the meantime, "lease_unavailable" if another client holds the lease
     server_config = await self.get_server_config()
-    if await self.did_newest_host_upload():
-      await self.set_newest_host()
-      start_command = server_config["start_cmd_win"] if os.name == "nt" else server_config["start_cmd_linux"]
-      process = SubprocessHandler(start_command.split(), server_config["env"], f"{os.getcwd()}/Servers/{self.server_name}")
-      self.server_process = process
+    if not await self.did_newest_host_upload():
+      raise ValueError("server_not_uploaded")
+    if not await self._hold_lease(callback_function):
+      raise ValueError("lease_unavailable")
+    # A queued full rollback is downloaded instead of the latest snapshot, queued path restores go on top after the download
+    pending = server_config.get("pending_restores") or []
+    rollback = pending[0] if pending != [] and pending[0]["paths"] == [] else None
+    snapshot = rollback["snapshot"] if rollback is not None else "latest"
+    try:
+      # A staged standby copy is swapped in first, the restore on top of it then only fetches the latest changes
+      staged = False
+      if self.standby is not None:
+        staged = await self.standby.take_staged(f"./Servers/{self.server_name}")
+      # --delete drops files the staged or rolled back snapshot doesn't have, unless a backup filter keeps files local
+      delete = (staged or rollback is not None) and BackupFilter.from_config(server_config).is_empty()
+      await self._download_server(callback_function, snapshot, delete, server_config)
+      await self.wait_till_restic_done()
+    except BaseException:
+      await self._release_lease()
+      raise
+    await self.set_newest_host()
+    self.commands = server_config.get("commands", [])
+    await self._start_change_tracker()
+    if pending != []:
+      if rollback is not None and self.change_tracker is not None:
+        self.change_tracker.put_back(set(), True)   # the working copy differs from the latest snapshot, the next upload scans everything
+      await self._apply_pending_restores(pending, callback_function)
+    self.console_log = ConsoleLogStore(self.server_name)
+    self.restart_times = []
+    await self._start_console_stats(callback_function, server_config)
+    await self._launch_process(callback_function, server_config)
+    if self.standby is not None:
+      self.standby.start()   # stays idle while this client hosts
+
+    await self._start_forwarding(server_config)
+
+  async def _launch_process(self, callback_function, server_config: dict, console_history=None):
+    # Starts the game process in the local working copy. console_history carries the console over on a hot restart.
+    start_command = server_config["start_cmd_win"] if os.name == "nt" else server_config["start_cmd_linux"]
+    process = SubprocessHandler(start_command.split(), server_config["env"], f"{os.getcwd()}/Servers/{self.server_name}", self.CONSOLE_MEMORY_LINES)
+    if console_history is not None:
+      process.total_output = console_history
+    self.server_process = process
 
-      async def convert(line):
-        await callback_function({"console": line})
+    async def convert(line):
+      await callback_function({"console": line})
+
+    run_id = self.console_log.start_run()
+    await self.logger.passLog(2, f"Writing console of '{self.server_name}' to run '{run_id}'.")
+
+    loop = asyncio.get_running_loop()
+    process.register_listener(convert)
+    process.register_listener(self.console_log.write)
+    self.console_stream.loop = loop
+    process.register_raw_listener(self.console_stream.append)
+    if self.console_stats is not None:
+      process.register_listener(self.console_stats.process_line)
+    process.register_exit_listener(lambda code: loop.call_soon_threadsafe(self._on_process_exit, process, code, callback_function))
+    self.process_started = time.time()
+    process.start()
+
+  def _on_process_exit(self, process, code: int, callback_function):
+    if process is not self.server_process or self._stopping:
+      return   # stopped on purpose, or a process that was already replaced
+    self._restart_task = asyncio.create_task(self._handle_crash(process, code, callback_function))
+
+  async def _notify(self, callback_function, message: dict):
+    if callback_function is not None:
+      await callback_function(message)
+
+  async def _handle_crash(self, process, code: int, callback_function):
+    # Restarts a crashed server in place: no restore, since this client still holds the lease and the working copy is current.
+    # Restarts back off exponentially; too many restarts within policy["window"] count as a crash loop, which stops the server.
+    process._stop_writer()   # the process is gone, its stdin writer thread would wait forever
+    server_config = await self.get_server_config()
+    policy = {**self.RESTART_DEFAULTS, **(server_config.get("restart") or {})}
+    if code == 0 and policy["on"] != "always":
+      # Shut down from the game console (e.g. "stop"): a normal stop with upload, not a crash
+      await self.logger.passLog(2, f"Server '{self.server_name}' exited cleanly, stopping.")
+      await self.stop_server(callback_function)
+      return
 
-      self.server_process.register_listener(convert)
-      self.server_process.start()
+    now = time.time()
+    uptime = now - self.process_started
+    self.crash_history.append({"time": now, "code": code, "uptime": uptime})
+    await self.logger.passLog(0, f"Server '{self.server_name}' exited unexpectedly with code {code} after {uptime:.0f}s.")
+    await self._notify(callback_function, {"info": "server_crashed", "code": code})
+    if not policy["enabled"]:
+      await self.stop_server(callback_function)
+      return
+    if not self._lease_held():
+      # Someone else took over, the local state must not be uploaded or restarted
+      await self.logger.passLog(0, f"Not restarting '{self.server_name}', this client no longer holds the lease.")
+      await self._abandon_server(callback_function)
+      return
 
-      # TODO: Tunnel port here when tunneling class is ready
+    self.restart_times = [started for started in self.restart_times if now - started < policy["window"]]
+    if len(self.restart_times) >= policy["max_restarts"]:
+      await self.logger.passLog(0, f"Server '{self.server_name}' crashed {len(self.restart_times) + 1} times within {policy['window']}s, giving up.")
+      await self._notify(callback_function, {"info": "crash_loop"})
+      await self.stop_server(callback_function)
+      return
 
-  async def send_input(self, text: str):
-    await self.server_process.send_input(text)
+    if policy["backup_crash_state"] and (self._crash_backup is None or self._crash_backup.done()):
+      self._crash_backup = asyncio.create_task(self._backup_crash_state(callback_function, server_config))
 
-  async def stop_server(self, callback_function=None):
-    server_config = await self.get_server_config()
+    delay = min(policy["backoff_initial"] * 2 ** len(self.restart_times), policy["backoff_max"])
+    await self.logger.passLog(1, f"Restarting '{self.server_name}' in {delay}s (attempt {len(self.restart_times) + 1}).")
+    await asyncio.sleep(delay)
+    if not self._lease_held():
+      await self.logger.passLog(0, f"Not restarting '{self.server_name}', the lease was lost during the backoff.")
+      await self._abandon_server(callback_function)
+      return
+    self.restart_times.append(time.time())
+    if self.console_stats is not None:
+      self.console_stats.clear_sets()
+    await self._launch_process(callback_function, server_config, process.total_output)
+    self._restart_task = None
+    await self._notify(callback_function, {"info": "server_restarted", "attempt": len(self.restart_times)})
+
+  def _lease_held(self) -> bool:
+    return self.lease is not None and not self.lease.lost
+
+  async def _start_console_stats(self, callback_function, server_config: dict):
     try:
-      if server_config["stop_cmd"] == "":
-        await self.server_process.stop()
-      else:
-        await self.server_process.send_input(server_config["stop_cmd"])
-        await self.server_process.wait_until_done()
-    except Exception:
-      await self.logger.passLog(0, "Process stop exception")
+      self.console_stats = ConsoleStats(server_config.get("console_stats"))
+    except (re.error, ValueError, KeyError) as e:
+      self.console_stats = None
+      await self.logger.passLog(0, f"Console stats rules of '{self.server_name}' are invalid: {str(e)}")
+      return
+    self.console_stats.start_push(callback_function)
+
+  async def get_console_stats(self):
+    if self.console_stats is None:
+      return None
+    return self.console_stats.snapshot()
+
+  async def _backup_crash_state(self, callback_function, server_config: dict):
+    # Snapshot of the files as the crash left them, tagged "crash". Runs next to the restart, so writes of the
+    # restarted process can end up in it if the backup takes longer than the backoff.
+    try:
+      await self._upload_server(callback_function, server_config=server_config, tags=["crash"])
+      await self.wait_till_restic_done()
+    except Exception as e:
+      await self.logger.passLog(0, f"Backup of the crash state of '{self.server_name}' failed: {str(e)}")
+
+  async def _fence_server(self, callback_function):
+    # The lease was lost while running: another client may host the server already, so the process is
+    # killed without a final upload (its state would overwrite the new host's snapshots)
+    if self.server_process is None:
+      return
+    await self.logger.passLog(0, f"Lease for '{self.server_name}' lost, stopping the server without upload.")
+    self._stopping = True
+    try:
+      if self._restart_task is not None and self._restart_task is not asyncio.current_task():
+        self._restart_task.cancel()
+      self._restart_task = None
+      await self.server_process.stop()
+      await self._abandon_server(callback_function)
+    finally:
+      self._stopping = False
+
+  async def _abandon_server(self, callback_function):
+    # Local cleanup without upload, for a server whose lease went to another client
     self.server_process = None
+    if self.console_log is not None:
+      self.console_log.close()
+    await self._stop_change_tracker()
+    await self._stop_forwarding()
+    if self.console_stats is not None:
+      self.console_stats.stop_push()
+    self.lease = None
+    await self._notify(callback_function, {"info": "server_stopped"})
+
+  async def get_restart_status(self) -> dict:
+    return {
+      "restarting": self._restart_task is not None and not self._restart_task.done(),
+      "restarts_in_window": len(self.restart_times),
+      "crash_backup_running": self._crash_backup is not None and not self._crash_backup.done(),
+      "crashes": list(self.crash_history)
+    }
+
+  async def _start_forwarding(self, server_config: dict):
+    # Forwards forwarding.listen_port on this host to the game server's forward_port (opt-in per server)
+    forwarding = server_config.get("forwarding") or {}
+    if not forwarding.get("enabled"):
+      return
+    if not forwarding.get("listen_port"):
+      await self.logger.passLog(1, f"Forwarding for '{self.server_name}' is enabled but has no listen port. Skipped.")
+      return
+    self.port_forwarder = PortForwarder(
+      "127.0.0.1", server_config["forward_port"],
+      forwarding.get("listen_host", "0.0.0.0"), forwarding["listen_port"],
+      forwarding.get("tcp", True), forwarding.get("udp", False), forwarding.get("max_connections", 256)
+    )
+    try:
+      await self.port_forwarder.start()
+    except OSError as e:
+      await self.logger.passLog(0, f"Failed to start forwarding for '{self.server_name}': {str(e)}")
+      self.port_forwarder = None
+
+  async def _stop_forwarding(self):
+    if self.port_forwarder is not None:
+      await self.port_forwarder.stop()
+      self.port_forwarder = None
 
-    await self._upload_server(callback_function)
-    await self.wait_till_restic_done()
+  async def get_forwarding_stats(self):
+    if self.port_forwarder is None:
+      return None
+    return self.port_forwarder.get_stats()
+
+  async def send_input(self, text: str):
+    await self.server_process.send_input(text)
 
-    await self.set_newest_host_status()
+  @staticmethod
+  def render_command(command: dict, arguments: dict) -> list:
+    # Fills the arguments of a configured command into its template and returns the stdin lines.
+    # "{name}" placeholders are replaced, remaining arguments are appended like the frontend did (quoted if they contain whitespace).
+    # Every line of the command template is sent as its own line. Raises ValueError with an error code on bad arguments.
+    template = command["command"]
+    appended = []
+    for argument in command.get("arguments", []):
+      value = arguments.get(argument["name"])
+      if value is None or str(value) == "":
+        if not argument["optional"]:
+          raise ValueError("missing_argument")
+        value = ""
+      value = str(value)
+      if argument["type"] == "int" and value != "":
+        try:
+          int(value)
+        except ValueError:
+          raise ValueError("invalid_argument")
+
+      placeholder = "{" + argument["name"] + "}"
+      if placeholder in template:
+        template = template.replace(placeholder, value)
+      elif value != "":
+        appended.append(f'"{value}"' if any(c.isspace() for c in value) else value)
+
+    lines = template.splitlines() or [""]
+    if appended:
+      lines[-1] = " ".join([lines[-1], *appended])
+    return lines
+
+  async def send_batch(self, lines: list, ack_pattern: str = None, timeout: float = 10):
+    return await self.server_process.send_batch(lines, ack_pattern, timeout)
+
+  async def run_command(self, name: str, arguments: dict, ack_pattern: str = None, timeout: float = 10) -> dict:
+    # Runs one of the commands from server_config.json as a single stdin batch, with the templates cached at start
+    if self.commands is None:
+      self.commands = (await self.get_server_config()).get("commands", [])
+    command = next((c for c in self.commands if c["name"] == name), None)
+    if command is None:
+      raise ValueError("command_not_found")
+    lines = self.render_command(command, arguments)
+    await self.logger.passLog(2, f"Running command '{name}' on '{self.server_name}' ({len(lines)} lines).")
+    ack = await self.send_batch(lines, ack_pattern, timeout)
+    return {"lines": lines, "ack": ack}
 
-    # TODO: Stop tunneling port
+  async def stop_server(self, callback_function=None):
+    self._stopping = True
+    if self._restart_task is not None and self._restart_task is not asyncio.current_task():
+      self._restart_task.cancel()   # stop during the restart backoff
+    self._restart_task = None
+    try:
+      server_config = await self.get_server_config()
+      try:
+        if server_config["stop_cmd"] == "":
+          await self.server_process.stop()
+        else:
+          await self.server_process.send_input(server_config["stop_cmd"])
+          await self.server_process.wait_until_done()
+      except Exception:
+        await self.logger.passLog(0, "Process stop exception")
+      self.server_process = None
+      if self.console_log is not None:
+        self.console_log.close()
+      if self._crash_backup is not None:
+        await self._crash_backup   # the final upload goes on top of it
+        self._crash_backup = None
+
+      await self._upload_server(callback_function, server_config=server_config)
+      await self.wait_till_restic_done()
+
+      await self.set_newest_host_status()
+      await self._release_lease()
+      await self._stop_change_tracker()
+
+      await self._stop_forwarding()
+      if self.console_stats is not None:
+        self.console_stats.stop_push()   # the last values stay readable through get_console_stats()
+    finally:
+      self._stopping = False   # crash recovery must work again after a failed stop
 
     result = callback_function({"info": "server_stopped"})
 
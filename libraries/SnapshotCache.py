@@ -0,0 +1,82 @@
+import os
+import json
+import time
+import asyncio
+
+class SnapshotCache:
+  # Local cache for snapshot listings and directory trees of a server's repository under ./cache/snapshots/<name>.
+  # Snapshots never change, so directory listings are cached per snapshot id for good; the snapshot list itself
+  # changes with every upload and is only reused for listing_ttl seconds (or until invalidate()).
+  CACHE_DIR = "./cache/snapshots"
+  MIN_ID_LENGTH = 8   # as long as restic's short ids
+
+  def __init__(self, restic, server_name: str, listing_ttl: float = 60):
+    self.restic = restic
+    self.endpoint = restic.endpoint
+    self.server_name = server_name
+    self.remote_path = f"/cssystem/{server_name}/repo"
+    self.listing_ttl = listing_ttl
+    self.directory = os.path.join(self.CACHE_DIR, server_name)
+    self._snapshots = None
+    self._snapshots_time = 0
+    self._trees = {}   # snapshot id -> {path: entries}, loaded from disk on first use
+    self._lock = asyncio.Lock()
+    os.makedirs(self.directory, exist_ok=True)
+
+  def invalidate(self):
+    # Called after uploads, the next listing goes to the remote again
+    self._snapshots_time = 0
+
+  async def get_snapshots(self) -> list:
+    async with self._lock:
+      if self._snapshots is None or time.time() - self._snapshots_time > self.listing_ttl:
+        snapshots = await asyncio.to_thread(self.restic.listSnapshots, self.remote_path)
+        self._snapshots = sorted(snapshots, key=lambda snapshot: snapshot["time"], reverse=True)
+        self._snapshots_time = time.time()
+        if snapshots != []:   # [] can also mean the remote wasn't readable
+          self._prune({snapshot["id"] for snapshot in snapshots})
+      return self._snapshots
+
+  async def find_snapshot(self, snapshot_id: str):
+    # Accepts full and short ids, None if no snapshot matches. Raises ValueError with an error code for ids shorter
+    # than MIN_ID_LENGTH and for prefixes that match several snapshots, a restore must never guess.
+    snapshot_id = snapshot_id.strip().lower()
+    if len(snapshot_id) < self.MIN_ID_LENGTH:
+      raise ValueError("invalid_snapshot_id")
+    matches = [snapshot for snapshot in await self.get_snapshots() if snapshot["id"].startswith(snapshot_id)]
+    if len(matches) > 1:
+      raise ValueError("ambiguous_snapshot_id")
+    return matches[0] if matches else None
+
+  def _tree_path(self, snapshot_id: str) -> str:
+    return os.path.join(self.directory, f"{snapshot_id}.json")
+
+  def _load_tree(self, snapshot_id: str) -> dict:
+    if snapshot_id not in self._trees:
+      try:
+        with open(self._tree_path(snapshot_id), "r") as f:
+          self._trees[snapshot_id] = json.loads(f.read())
+      except (FileNotFoundError, json.JSONDecodeError):
+        self._trees[snapshot_id] = {}
+    return self._trees[snapshot_id]
+
+  async def list_directory(self, snapshot_id: str, path: str = "/"):
+    # Entries directly below path in the snapshot (full snapshot id), None if the path doesn't exist
+    path = "/" + path.strip("/")
+    tree = self._load_tree(snapshot_id)
+    if path not in tree:
+      entries = await asyncio.to_thread(self.restic.listDirectory, self.remote_path, snapshot_id, path)
+      if entries is None:
+        return None
+      tree[path] = entries
+      with open(self._tree_path(snapshot_id), "w") as f:
+        f.write(json.dumps(tree))
+    return tree[path]
+
+  def _prune(self, keep_ids: set):
+    # Drops cached trees of snapshots that were forgotten on the remote
+    for name in os.listdir(self.directory):
+      snapshot_id = name.removesuffix(".json")
+      if snapshot_id not in keep_ids:
+        os.remove(os.path.join(self.directory, name))
+        self._trees.pop(snapshot_id, None)
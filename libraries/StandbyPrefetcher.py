@@ -0,0 +1,109 @@
+import os
+import json
+import time
+import shutil
+import asyncio
+
+from .ResticManager import ResticManager
+from .TransferProfile import TransferProfile
+from .LogHelper import LogHelper
+
+class StandbyPrefetcher:
+  # Warm standby for clients that aren't hosting: restores the newest snapshot into ./Servers/.standby/<name>
+  # in the background (gentle transfer profile), so a handoff only has to restore what changed since the last prefetch.
+  # restic skips files that already match, so every prefetch after the first one only downloads the delta.
+  STANDBY_DIR = "./Servers/.standby"
+
+  def __init__(self, endpoint: str, server_name: str, interval: int = 300, is_hosting=None, profile: TransferProfile = None, delete: bool = True):
+    self.restic = ResticManager(endpoint)   # own instance, so prefetches never block the main restic process
+    self.server_name = server_name
+    self.interval = interval
+    self.is_hosting = is_hosting   # callable, prefetching pauses while this client hosts the server
+    self.profile = profile or TransferProfile.from_config({}, "gentle")   # the server's gentle profile, updated by set_server_config()
+    self.delete = delete   # restore with --delete, False for servers with a backup filter (it would remove the files the filter keeps local)
+    self.staging_dir = os.path.join(self.STANDBY_DIR, server_name)
+    self.state_path = os.path.join(self.STANDBY_DIR, f"{server_name}.json")
+    self.logger = LogHelper()
+    self._task = None
+    self._prefetching = False
+    self._prefetch_lock = asyncio.Lock()
+    os.makedirs(self.STANDBY_DIR, exist_ok=True)
+    self.state = self._load_state()
+
+  def _load_state(self) -> dict:
+    try:
+      with open(self.state_path, "r") as f:
+        return json.loads(f.read())
+    except (FileNotFoundError, json.JSONDecodeError):
+      return {"snapshot": None, "time": None, "seconds": None}
+
+  def _save_state(self):
+    with open(self.state_path, "w") as f:
+      f.write(json.dumps(self.state))
+
+  def start(self):
+    if self._task is None:
+      self._task = asyncio.create_task(self._loop())
+
+  async def stop(self):
+    if self._task is not None:
+      self._task.cancel()
+      self._task = None
+    if self._prefetching:
+      await self.restic.stop()
+      self._prefetching = False
+
+  async def _loop(self):
+    while True:
+      if self.is_hosting is None or not self.is_hosting():
+        try:
+          await self.prefetch()
+        except Exception as e:
+          await self.logger.passLog(0, f"Standby prefetch for '{self.server_name}' failed: {str(e)}")
+      await asyncio.sleep(self.interval)
+
+  async def prefetch(self) -> bool:
+    # Brings the staging copy up to the newest snapshot, returns False if it already was
+    async with self._prefetch_lock:
+      return await self._prefetch()
+
+  async def _prefetch(self) -> bool:
+    remote_repo = f"/cssystem/{self.server_name}/repo"
+    snapshot = await asyncio.to_thread(self.restic.getLatestSnapshotId, remote_repo)
+    if snapshot is None or snapshot == self.state["snapshot"]:
+      return False
+
+    await self.logger.passLog(2, f"Prefetching snapshot '{snapshot}' of '{self.server_name}' into standby copy.")
+    os.makedirs(self.staging_dir, exist_ok=True)
+    started = time.time()
+    self._prefetching = True
+    try:
+      await self.restic.restoreRepo(remote_repo, ".", None, os.path.abspath(self.staging_dir), snapshot, delete=self.delete, profile=self.profile)
+      await self.restic.wait_until_done()
+    finally:
+      self._prefetching = False
+    self.state = {"snapshot": snapshot, "time": time.time(), "seconds": time.time() - started}
+    self._save_state()
+    await self.logger.passLog(2, f"Standby copy of '{self.server_name}' is at snapshot '{snapshot}' ({self.state['seconds']:.1f}s).")
+    return True
+
+  async def take_staged(self, server_dir: str) -> bool:
+    # Swaps the staging copy in as server_dir (renames on the same filesystem), the previous server_dir
+    # becomes the next staging copy. Returns False if there is nothing staged.
+    await self.stop()
+    if self.state["snapshot"] is None or not os.path.isdir(self.staging_dir):
+      return False
+    old_dir = self.staging_dir + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.isdir(server_dir):
+      os.rename(server_dir, old_dir)
+    os.rename(self.staging_dir, server_dir)
+    if os.path.isdir(old_dir):
+      os.rename(old_dir, self.staging_dir)
+    self.state = {"snapshot": None, "time": None, "seconds": None}   # the new staging copy has an unknown state
+    self._save_state()
+    await self.logger.passLog(2, f"Swapped standby copy of '{self.server_name}' into '{server_dir}'.")
+    return True
+
+  def get_status(self) -> dict:
+    return {"server_name": self.server_name, "interval": self.interval, "running": self._task is not None, "prefetching": self._prefetching, **self.state}
@@ -1,52 +1,94 @@
 import threading
 import subprocess
 import os
+import re
 from .AbstractProcessRunHandler import AbstractProcessRunHandler
+from .ConsoleBuffer import ConsoleBuffer
 import queue
 import inspect
 import asyncio
 
 class SubprocessHandler(AbstractProcessRunHandler):
-  def __init__(self, command: list, env: dict = None, cwd: str = os.getcwd()):
+  def __init__(self, command: list, env: dict = None, cwd: str = os.getcwd(), output_limit: int = 0):
     super().__init__(command, env, cwd)
     self.listeners = []
+    self.raw_listeners = []
+    self.exit_listeners = []
     self.process = None
+    self.returncode = None
     self._output_thread = None
     self._running = False
-    self._input_queue = queue.Queue()
+    self._input_queue = queue.Queue()   # items are lists of lines, each item is written with a single write()
+    self._ack_waiters = []   # (compiled pattern, future) pairs resolved by the first matching output line
     self.loop = asyncio.get_event_loop()
-    self.total_output = ""
+    self.total_output = ConsoleBuffer(output_limit)   # output_limit = lines kept in memory, 0 = all
 
   async def accumulate_output(self, line):
-    self.total_output += line + "\n"
+    self.total_output.append(line)
+    for pattern, future in self._ack_waiters:
+      if not future.done() and pattern.search(line):
+        future.set_result(line)
 
   def register_listener(self, callback):
     # Add function that gets called every time a new line appears.
     self.listeners.append(callback)
 
+  def register_raw_listener(self, callback):
+    # Add function that gets the undecoded bytes of every line (called from the reader thread, must not be async).
+    self.raw_listeners.append(callback)
+
+  def register_exit_listener(self, callback):
+    # Add function that gets the exit code once the process ended (called from the reader thread, must not be async).
+    self.exit_listeners.append(callback)
+
   def _read_output(self):
     # Blocking stdout reader loop running in a separate thread.
-    with self.process.stdout:
-      for line in iter(self.process.stdout.readline, b''):
+    process = self.process
+    with process.stdout:
+      for line in iter(process.stdout.readline, b''):
+        for raw_listener in self.raw_listeners:
+          raw_listener(line)
         decoded = line.decode().rstrip()
         for listener in self.listeners:
           result = listener(decoded)
           if inspect.isawaitable(result):
             asyncio.run_coroutine_threadsafe(result, self.loop)
+    self.returncode = process.wait()
+    for exit_listener in self.exit_listeners:
+      exit_listener(self.returncode)
 
   async def read_total_output(self):
-    return self.total_output
+    return self.total_output.text()
+
+  async def query_output(self, **query) -> dict:
+    return self.total_output.query(**query)
+
+  def export_output(self, **query):
+    # Generator with the console history as NDJSON chunks
+    return self.total_output.iter_ndjson(**query)
 
   def _write_input(self):
     # Blocking stdin writer loop running in a separate thread.
+    # Everything queued in the meantime is joined and written with one write() and one flush().
     while self._running:
+      lines = self._input_queue.get()
+      if lines is None:   # wake-up sentinel from stop()
+        break
       try:
-        line = self._input_queue.get(timeout=0.1)
-        if self.process and self.process.stdin:
-          self.process.stdin.write((line + '\n').encode())
-          self.process.stdin.flush()
+        while True:
+          more = self._input_queue.get_nowait()
+          if more is None:
+            self._running = False
+            break
+          lines.extend(more)
       except queue.Empty:
-        continue
+        pass
+      if self.process and self.process.stdin:
+        try:
+          self.process.stdin.write("".join(line + "\n" for line in lines).encode())
+          self.process.stdin.flush()
+        except OSError:
+          break   # process is gone, stdin pipe closed
 
   def start(self):
     # Start the subprocess and background I/O threads.
@@ -77,21 +119,45 @@ class SubprocessHandler(AbstractProcessRunHandler):
 
   async def send_input(self, text: str):
     # Send input to the subprocess.
-    self._input_queue.put(text)
+    self._input_queue.put([text])
+
+  async def send_batch(self, lines: list, ack_pattern: str = None, timeout: float = 10):
+    # Sends all lines with a single write. With ack_pattern, waits until a matching output line
+    # appears and returns it (None on timeout). Raises re.error on an invalid pattern.
+    waiter = None
+    if ack_pattern:
+      waiter = (re.compile(ack_pattern), asyncio.get_running_loop().create_future())
+      self._ack_waiters.append(waiter)
+    self._input_queue.put(list(lines))
+    if waiter is None:
+      return None
+    try:
+      return await asyncio.wait_for(waiter[1], timeout)
+    except asyncio.TimeoutError:
+      return None
+    finally:
+      self._ack_waiters.remove(waiter)
+
+  def _stop_writer(self):
+    self._running = False
+    self._input_queue.put(None)
 
   async def stop(self):
     if self.process:
-      self._running = False
+      self._stop_writer()
       self.process.terminate()
       self.process.wait()
       self.process = None
 
   async def wait_until_done(self):
+    # Returns the exit code (None if the process never ran)
     if self.process:
       while self.process.poll() is None:
         await asyncio.sleep(0.1)
-      self._running = False
+      self.returncode = self.process.returncode
+      self._stop_writer()
       self.process = None
+    return self.returncode
       
   @staticmethod
   def run_once(command: list[str], env: dict = None) -> str:
@@ -108,3 +174,20 @@ class SubprocessHandler(AbstractProcessRunHandler):
       text=True  # returns str instead of bytes
     )
     return result.stdout.strip()
+
+  @staticmethod
+  def run_once_with_code(command: list[str], env: dict = None, input: str = None) -> tuple[int, str]:
+    # Like run_once(), but keeps stderr out of the output, can feed stdin and also returns the exit code.
+    environment = os.environ.copy()
+    if env is not None:
+      environment.update(env)
+
+    result = subprocess.run(
+      command,
+      stdout=subprocess.PIPE,
+      stderr=subprocess.DEVNULL,
+      input=input if input is not None else "",
+      env=environment,
+      text=True
+    )
+    return result.returncode, result.stdout
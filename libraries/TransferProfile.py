@@ -0,0 +1,54 @@
+import os
+import shutil
+
+class TransferProfile:
+  # Resource limits for restic processes, per server from server_config.json ("transfer": {"gentle": {...}, "full": {...}}).
+  # The rclone backend is started by restic and inherits priority and environment, so the limits cover both:
+  #   nice:         CPU priority 0-19, None leaves it unchanged
+  #   ionice_class: I/O class, 2 best-effort or 3 idle; ionice_level 0-7 (best-effort only)
+  #   bwlimit:      rclone --bwlimit, a rate ("4M") or a timetable ("08:00,1M 23:00,off"), None = unlimited
+  #   gomaxprocs:   number of cores restic/rclone run Go code on, None = all
+  # "gentle" is used while the game server runs on this client and for background transfers, "full" otherwise
+  # (download at start, final backup at stop). nice/ionice are Linux only and skipped if the tools are missing.
+  # Values that need root (negative nice, the realtime I/O class) are ignored, restic would not start at all otherwise.
+  DEFAULTS = {
+    "gentle": {"nice": 19, "ionice_class": 2, "ionice_level": 7, "bwlimit": None, "gomaxprocs": max(1, (os.cpu_count() or 1) // 4)},
+    "full": {"nice": None, "ionice_class": None, "ionice_level": None, "bwlimit": None, "gomaxprocs": None}
+  }
+
+  def __init__(self, name: str, nice: int = None, ionice_class: int = None, ionice_level: int = None, bwlimit: str = None, gomaxprocs: int = None):
+    self.name = name
+    self.nice = nice
+    self.ionice_class = ionice_class
+    self.ionice_level = ionice_level
+    self.bwlimit = bwlimit
+    self.gomaxprocs = gomaxprocs
+
+  @classmethod
+  def from_config(cls, server_config: dict, name: str):
+    settings = (server_config.get("transfer") or {}).get(name) or {}
+    return cls(name, **{**cls.DEFAULTS[name], **{key: value for key, value in settings.items() if key in cls.DEFAULTS[name]}})
+
+  def prefix(self) -> list:
+    # nice/ionice wrapper for the command
+    prefix = []
+    if os.name == "nt":
+      return prefix
+    if self.nice is not None and 0 <= self.nice <= 19 and shutil.which("nice"):
+      prefix += ["nice", "-n", str(self.nice)]
+    if self.ionice_class in (2, 3) and shutil.which("ionice"):
+      prefix += ["ionice", "-c", str(self.ionice_class)]
+      if self.ionice_level is not None and self.ionice_class == 2:
+        prefix += ["-n", str(self.ionice_level)]
+    return prefix
+
+  def env(self) -> dict:
+    env = {}
+    if self.bwlimit:
+      env["RCLONE_BWLIMIT"] = self.bwlimit   # rclone reads every flag from RCLONE_<FLAG>
+    if self.gomaxprocs:
+      env["GOMAXPROCS"] = str(self.gomaxprocs)
+    return env
+
+  def to_dict(self) -> dict:
+    return {"name": self.name, "nice": self.nice, "ionice_class": self.ionice_class, "ionice_level": self.ionice_level, "bwlimit": self.bwlimit, "gomaxprocs": self.gomaxprocs}
@@ -1,14 +1,19 @@
 import uvicorn
 import webbrowser
+import importlib.util
 import asyncio
 import threading
 import os
+import re
+import time
 from typing import Dict, Optional
 from pydantic import BaseModel
 from fastapi import FastAPI, WebSocket, Request, HTTPException
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from fastapi.responses import HTMLResponse
+from fastapi.responses import StreamingResponse
+from fastapi.responses import Response
 from fastapi.templating import Jinja2Templates
 
 from libraries.LogHelper import LogHelper
@@ -17,17 +22,24 @@ from libraries.ResticManager import ResticManager
 from libraries.SubprocessHandler import SubprocessHandler
 from libraries.ConfigManager import ConfigManager
 from libraries.ServerManager import ServerManager
+from libraries.LoopMonitor import LoopMonitor
+from libraries.Profiler import Profiler
+from libraries.Serializer import Serializer, SerializerResponse
+from libraries.ConsoleStats import ConsoleStats
+from libraries.ConsoleLogStore import ConsoleLogStore
 
 
-app = FastAPI()
 logger = LogHelper()
 config = ConfigManager()
+Serializer.configure(config.getFastRuntime())
+app = FastAPI(default_response_class=SerializerResponse)
 sm = ServerManager(config.getEndpoint(), config.getServerName())
+loop_monitor = LoopMonitor()
 
 # ---------- MODELS ----------
 
-from pydantic import BaseModel
-from typing import Optional, List, Dict
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, Literal
 
 class CommandArgument(BaseModel):
   name: str
@@ -40,6 +52,50 @@ class Command(BaseModel):
   command: str
   arguments: List[CommandArgument]
 
+class ForwardingConfig(BaseModel):
+  enabled: bool = False
+  listen_host: str = "0.0.0.0"
+  listen_port: int = 0
+  tcp: bool = True
+  udp: bool = False
+  max_connections: int = 256
+
+class BackupFilterConfig(BaseModel):
+  include: List[str] = []
+  exclude: List[str] = []
+  exclude_if_present: List[str] = []
+  max_file_size: int = 0   # bytes, 0 = no limit
+
+class RestartPolicy(BaseModel):
+  enabled: bool = False
+  on: Literal["failure", "always"] = "failure"   # failure: only non-zero exit codes
+  max_restarts: int = 5   # within window seconds, one more crash counts as a crash loop and stops the server
+  window: int = 600
+  backoff_initial: float = 2
+  backoff_max: float = 60
+  backup_crash_state: bool = False
+
+class TransferProfileConfig(BaseModel):
+  # Omitted values keep the profile's default, see TransferProfile
+  nice: Optional[int] = Field(None, ge=0, le=19)   # 0 = normal priority
+  ionice_class: Optional[Literal[2, 3]] = None   # best-effort or idle, realtime needs root
+  ionice_level: Optional[int] = Field(None, ge=0, le=7)
+  bwlimit: Optional[str] = None   # rclone --bwlimit, e.g. "4M" or "08:00,1M 23:00,off"
+  gomaxprocs: Optional[int] = Field(None, ge=0)   # 0 = all cores
+
+class TransferConfig(BaseModel):
+  gentle: Optional[TransferProfileConfig] = None   # while the server runs on this client and for background copies
+  full: Optional[TransferProfileConfig] = None   # download at start, final backup at stop
+
+class ConsoleStatRule(BaseModel):
+  name: str
+  type: Literal["counter", "gauge", "set_add", "set_remove"]
+  pattern: str
+  group: Optional[str] = None   # capture group name or index for gauges and sets, 1 if omitted
+  contains: Optional[str] = None   # literal that must appear in the line before the regex runs
+
+EXTRA_SERVER_CONFIG_FIELDS = {"forwarding", "backup_filter", "replicas", "restart", "console_stats", "transfer"}   # optional server_config.json settings, only written when sent
+
 class ServerConfigChangeRequest(BaseModel):
   start_cmd_win: Optional[str] = ""
   start_cmd_linux: Optional[str] = "./ping1 google.com"
@@ -47,6 +103,12 @@ class ServerConfigChangeRequest(BaseModel):
   port: int = 8080
   env: Dict[str, str] = {}
   commands: Optional[List[Command]] = []
+  forwarding: Optional[ForwardingConfig] = None
+  backup_filter: Optional[BackupFilterConfig] = None
+  replicas: Optional[List[str]] = None   # rclone endpoints the repository is copied to
+  restart: Optional[RestartPolicy] = None
+  console_stats: Optional[List[ConsoleStatRule]] = None   # omitted: Minecraft defaults, []: off
+  transfer: Optional[TransferConfig] = None
 
 class ServerCreateRequest(BaseModel):
   server_name: str
@@ -57,6 +119,12 @@ class ServerCreateRequest(BaseModel):
   port: int = 8080
   env: Dict[str, str] = {}
   commands: Optional[List[Command]] = []
+  forwarding: Optional[ForwardingConfig] = None
+  backup_filter: Optional[BackupFilterConfig] = None
+  replicas: Optional[List[str]] = None   # rclone endpoints the repository is copied to
+  restart: Optional[RestartPolicy] = None
+  console_stats: Optional[List[ConsoleStatRule]] = None   # omitted: Minecraft defaults, []: off
+  transfer: Optional[TransferConfig] = None
 
 class ServerIdentifier(BaseModel):
   server_name: str
@@ -68,6 +136,49 @@ class RcloneConfigPayload(BaseModel):
 class ServerInput(BaseModel):
   input: str
 
+class CommandRunRequest(BaseModel):
+  name: str
+  arguments: Dict[str, str] = {}
+  ack_pattern: Optional[str] = None
+  timeout: float = 10
+
+class ConsoleQuery(BaseModel):
+  offset: int = 0
+  limit: Optional[int] = 1000
+  since_seq: Optional[int] = None
+  before_seq: Optional[int] = None
+  tail: Optional[int] = None
+  pattern: Optional[str] = None
+  regex: bool = False
+  ignore_case: bool = False
+
+class ConsoleLogSearch(BaseModel):
+  pattern: str
+  regex: bool = False
+  ignore_case: bool = False
+  run_id: Optional[str] = None
+  since: Optional[float] = None
+  until: Optional[float] = None
+  limit: int = 1000
+
+class StandbyRequest(BaseModel):
+  enabled: bool
+  interval: int = 300
+
+class BackupFilterDryRun(BaseModel):
+  backup_filter: Optional[BackupFilterConfig] = None   # unsaved rules to try, the stored ones if omitted
+
+class SnapshotBrowseRequest(BaseModel):
+  snapshot: str   # full or short id
+  path: str = "/"
+
+class SnapshotRestoreRequest(BaseModel):
+  snapshot: str
+  paths: List[str] = []   # snapshot paths, e.g. "/server.properties" or "/world/region", everything if empty
+
+class RuntimeRequest(BaseModel):
+  fast_runtime: bool
+
 class ConfigUpdateRequest(BaseModel):
     client_id: str
     endpoint: str
@@ -85,25 +196,38 @@ async def index():
 # ---------- WEBSOCKETS ----------
 
 websockets = {}
+binary_console_ids = set()   # clients that get the console as raw binary frames instead of JSON
+CONSOLE_INITIAL_LINES = 500   # lines sent on connect, older ones are loaded on demand through /server/console
 
 async def forward_to_websockets(json):
-  for ws in list(websockets.values()):
+  text = None
+  for ws_id, ws in list(websockets.items()):
+    if ws_id in binary_console_ids and "console" in json:
+      continue
+    if text is None:
+      text = Serializer.dumps(json)   # encoded once for all clients
     try:
-      await ws.send_json(json)
+      await ws.send_text(text)
     except Exception:
       pass
 
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
+async def websocket_endpoint(websocket: WebSocket, console: str = "json"):
+  # console=binary: console output arrives as binary frames (see BinaryConsoleStream), everything else stays JSON
   await websocket.accept()
   ws_id = id(websocket)
   websockets[ws_id] = websocket
 
   try:
-    output_str = await sm.read_total_output()
-    await websocket.send_json({"console": output_str.splitlines()})
+    if console == "binary":
+      binary_console_ids.add(ws_id)
+      await sm.console_stream.attach(ws_id, websocket)
+    else:
+      history = await sm.query_output(tail=CONSOLE_INITIAL_LINES)
+      first_seq = history["lines"][0]["seq"] if history["lines"] else history["next_seq"]
+      await websocket.send_text(Serializer.dumps({"console": [entry["line"] for entry in history["lines"]], "first_seq": first_seq}))
     if await sm.process_exists():
-      await websocket.send_json({"info": "server_active"})
+      await websocket.send_text(Serializer.dumps({"info": "server_active"}))
   except Exception:
     pass
 
@@ -114,6 +238,8 @@ async def websocket_endpoint(websocket: WebSocket):
       except asyncio.TimeoutError:
         continue
   except Exception:
+    sm.console_stream.detach(ws_id)
+    binary_console_ids.discard(ws_id)
     if ws_id in websockets:
       del websockets[ws_id]
       print("Disconnected and removed!")
@@ -143,13 +269,77 @@ async def update_config(payload: ConfigUpdateRequest):
     await sm.set_server_name(payload.server_name)
     return {"status": "updated"}
 
+@app.get("/config/runtime")
+async def get_runtime():
+  # fast_runtime is the saved setting (applies after a restart), loop and json what is running
+  return {"fast_runtime": ConfigManager().getFastRuntime(), "loop": type(asyncio.get_running_loop()).__module__.split(".")[0], "json": Serializer.backend()}
+
+@app.post("/config/runtime")
+async def set_runtime(data: RuntimeRequest):
+  ConfigManager().setFastRuntime(data.fast_runtime)
+  return {"status": "restart_required"}   # the event loop can only be chosen at startup
+
+@app.on_event("startup")
+async def start_loop_monitor():
+  loop_monitor.start()
+
+@app.on_event("startup")
+async def start_standby():
+  enabled, interval = config.getStandby()
+  if enabled:
+    await sm.enable_standby(interval)
+
+@app.on_event("shutdown")
+async def stop_search_pool():
+  ConsoleLogStore.shutdown_pool()
+
+@app.post("/standby/set")
+async def set_standby(data: StandbyRequest):
+  ConfigManager().setStandby(data.enabled, data.interval)
+  if data.enabled:
+    await sm.enable_standby(data.interval)
+  else:
+    await sm.disable_standby()
+  return {"status": "updated"}
+
+@app.post("/standby/status")
+async def standby_status():
+  status = await sm.get_standby_status()
+  if status is None:
+    return {"error": "standby_disabled"}
+  return status
+
+@app.post("/standby/prefetch")
+async def standby_prefetch():
+  if sm.standby is None:
+    return {"error": "standby_disabled"}
+  if await sm.process_exists():
+    return {"error": "server_already_running"}
+  fetched = await sm.standby.prefetch()
+  return {"status": "prefetched" if fetched else "up_to_date"}
+
 # ---------- SERVER ENDPOINTS ----------
 
+def unknown_replicas(replicas: Optional[List[str]]) -> bool:
+  return replicas is not None and not set(replicas) <= set(ResticManager.getEndpointsFromConfig())
+
+def invalid_stat_rules(rules: Optional[List[ConsoleStatRule]]) -> bool:
+  try:
+    ConsoleStats.compile([rule.dict() for rule in rules or []])
+    return False
+  except (re.error, ValueError):
+    return True
+
 @app.post("/server/create")
 async def create_server(data: ServerCreateRequest):
+  if unknown_replicas(data.replicas):
+    return {"error": "unknown_endpoint"}
+  if invalid_stat_rules(data.console_stats):
+    return {"error": "invalid_pattern"}
   smt = ServerManager(data.endpoint, data.server_name)
   await smt.create_server(
-    data.start_cmd_win, data.start_cmd_linux, data.stop_cmd, data.port, data.env, data.commands
+    data.start_cmd_win, data.start_cmd_linux, data.stop_cmd, data.port, data.env, data.commands,
+    data.dict(include=EXTRA_SERVER_CONFIG_FIELDS, exclude_none=True)
   )
   return {"status": "server_created"}
 
@@ -162,15 +352,17 @@ async def delete_server(data: ServerIdentifier):
 @app.post("/server/start")
 async def start_server():
   config = await sm.get_server_config()
-  if not await sm.did_newest_host_upload():
+  if not await sm.did_newest_host_upload() and not await sm.take_over_expired_host():
     return {"error": "server_not_uploaded"}
   elif await sm.process_exists():
     return {"error": "server_already_running"}
   #elif not os.path.isfile(config["start_cmd_linux"].split()[0]):
   #  return {"error": "executable_not_found"}
-  else:
+  try:
     await sm.start_server(forward_to_websockets)
-    return {"status": "server_started"}
+  except ValueError as e:
+    return {"error": str(e)}
+  return {"status": "server_started"}
 
 @app.post("/server/stop")
 async def stop_server():
@@ -182,19 +374,137 @@ async def stop_server(data: ServerInput):
   await sm.send_input(data.input)
   return {"status": "input_sent"}
 
+@app.post("/server/send_batch")
+async def send_batch(data: CommandRunRequest):
+  if not await sm.process_exists():
+    return {"error": "server_not_running"}
+  try:
+    result = await sm.run_command(data.name, data.arguments, data.ack_pattern, data.timeout)
+  except ValueError as e:
+    return {"error": str(e)}
+  except re.error:
+    return {"error": "invalid_pattern"}
+  if data.ack_pattern and result["ack"] is None:
+    return {"error": "ack_timeout", "lines": result["lines"]}
+  return {"status": "batch_sent", **result}
+
 @app.post("/server/read")
 async def read_total_output():
   output_str = await sm.read_total_output()
   return output_str.splitlines()
 
+@app.post("/server/console")
+async def query_console(query: ConsoleQuery):
+  try:
+    return await sm.query_output(**query.dict())
+  except re.error:
+    return {"error": "invalid_pattern"}
+
+@app.post("/server/console/export")
+async def export_console(query: ConsoleQuery):
+  if query.regex and query.pattern:
+    try:
+      re.compile(query.pattern)
+    except re.error:
+      return {"error": "invalid_pattern"}
+  export = sm.export_output(since_seq=query.since_seq, before_seq=query.before_seq, pattern=query.pattern, regex=query.regex, ignore_case=query.ignore_case)
+  return StreamingResponse(export, media_type="application/x-ndjson")
+
+@app.post("/server/logs/runs")
+async def console_log_runs():
+  return await sm.get_console_runs()
+
+@app.post("/server/logs/search")
+async def search_console_logs(query: ConsoleLogSearch):
+  try:
+    return await sm.search_console_logs(**query.dict())
+  except re.error:
+    return {"error": "invalid_pattern"}
+
 @app.post("/server/upload")
 async def upload_server():
   if not await sm.is_client_newest_host():
     return {"error": "client_is_not_newest_host"}
   else:
-    await sm._upload_server(forward_to_websockets)
+    uploaded = await sm._upload_server(forward_to_websockets)
     await sm.set_newest_host_status()
-    return {"status": "server_uploaded"}
+    return {"status": "server_uploaded" if uploaded else "no_changes"}
+
+@app.post("/server/backup_filter/dry_run")
+async def backup_filter_dry_run(data: BackupFilterDryRun):
+  result = await sm.backup_filter_dry_run(data.backup_filter.dict() if data.backup_filter is not None else None)
+  if result is None:
+    return {"error": "server_not_downloaded"}
+  return result
+
+@app.post("/server/replicas")
+async def replication_status():
+  status = await sm.get_replication_status()
+  if status is None:
+    return {"error": "no_replicas"}
+  return status
+
+@app.post("/server/replicas/probe")
+async def probe_replicas():
+  probes = await sm.probe_replicas()
+  if probes is None:
+    return {"error": "no_replicas"}
+  return {"probes": probes}
+
+@app.post("/server/replicate")
+async def replicate():
+  state = await sm.replicate()
+  if state is None:
+    return {"error": "no_replicas"}
+  return {"replicas": state}
+
+@app.post("/server/snapshots")
+async def list_snapshots():
+  return {"snapshots": await sm.list_snapshots()}
+
+@app.post("/server/snapshots/browse")
+async def browse_snapshot(data: SnapshotBrowseRequest):
+  try:
+    snapshot, entries = await sm.browse_snapshot(data.snapshot, data.path)
+  except ValueError as e:
+    return {"error": str(e)}
+  if snapshot is None:
+    return {"error": "unknown_snapshot"}
+  if entries is None:
+    return {"error": "unknown_path"}
+  return {"snapshot": snapshot["id"], "path": "/" + data.path.strip("/"), "entries": entries}
+
+@app.post("/server/snapshots/restore")
+async def restore_snapshot(data: SnapshotRestoreRequest):
+  # Restores right away while this client runs the server, otherwise at the next start
+  try:
+    status = await sm.restore_snapshot(data.snapshot, data.paths, forward_to_websockets)
+  except ValueError as e:
+    return {"error": str(e)}
+  if status is None:
+    return {"error": "unknown_snapshot"}
+  if status == "failed":
+    return {"error": "restore_failed"}
+  return {"status": status}
+
+@app.post("/server/stats")
+async def console_stats():
+  stats = await sm.get_console_stats()
+  if stats is None:
+    return {"error": "no_stats"}
+  return stats
+
+@app.post("/server/transfer")
+async def transfer_profiles():
+  return await sm.get_transfer_profiles()
+
+@app.post("/server/restarts")
+async def restart_status():
+  return await sm.get_restart_status()
+
+@app.post("/server/changes")
+async def change_tracker_status():
+  return await sm.get_change_tracker_status()
 
 @app.post("/server/set_newest_host")
 async def set_newest_host():
@@ -233,6 +543,16 @@ async def forceset_newest_host_status():
   await sm.forceset_newest_host_status()
   return {"status": "forced_set"}
 
+@app.post("/server/lease")
+async def lease_status():
+  return await sm.get_lease_status()
+
+@app.post("/server/takeover")
+async def take_over():
+  if await sm.take_over_expired_host():
+    return {"status": "taken_over"}
+  return {"error": "lease_not_expired"}
+
 @app.post("/server/is_newest")
 async def is_client_newest():
   is_newest = await sm.is_client_newest_host()
@@ -245,8 +565,13 @@ async def did_upload():
 
 @app.post("/server/config/set")
 async def create_server(data: ServerConfigChangeRequest):
+  if unknown_replicas(data.replicas):
+    return {"error": "unknown_endpoint"}
+  if invalid_stat_rules(data.console_stats):
+    return {"error": "invalid_pattern"}
   await sm.set_server_config(
-    data.start_cmd_win, data.start_cmd_linux, data.stop_cmd, data.port, data.env, data.commands
+    data.start_cmd_win, data.start_cmd_linux, data.stop_cmd, data.port, data.env, data.commands,
+    data.dict(include=EXTRA_SERVER_CONFIG_FIELDS, exclude_none=True)
   )
   return {"status": "changed_config"}
 
@@ -255,6 +580,13 @@ async def get_server_config():
   config = await sm.get_server_config()
   return config
 
+@app.post("/server/forwarding")
+async def forwarding_stats():
+  stats = await sm.get_forwarding_stats()
+  if stats is None:
+    return {"error": "forwarding_not_running"}
+  return stats
+
 @app.get("/servers")
 async def list_servers(endpoint: str):
   smt = ServerManager(endpoint, "")
@@ -274,6 +606,36 @@ def add_rclone_config(payload: RcloneConfigPayload):
     logger.passLog(2, f"Fehler beim Hinzufügen: {str(e)}")
     return {"error": f"Fehler beim Hinzufügen: {str(e)}"}
 
+# ---------- ADMIN ENDPOINTS ----------
+
+def _download(content: bytes, filename: str, media_type: str = "text/plain") -> Response:
+  return Response(content, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.get("/admin/loop_lag")
+async def loop_lag(seconds: float = 60):
+  return loop_monitor.get_stats(seconds)
+
+@app.get("/admin/profile")
+async def profile(seconds: float = 10, mode: str = "cprofile", text: bool = False):
+  # mode=cprofile: event loop thread, pstats dump (or text report); mode=sampling: all threads, collapsed stacks
+  if Profiler.busy():
+    return {"error": "profiler_busy"}
+  stamp = time.strftime("%Y-%m-%d_%H-%M-%S")
+  if mode == "sampling":
+    return _download(await Profiler.sample(seconds), f"profile_{stamp}.folded")
+  if mode != "cprofile":
+    return {"error": "unknown_mode"}
+  if text:
+    return _download(await Profiler.cprofile(seconds, True), f"profile_{stamp}.txt")
+  return _download(await Profiler.cprofile(seconds), f"profile_{stamp}.prof", "application/octet-stream")
+
+@app.get("/admin/tracemalloc")
+async def tracemalloc_snapshot(seconds: float = 10, top: int = 25):
+  if Profiler.busy():
+    return {"error": "profiler_busy"}
+  stamp = time.strftime("%Y-%m-%d_%H-%M-%S")
+  return _download(await Profiler.tracemalloc_top(seconds, top), f"tracemalloc_{stamp}.txt")
+
 # ---------- OPEN BROWSER ----------
 
 def open_browser_later():
@@ -299,5 +661,7 @@ async def _wait_and_open():
 if __name__ == "__main__":
   DownloadHandler().ensure_binaries_sync()
   threading.Thread(target=open_browser_later, daemon=True).start()
-  asyncio.run(logger.passLog(2, "Starting Uvicorn server..."))
-  uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+  # Fast runtime: uvloop as event loop (when installed), orjson is chosen by Serializer.configure() above
+  loop = "uvloop" if config.getFastRuntime() and importlib.util.find_spec("uvloop") is not None else "asyncio"
+  asyncio.run(logger.passLog(2, f"Starting Uvicorn server (loop: {loop}, json: {Serializer.backend()})..."))
+  uvicorn.run(app, host="0.0.0.0", port=8000, loop=loop)
\ No newline at end of file
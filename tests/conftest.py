@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+  # The libraries write logs, configs and caches relative to the working directory
+  monkeypatch.chdir(tmp_path)
+  return tmp_path
+
+
+class FakeRemote:
+  # In-memory stand-in for the remote files a ResticManager reads and writes
+  def __init__(self, endpoint: str = "remote"):
+    self.endpoint = endpoint
+    self.files = {}
+    self.fail_writes = False
+
+  def readRemoteFile(self, remote_path: str):
+    return self.files.get(remote_path)
+
+  def writeRemoteFile(self, remote_path: str, content: str) -> bool:
+    if self.fail_writes:
+      return False
+    self.files[remote_path] = content
+    return True
+
+
+@pytest.fixture
+def remote():
+  return FakeRemote()
@@ -0,0 +1,120 @@
+import os
+import asyncio
+
+import pytest
+
+from libraries.BackupFilter import BackupFilter
+from libraries.ServerManager import ServerManager
+
+
+def make_server(root: str):
+  files = {"world/level.dat": 10, "world/session.lock": 1, "logs/latest.log": 100, "cache/big.bin": 5000, "cache/.nobackup": 0, "server.properties": 20, "plugins/a.jar": 300}
+  for path, size in files.items():
+    full = os.path.join(root, path)
+    os.makedirs(os.path.dirname(full), exist_ok=True)
+    with open(full, "wb") as f:
+      f.write(b"x" * size)
+
+
+def test_restic_args_anchor_leading_slash_patterns(workdir):
+  backup_filter = BackupFilter(exclude=["/world/session.lock", "*.log"], exclude_if_present=[".nobackup"], max_file_size=1000)
+  assert backup_filter.restic_args("server") == [
+    "--exclude", os.path.join(os.path.abspath("server"), "world/session.lock"),
+    "--exclude", "*.log",
+    "--exclude-if-present", ".nobackup",
+    "--exclude-larger-than", "1000"
+  ]
+
+
+def test_targets_from_include_globs(workdir):
+  make_server("server")
+  assert BackupFilter().targets("server") == ["."]
+  assert BackupFilter(include=["world", "*.properties"]).targets("server") == ["server.properties", "world"]
+  assert BackupFilter(include=["nothing*"]).targets("server") == ["."]
+
+
+def test_dry_run_counts_bytes_per_rule(workdir):
+  make_server("server")
+  backup_filter = BackupFilter.from_config({"backup_filter": {"exclude": ["/world/session.lock", "logs"], "exclude_if_present": [".nobackup"], "max_file_size": 200}})
+  result = backup_filter.dry_run("server")
+  rules = {rule["rule"]: rule["bytes"] for rule in result["rules"]}
+  assert rules == {"exclude_if_present:.nobackup": 5000, "exclude:logs": 100, "exclude:/world/session.lock": 1, "max_file_size": 300}
+  assert (result["kept_files"], result["kept_bytes"]) == (2, 30)
+  assert result["saved_bytes"] == result["total_bytes"] - 30
+
+
+def test_is_empty():
+  assert BackupFilter.from_config({}).is_empty()
+  assert not BackupFilter.from_config({"backup_filter": {"exclude": ["logs"]}}).is_empty()
+  assert not BackupFilter(max_file_size=10).is_empty()
+
+
+class FakeStandby:
+  def __init__(self):
+    self.taken = False
+
+  async def take_staged(self, server_dir: str) -> bool:
+    self.taken = True
+    return True
+
+  def start(self):
+    pass
+
+
+def starting_manager(config: dict, uploaded: bool = True) -> tuple:
+  # ServerManager with a staged standby copy whose start stops right after the download
+  sm = ServerManager("remote", "srv")
+  sm.standby = FakeStandby()
+  downloads = []
+  async def get_server_config():
+    return config
+  async def did_newest_host_upload():
+    return uploaded
+  async def hold_lease(callback_function=None):
+    return True
+  async def download_server(callback_function, snapshot, delete, server_config):
+    downloads.append(delete)
+  async def stop_after_download():
+    raise RuntimeError("download finished")
+  async def release_lease():
+    pass
+  sm.get_server_config = get_server_config
+  sm.did_newest_host_upload = did_newest_host_upload
+  sm._hold_lease = hold_lease
+  sm._download_server = download_server
+  sm.wait_till_restic_done = stop_after_download
+  sm._release_lease = release_lease
+  return sm, downloads
+
+
+@pytest.mark.parametrize("config, delete", [
+  ({}, True),
+  ({"backup_filter": {"exclude": ["logs"]}}, False)
+])
+def test_staged_start_deletes_only_without_filter(config, delete):
+  sm, downloads = starting_manager(config)
+  with pytest.raises(RuntimeError):
+    asyncio.run(sm.start_server())
+  assert sm.standby.taken and downloads == [delete]
+
+
+def test_refused_start_keeps_the_standby_copy():
+  sm, downloads = starting_manager({}, uploaded=False)
+  with pytest.raises(ValueError, match="server_not_uploaded"):
+    asyncio.run(sm.start_server())
+  assert not sm.standby.taken and downloads == []
+
+
+def test_standby_does_not_delete_with_filter():
+  async def run():
+    sm = ServerManager("remote", "srv")
+    async def get_server_config():
+      return {"backup_filter": {"exclude": ["logs"]}}
+    sm.get_server_config = get_server_config
+    sm.restic.uploadPath = lambda local_path, remote_path: None
+    await sm.enable_standby(3600)
+    assert not sm.standby.delete
+    await sm._save_server_config({})
+    assert sm.standby.delete
+    await sm.disable_standby()
+  asyncio.run(run())
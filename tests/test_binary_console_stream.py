@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from libraries.BinaryConsoleStream import BinaryConsoleStream
+
+
+class FakeWebSocket:
+  def __init__(self):
+    self.frames = []
+
+  async def send_bytes(self, frame: bytes):
+    self.frames.append(frame)
+
+  def decoded(self) -> list:
+    frames = []
+    for frame in self.frames:
+      offset, length = BinaryConsoleStream.HEADER.unpack_from(frame)
+      payload = frame[BinaryConsoleStream.HEADER.size:]
+      assert len(payload) == length
+      frames.append((offset, payload))
+    return frames
+
+
+def test_header_is_offset_and_length():
+  stream = BinaryConsoleStream(capacity=64)
+  stream.append(b"hello\n")
+  frame, end = stream._next_frame(0, stream.written)
+  assert frame[:12] == (0).to_bytes(8, "big") + (6).to_bytes(4, "big")
+  assert BinaryConsoleStream.HEADER.unpack_from(frame) == (0, 6)
+  assert frame[12:] == b"hello\n" and end == 6
+
+
+def test_ring_buffer_wraps_around():
+  stream = BinaryConsoleStream(capacity=16)
+  stream.append(b"0123456789")
+  stream.append(b"abcdefghij")
+  frame, end = stream._next_frame(0, stream.written)
+  assert BinaryConsoleStream.HEADER.unpack_from(frame) == (4, 16)   # the first 4 bytes were overwritten
+  assert frame[12:] == b"456789abcdefghij" and end == 20
+
+
+def test_oversized_append_keeps_the_tail():
+  stream = BinaryConsoleStream(capacity=8)
+  stream.append(b"0123456789abcdef")
+  frame, _ = stream._next_frame(0, stream.written)
+  assert BinaryConsoleStream.HEADER.unpack_from(frame) == (8, 8) and frame[12:] == b"89abcdef"
+
+
+def test_frames_are_split_at_the_payload_limit(monkeypatch):
+  monkeypatch.setattr(BinaryConsoleStream, "MAX_FRAME_PAYLOAD", 4)
+  async def run():
+    stream = BinaryConsoleStream(capacity=64)
+    stream.loop = asyncio.get_running_loop()
+    stream.append(b"0123456789")
+    websocket = FakeWebSocket()
+    await stream.attach("a", websocket)
+    assert websocket.decoded() == [(0, b"0123"), (4, b"4567"), (8, b"89")]
+  asyncio.run(run())
+
+
+def test_attach_after_overwrite_starts_at_the_oldest_byte():
+  async def run():
+    stream = BinaryConsoleStream(capacity=16)
+    for line in (b"line one\n", b"line two\n", b"line three\n"):
+      stream.append(line)   # no clients yet, nothing is sent
+    websocket = FakeWebSocket()
+    await stream.attach("a", websocket)
+    # The offset of the first frame shows the client that the first 13 bytes are gone
+    assert websocket.decoded() == [(13, b" two\nline three\n")]
+    assert stream.sent == stream.written == 29
+    stream.append(b"four\n")
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    assert websocket.decoded()[-1] == (29, b"four\n")
+  asyncio.run(run())
+
+
+def test_cancelled_flush_lets_the_next_append_flush():
+  async def run():
+    stream = BinaryConsoleStream(capacity=64)
+    stream.loop = asyncio.get_running_loop()
+    blocked = asyncio.Event()
+    class BlockingWebSocket(FakeWebSocket):
+      async def send_bytes(self, frame: bytes):
+        blocked.set()
+        await asyncio.sleep(60)
+    stream.clients["slow"] = BlockingWebSocket()
+    stream._flushing = True
+    stream.append(b"x\n")
+    flush = asyncio.ensure_future(stream._flush())
+    await blocked.wait()
+    flush.cancel()
+    with pytest.raises(asyncio.CancelledError):
+      await flush
+    assert not stream._flushing
+  asyncio.run(run())
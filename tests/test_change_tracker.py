@@ -0,0 +1,57 @@
+import os
+import time
+
+import pytest
+
+from libraries.ChangeTracker import ChangeTracker
+
+pytestmark = pytest.mark.skipif(not ChangeTracker.supported(), reason="inotify is Linux only")
+
+
+def wait_for(condition, timeout: float = 5):
+  deadline = time.time() + timeout
+  while not condition():
+    if time.time() > deadline:
+      return False
+    time.sleep(0.02)
+  return True
+
+
+@pytest.fixture
+def tracker(workdir):
+  os.makedirs("server/world/region")
+  with open("server/server.properties", "w") as f:
+    f.write("motd=test\n")
+  tracker = ChangeTracker("server")
+  assert tracker.start()
+  yield tracker
+  tracker.stop()
+
+
+def test_records_changes_below_the_root(tracker):
+  assert not tracker.has_changes()
+  with open("server/world/region/r.0.0.mca", "wb") as f:
+    f.write(b"chunk")
+  assert wait_for(lambda: os.path.join("world", "region", "r.0.0.mca") in tracker.changed)
+  changes, incomplete = tracker.take()
+  assert not incomplete and not tracker.has_changes()
+
+
+def test_new_directories_are_watched(tracker):
+  os.makedirs("server/plugins/config")
+  assert wait_for(lambda: os.path.join("plugins", "config") in tracker.changed)
+  with open("server/plugins/config/settings.yml", "w") as f:
+    f.write("a: 1\n")
+  assert wait_for(lambda: os.path.join("plugins", "config", "settings.yml") in tracker.changed)
+
+
+def test_moving_a_directory_out_makes_the_changes_incomplete(tracker):
+  os.rename("server/world", "world.old")
+  assert wait_for(lambda: tracker.incomplete)
+
+
+def test_failed_backups_put_their_changes_back(tracker):
+  tracker.put_back({"server.properties"}, False)
+  changes, incomplete = tracker.take()
+  tracker.put_back(changes, True)
+  assert tracker.take() == ({"server.properties"}, True)
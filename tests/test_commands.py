@@ -0,0 +1,57 @@
+import sys
+import asyncio
+
+import pytest
+
+from libraries.ServerManager import ServerManager
+from libraries.SubprocessHandler import SubprocessHandler
+
+GIVE = {"name": "give", "command": "give {player} {item}", "arguments": [
+  {"name": "player", "type": "str", "optional": False},
+  {"name": "item", "type": "str", "optional": False},
+  {"name": "count", "type": "int", "optional": True}
+]}
+
+
+def test_render_command_fills_and_appends_arguments():
+  assert ServerManager.render_command(GIVE, {"player": "Steve", "item": "diamond"}) == ["give Steve diamond"]
+  assert ServerManager.render_command(GIVE, {"player": "Steve", "item": "diamond", "count": "3"}) == ["give Steve diamond 3"]
+  assert ServerManager.render_command({"command": "say\nsave-all", "arguments": [{"name": "text", "type": "str", "optional": False}]}, {"text": "hi there"}) == ["say", 'save-all "hi there"']
+
+
+def test_render_command_rejects_bad_arguments():
+  with pytest.raises(ValueError, match="missing_argument"):
+    ServerManager.render_command(GIVE, {"player": "Steve"})
+  with pytest.raises(ValueError, match="invalid_argument"):
+    ServerManager.render_command(GIVE, {"player": "Steve", "item": "diamond", "count": "many"})
+
+
+def test_send_batch_waits_for_the_ack():
+  async def run():
+    process = SubprocessHandler([sys.executable, "-u", "-c", "import sys\nfor line in sys.stdin: print('echo ' + line.strip(), flush=True)"])
+    process.start()
+    try:
+      assert await process.send_batch(["first", "done"], ack_pattern=r"echo done", timeout=5) == "echo done"
+      assert await process.send_batch(["again"], ack_pattern=r"never", timeout=0.2) is None
+    finally:
+      await process.stop()
+  asyncio.run(run())
+
+
+def test_run_command_uses_the_cached_templates():
+  async def run():
+    sm = ServerManager("remote", "srv")
+    fetched, sent = [], []
+    async def get_server_config():
+      fetched.append(True)
+      return {"commands": [GIVE]}
+    async def send_batch(lines, ack_pattern=None, timeout=10):
+      sent.append(lines)
+    sm.get_server_config = get_server_config
+    sm.send_batch = send_batch
+    for _ in range(3):
+      await sm.run_command("give", {"player": "Alex", "item": "apple"})
+    assert len(fetched) == 1 and sent == [["give Alex apple"]] * 3
+    with pytest.raises(ValueError, match="command_not_found"):
+      await sm.run_command("kick", {})
+  asyncio.run(run())
@@ -0,0 +1,45 @@
+import json
+
+from libraries.ConsoleBuffer import ConsoleBuffer
+
+
+def filled(count: int, max_lines: int = 0) -> ConsoleBuffer:
+  buffer = ConsoleBuffer(max_lines)
+  for i in range(count):
+    assert buffer.append(f"line {i}") == i
+  return buffer
+
+
+def test_cap_keeps_the_newest_lines_with_their_seqs():
+  buffer = filled(1000, max_lines=100)
+  assert len(buffer) == 100
+  assert buffer.first_seq == 900 and buffer.next_seq() == 1000
+  result = buffer.query()
+  assert [entry["seq"] for entry in result["lines"]] == list(range(900, 1000))
+  assert all(entry["line"] == f"line {entry['seq']}" for entry in result["lines"])
+  assert buffer.text().splitlines() == [f"line {i}" for i in range(900, 1000)]
+
+
+def test_trimming_is_chunked():
+  buffer = filled(130, max_lines=100)
+  assert len(buffer.lines) - len(buffer) < buffer.trim_lines
+
+
+def test_query_ranges_and_filters():
+  buffer = filled(250, max_lines=100)
+  assert [entry["seq"] for entry in buffer.query(since_seq=240, before_seq=245)["lines"]] == [240, 241, 242, 243, 244]
+  assert [entry["seq"] for entry in buffer.query(since_seq=0, limit=2)["lines"]] == [150, 151]
+  assert [entry["seq"] for entry in buffer.query(tail=3)["lines"]] == [247, 248, 249]
+  result = buffer.query(pattern=r"line 1\d\d$", regex=True)
+  assert result["matched"] == 50 and result["lines"][0]["seq"] == 150
+
+
+def test_export_stays_consistent_while_lines_are_dropped():
+  buffer = filled(100, max_lines=100)
+  chunks = buffer.iter_ndjson(chunk_lines=10)
+  records = [json.loads(line) for line in next(chunks).splitlines()]
+  for i in range(100, 150):
+    buffer.append(f"line {i}")
+  records += [json.loads(line) for chunk in chunks for line in chunk.splitlines()]
+  assert [record["seq"] for record in records] == list(range(0, 10)) + list(range(50, 100))
+  assert all(record["line"] == f"line {record['seq']}" for record in records)
@@ -0,0 +1,50 @@
+import asyncio
+
+from libraries.ConsoleLogStore import ConsoleLogStore
+
+
+def test_rotation_keeps_max_segments():
+  store = ConsoleLogStore("srv", segment_bytes=100, max_segments=3)
+  run_id = store.start_run()
+  for i in range(100):
+    store.write(f"line {i:03d}")
+  store.close()
+  runs = store.get_runs()
+  assert [run["run_id"] for run in runs] == [run_id]
+  assert len(runs[0]["segments"]) == 3 == len(store.index["segments"])
+
+
+def test_search_finds_lines_in_closed_and_open_segments():
+  store = ConsoleLogStore("srv", segment_bytes=100)
+  store.start_run()
+  for i in range(50):
+    store.write(f"[INFO] line {i}" if i % 10 else f"[ERROR] line {i}")
+  store.flush()
+  matches = asyncio.run(store.search("error", ignore_case=True))
+  store.close()
+  assert sorted(match["line"] for match in matches) == sorted(f"[ERROR] line {i}" for i in range(0, 50, 10))
+
+
+def test_search_pool_is_spawned_and_shut_down():
+  store = ConsoleLogStore("srv")
+  store.start_run()
+  store.write("[ERROR] boom")
+  store.flush()
+  assert len(asyncio.run(store.search("boom"))) == 1
+  store.close()
+  pool = ConsoleLogStore._pool
+  assert pool._mp_context.get_start_method() == "spawn"
+  ConsoleLogStore.shutdown_pool()
+  assert ConsoleLogStore._pool is None
+  ConsoleLogStore.shutdown_pool()   # a second shutdown (no search since) is a no-op
+
+
+def test_get_runs_returns_copies_of_the_index():
+  # The reader thread keeps changing the index, callers must not hold on to its lists
+  store = ConsoleLogStore("srv", segment_bytes=50)
+  store.start_run()
+  runs = store.get_runs()
+  for i in range(20):
+    store.write(f"line {i}")
+  assert len(runs[0]["segments"]) == 1 < len(store.get_runs()[0]["segments"])
+  store.close()
@@ -0,0 +1,92 @@
+import re
+
+import pytest
+
+from libraries import ConsoleStats as console_stats_module
+from libraries.ConsoleStats import ConsoleStats
+
+LINES = [
+  "[12:00:01] [Server thread/INFO]: Steve joined the game",
+  "[12:00:02] [Server thread/INFO]: Alex joined the game",
+  "[12:00:03] [Server thread/WARN]: Can't keep up! Is the server overloaded? Running 2500ms or 50 ticks behind",
+  "[12:00:04] [Server thread/INFO]: TPS from last 1m, 5m, 15m: *19.5, 20.0, 20.0",
+  "[12:00:05] [Server thread/ERROR]: Could not pass event",
+  "[12:00:06] [Server thread/INFO]: Steve left the game",
+  "[12:00:07] [Server thread/INFO]: Done (3.2s)! For help, type \"help\""
+]
+
+
+def test_default_minecraft_rules():
+  stats = ConsoleStats()
+  for line in LINES:
+    stats.process_line(line)
+  snapshot = stats.snapshot()
+  assert snapshot["sets"]["players"] == {"count": 1, "members": ["Alex"]}
+  assert snapshot["gauges"]["tps"]["value"] == 19.5
+  assert {name: counter["total"] for name, counter in snapshot["counters"].items()} == {"tick_lag": 1, "errors": 1, "warnings": 1}
+
+
+def test_unparsable_gauge_keeps_the_last_value():
+  stats = ConsoleStats([{"name": "tps", "type": "gauge", "pattern": r"TPS: (\S+)"}])
+  stats.process_line("TPS: 18.0")
+  version = stats.version
+  stats.process_line("TPS: n/a")
+  assert stats.snapshot()["gauges"]["tps"]["value"] == 18.0
+  assert stats.version == version
+
+
+def test_group_by_index_and_name():
+  stats = ConsoleStats([
+    {"name": "whole", "type": "set_add", "pattern": r"\w+ \d+", "group": 0},
+    {"name": "memory", "type": "gauge", "pattern": r"mem (?P<mb>\d+)", "group": "mb"}
+  ])
+  stats.process_line("mem 512")
+  snapshot = stats.snapshot()
+  assert snapshot["sets"]["whole"]["members"] == ["mem 512"]
+  assert snapshot["gauges"]["memory"]["value"] == 512
+
+
+def test_per_minute_rate_decays(monkeypatch):
+  now = [1000.0]
+  monkeypatch.setattr(console_stats_module.time, "time", lambda: now[0])
+  stats = ConsoleStats([{"name": "errors", "type": "counter", "pattern": "ERROR"}])
+  stats.process_line("ERROR one")
+  now[0] += 30
+  stats.process_line("ERROR two")
+  assert stats.snapshot()["counters"]["errors"] == {"total": 2, "per_minute": 2}
+  now[0] += 45
+  assert stats.snapshot()["counters"]["errors"] == {"total": 2, "per_minute": 1}
+  now[0] += 60
+  assert stats.snapshot()["counters"]["errors"] == {"total": 2, "per_minute": 0}
+
+
+def test_clear_sets_keeps_counters():
+  stats = ConsoleStats()
+  stats.process_line(LINES[0])
+  stats.process_line(LINES[4])
+  stats.clear_sets()
+  snapshot = stats.snapshot()
+  assert snapshot["sets"]["players"] == {"count": 0, "members": []}
+  assert snapshot["counters"]["errors"]["total"] == 1
+
+
+@pytest.mark.parametrize("rule, error", [
+  ({"name": "x", "type": "counter", "pattern": "("}, re.error),
+  ({"name": "x", "type": "average", "pattern": "x"}, ValueError),
+  ({"name": "x", "type": "gauge", "pattern": r"(\d+)", "group": 2}, ValueError),
+  ({"name": "x", "type": "gauge", "pattern": r"(?P<tps>\d+)", "group": "mspt"}, ValueError)
+])
+def test_invalid_rules_are_rejected(rule, error):
+  with pytest.raises(error):
+    ConsoleStats.compile([rule])
+
+
+@pytest.mark.parametrize("rule", [
+  {"name": "x", "type": "counter", "pattern": "("},
+  {"name": "x", "type": "gauge", "pattern": r"(\d+)", "group": "2"}
+])
+def test_config_with_invalid_rules_is_refused(rule):
+  from fastapi.testclient import TestClient
+  import main
+  client = TestClient(main.app)
+  assert client.post("/server/config/set", json={"console_stats": [rule]}).json() == {"error": "invalid_pattern"}
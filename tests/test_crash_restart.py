@@ -0,0 +1,113 @@
+import time
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from libraries.ServerManager import ServerManager
+
+
+class DeadProcess:
+  def __init__(self):
+    self.total_output = ["history"]
+    self.writer_stopped = False
+
+  def _stop_writer(self):
+    self.writer_stopped = True
+
+
+def manager(restart: dict) -> tuple:
+  sm = ServerManager("remote", "srv")
+  events = []
+  sm.lease = SimpleNamespace(lost=False)
+  sm.process_started = time.time()
+
+  async def get_server_config():
+    return {"restart": {"enabled": True, "backoff_initial": 0.01, **restart}}
+  async def stop_server(callback_function=None):
+    events.append("stopped")
+  async def abandon(callback_function):
+    events.append("abandoned")
+  async def launch(callback_function, server_config, console_history=None):
+    events.append(("launched", console_history))
+
+  sm.get_server_config = get_server_config
+  sm.stop_server = stop_server
+  sm._abandon_server = abandon
+  sm._launch_process = launch
+  return sm, events
+
+
+def crash(sm, code: int = 1) -> tuple:
+  process = DeadProcess()
+  messages = []
+  async def callback(message):
+    messages.append(message)
+  asyncio.run(sm._handle_crash(process, code, callback))
+  return process, messages
+
+
+def test_restarts_in_place():
+  sm, events = manager({})
+  process, messages = crash(sm)
+  assert process.writer_stopped
+  assert events == [("launched", ["history"])]
+  assert {"info": "server_restarted", "attempt": 1} in messages
+
+
+def test_disabled_policy_stops_the_server():
+  sm, events = manager({"enabled": False})
+  crash(sm)
+  assert events == ["stopped"]
+
+
+def test_clean_exit_only_restarts_with_always():
+  sm, events = manager({})
+  _, messages = crash(sm, code=0)
+  assert events == ["stopped"]
+  assert messages == [] and list(sm.crash_history) == []   # a normal stop, not a crash
+  sm, events = manager({"on": "always"})
+  crash(sm, code=0)
+  assert events[0][0] == "launched"
+
+
+def test_clean_exit_with_disabled_policy_is_no_crash():
+  sm, events = manager({"enabled": False})
+  _, messages = crash(sm, code=0)
+  assert events == ["stopped"] and messages == [] and list(sm.crash_history) == []
+
+
+def test_crash_loop_gives_up():
+  sm, events = manager({"max_restarts": 2, "window": 60})
+  sm.restart_times = [time.time() - 10, time.time() - 5]
+  _, messages = crash(sm)
+  assert events == ["stopped"]
+  assert {"info": "crash_loop"} in messages
+
+
+def test_lost_lease_is_not_restarted():
+  sm, events = manager({})
+  sm.lease.lost = True
+  crash(sm)
+  assert events == ["abandoned"]
+
+
+def test_lease_lost_during_backoff_is_not_restarted():
+  sm, events = manager({"backoff_initial": 0.2})
+  async def run():
+    task = asyncio.create_task(sm._handle_crash(DeadProcess(), 1, None))
+    await asyncio.sleep(0.05)
+    sm.lease.lost = True
+    await task
+  asyncio.run(run())
+  assert events == ["abandoned"]
+
+
+def test_failed_stop_keeps_crash_recovery_enabled():
+  sm = ServerManager("remote", "srv")
+  async def get_server_config():
+    raise OSError("remote unreachable")
+  sm.get_server_config = get_server_config
+  with pytest.raises(OSError):
+    asyncio.run(sm.stop_server())
+  assert not sm._stopping
@@ -0,0 +1,142 @@
+import json
+import time
+import asyncio
+
+import pytest
+
+from libraries.HostLease import HostLease
+from libraries.ServerManager import ServerManager
+
+
+def lease(remote, client_id: str, **kwargs) -> HostLease:
+  return HostLease(remote, "srv", client_id, settle_seconds=0.01, **kwargs)
+
+
+def test_acquire_respects_unexpired_lease(remote):
+  async def run():
+    first, second = lease(remote, "a"), lease(remote, "b")
+    assert await first.acquire()
+    assert not await second.acquire()
+    assert await second.acquire(force=True)
+    assert json.loads(remote.files[first.remote_path])["generation"] == 2
+  asyncio.run(run())
+
+
+def test_acquire_after_expiry(remote):
+  async def run():
+    first, second = lease(remote, "a", ttl=0), lease(remote, "b")
+    first.clock_skew = second.clock_skew = 0
+    assert await first.acquire()
+    await asyncio.sleep(0.01)
+    assert await second.acquire()
+  asyncio.run(run())
+
+
+def test_only_one_client_wins_a_race(remote):
+  async def run():
+    results = await asyncio.gather(lease(remote, "a").acquire(), lease(remote, "b").acquire())
+    assert sorted(results) == [False, True]
+  asyncio.run(run())
+
+
+def test_renew_without_lease_is_lost(remote):
+  async def run():
+    unheld = lease(remote, "a")
+    assert not await unheld.renew()
+    assert unheld.lost
+  asyncio.run(run())
+
+
+def test_renew_detects_takeover(remote):
+  async def run():
+    first = lease(remote, "a")
+    await first.acquire()
+    await lease(remote, "b").acquire(force=True)
+    assert not await first.renew()
+    assert first.lost
+  asyncio.run(run())
+
+
+def test_renew_failing_past_expiry_is_lost(remote):
+  async def run():
+    held = lease(remote, "a", ttl=30)
+    await held.acquire()
+    remote.fail_writes = True
+    assert await held.renew()   # still within the ttl
+    held.lease["expires"] = time.time() - 1
+    assert not await held.renew()
+    assert held.lost
+  asyncio.run(run())
+
+
+def test_heartbeat_calls_on_lost(remote):
+  async def run():
+    lost = asyncio.Event()
+    held = lease(remote, "a", ttl=0.03, on_lost=lost.set)
+    await held.acquire()
+    held.start_heartbeat()
+    await lease(remote, "b").acquire(force=True)
+    await asyncio.wait_for(lost.wait(), 1)
+  asyncio.run(run())
+
+
+class FakeProcess:
+  def __init__(self):
+    self.stopped = False
+
+  async def stop(self):
+    self.stopped = True
+
+
+def manager(remote) -> ServerManager:
+  sm = ServerManager("remote", "srv")
+  sm.restic = remote
+  sm.LEASE_ATTEMPTS = 1
+  return sm
+
+
+def test_hold_lease_fails_without_remote(remote):
+  async def run():
+    remote.fail_writes = True
+    sm = manager(remote)
+    assert not await sm._hold_lease()
+    assert sm.lease is None
+  asyncio.run(run())
+
+
+def test_lost_lease_stops_the_server(remote):
+  async def run():
+    sm = manager(remote)
+    messages = []
+    async def callback(message):
+      messages.append(message)
+    assert await sm._hold_lease(callback)
+    await sm.lease.release()
+    process = sm.server_process = FakeProcess()
+    await sm.lease.on_lost()
+    assert process.stopped
+    assert sm.server_process is None
+    assert {"info": "lease_lost"} in messages and {"info": "server_stopped"} in messages
+  asyncio.run(run())
+
+
+def test_fresh_foreign_lease_refuses_the_start(remote):
+  async def run():
+    foreign = lease(remote, "other-client")
+    assert await foreign.acquire()
+    sm = manager(remote)
+    launched = []
+    async def server_config():
+      return {"commands": []}
+    async def nothing(*args, **kwargs):
+      return True
+    async def launch(*args):
+      launched.append(args)
+    sm.get_server_config = server_config
+    sm._download_server = sm.wait_till_restic_done = sm.did_newest_host_upload = nothing
+    sm._launch_process = launch
+    with pytest.raises(ValueError, match="lease_unavailable"):
+      await sm.start_server()
+    assert launched == [] and sm.lease is None
+    assert json.loads(remote.files[foreign.remote_path])["client_id"] == "other-client"
+  asyncio.run(run())
@@ -0,0 +1,37 @@
+import time
+import asyncio
+
+from libraries.LoopMonitor import LoopMonitor
+
+
+def test_blocked_loop_is_detected_with_its_stack():
+  monitor = LoopMonitor(interval=0.02, slow_threshold=0.1)
+  async def run():
+    monitor.start()
+    await asyncio.sleep(0.1)
+    time.sleep(0.4)   # blocks the event loop like a synchronous call would
+    await asyncio.sleep(0.1)
+    monitor.stop()
+  asyncio.run(run())
+
+  stats = monitor.get_stats()
+  assert stats["samples"] > 0 and stats["lag_ms"]["max"] >= 300
+  assert stats["lag_ms"]["p50"] < 100
+  event = stats["slow_events"][-1]
+  assert event["lag_ms"] >= 300
+  assert any("time.sleep(0.4)" in line for line in event["stack"])   # the watchdog caught the blocking line
+
+
+def test_idle_loop_has_no_slow_events():
+  monitor = LoopMonitor(interval=0.01, slow_threshold=0.2)
+  async def run():
+    monitor.start()
+    await asyncio.sleep(0.1)
+    monitor.stop()
+  asyncio.run(run())
+  assert monitor.get_stats()["slow_events"] == []
+
+
+def test_stats_without_samples():
+  stats = LoopMonitor().get_stats(10)
+  assert stats["samples"] == 0 and stats["lag_ms"] == {"p50": None, "p90": None, "p99": None, "max": None}
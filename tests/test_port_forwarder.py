@@ -0,0 +1,74 @@
+import socket
+import asyncio
+
+import pytest
+
+from libraries.PortForwarder import PortForwarder, _UdpSession
+
+
+async def tcp_echo_server() -> tuple:
+  async def echo(reader, writer):
+    while data := await reader.read(1024):
+      writer.write(data)
+      await writer.drain()
+    writer.close()
+  server = await asyncio.start_server(echo, "127.0.0.1", 0)
+  return server, server.sockets[0].getsockname()[1]
+
+
+def test_tcp_loopback():
+  async def run():
+    server, port = await tcp_echo_server()
+    forwarder = PortForwarder("127.0.0.1", port, "127.0.0.1", 0)
+    await forwarder.start()
+    reader, writer = await asyncio.open_connection("127.0.0.1", forwarder.listen_port)
+    writer.write(b"ping")
+    await writer.drain()
+    assert await asyncio.wait_for(reader.readexactly(4), 5) == b"ping"
+    writer.close()
+    await forwarder.stop()
+    server.close()
+  asyncio.run(run())
+
+
+def test_udp_loopback():
+  async def run():
+    loop = asyncio.get_running_loop()
+    class Echo(asyncio.DatagramProtocol):
+      def connection_made(self, transport):
+        self.transport = transport
+      def datagram_received(self, data, addr):
+        self.transport.sendto(data, addr)
+    target, _ = await loop.create_datagram_endpoint(Echo, local_addr=("127.0.0.1", 0))
+    forwarder = PortForwarder("127.0.0.1", target.get_extra_info("sockname")[1], "127.0.0.1", 0, tcp=False, udp=True)
+    await forwarder.start()
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.setblocking(False)
+    client.sendto(b"ping", ("127.0.0.1", forwarder.listen_port))
+    assert await asyncio.wait_for(loop.sock_recv(client, 1024), 5) == b"ping"
+    client.close()
+    await forwarder.stop()
+    target.close()
+  asyncio.run(run())
+
+
+def test_failed_udp_bind_releases_the_tcp_port():
+  async def run():
+    blocker = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    blocker.bind(("127.0.0.1", 0))
+    port = blocker.getsockname()[1]
+    forwarder = PortForwarder("127.0.0.1", 1, "127.0.0.1", port, tcp=True, udp=True)
+    with pytest.raises(OSError):
+      await forwarder.start()
+    assert forwarder._tcp_listener is None and forwarder._tasks == set()
+    blocker.close()
+    await forwarder.start()   # the retry binds both ports
+    await forwarder.stop()
+  asyncio.run(run())
+
+
+def test_udp_reply_during_shutdown_is_dropped():
+  forwarder = PortForwarder("127.0.0.1", 1, udp=True)
+  session = _UdpSession(forwarder, ("127.0.0.1", 5))
+  session.datagram_received(b"late", ("127.0.0.1", 1))
+  assert session.stats["packets_out"] == 0
@@ -0,0 +1,75 @@
+import time
+import marshal
+import asyncio
+import threading
+import tracemalloc
+
+from libraries.Profiler import Profiler
+
+
+def test_cprofile_dump_and_text_report():
+  async def busy_loop():
+    for _ in range(20):
+      sum(range(1000))
+      await asyncio.sleep(0.001)
+  async def run():
+    work = asyncio.create_task(busy_loop())
+    dump = await Profiler.cprofile(0.05)
+    text = await Profiler.cprofile(0.05, as_text=True)
+    await work
+    return dump, text
+  dump, text = asyncio.run(run())
+  stats = marshal.loads(dump)
+  assert any(function == "busy_loop" for (_, _, function) in stats)
+  assert b"Ordered by: cumulative time" in text
+  assert not Profiler.busy()
+
+
+def test_sampling_profile_is_collapsed_stacks():
+  stop = threading.Event()
+  def spin():
+    while not stop.is_set():
+      time.sleep(0.001)
+  worker = threading.Thread(target=spin, name="spinner")
+  worker.start()
+  try:
+    output = asyncio.run(Profiler.sample(0.05, 0.005)).decode()
+  finally:
+    stop.set()
+    worker.join()
+  lines = output.splitlines()
+  assert lines != []
+  stack, count = lines[0].rsplit(" ", 1)
+  assert int(count) > 0
+  assert any(line.startswith("spinner;") and "spin (test_profiler.py:" in line for line in lines)
+
+
+def test_tracemalloc_window_is_stopped_afterwards():
+  kept = []
+  async def allocate():
+    await asyncio.sleep(0.01)
+    kept.append(bytearray(2 * 1024 * 1024))
+  async def run():
+    work = asyncio.create_task(allocate())
+    report = await Profiler.tracemalloc_top(0.05, top=5)
+    await work
+    return report.decode()
+  report = asyncio.run(run())
+  assert report.startswith("traced memory: current")
+  assert "test_profiler.py" in report   # the 2 MiB allocation above is the largest site
+  assert not tracemalloc.is_tracing()
+
+
+def test_admin_endpoints_round_trip():
+  from fastapi.testclient import TestClient
+  import main
+  client = TestClient(main.app)
+  response = client.get("/admin/profile", params={"seconds": 0.05, "text": True})
+  assert response.status_code == 200 and b"cumulative" in response.content
+  assert response.headers["content-disposition"].startswith('attachment; filename="profile_')
+  response = client.get("/admin/profile", params={"seconds": 0.05})
+  assert response.headers["content-type"] == "application/octet-stream" and isinstance(marshal.loads(response.content), dict)
+  assert client.get("/admin/profile", params={"mode": "unknown", "seconds": 0}).json() == {"error": "unknown_mode"}
+  response = client.get("/admin/tracemalloc", params={"seconds": 0.05, "top": 3})
+  assert response.content.startswith(b"traced memory:")
+  assert set(client.get("/admin/loop_lag", params={"seconds": 5}).json()["lag_ms"]) == {"p50", "p90", "p99", "max"}
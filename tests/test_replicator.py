@@ -0,0 +1,42 @@
+import asyncio
+
+from libraries.Replicator import Replicator
+from libraries.ServerManager import ServerManager
+
+
+def test_manual_and_scheduled_runs_do_not_overlap():
+  async def run():
+    replicator = Replicator("primary", "srv", ["replica"])
+    running, overlaps, runs = [], [], []
+    async def replicate_endpoint(endpoint):
+      if running:
+        overlaps.append(endpoint)
+      running.append(endpoint)
+      await asyncio.sleep(0.02)
+      running.remove(endpoint)
+      runs.append(endpoint)
+    replicator._replicate = replicate_endpoint
+    replicator.schedule()
+    await asyncio.gather(replicator.replicate(), replicator.replicate())
+    await replicator._task
+    assert overlaps == [] and runs == ["replica"] * 3
+  asyncio.run(run())
+
+
+def test_replaced_replicator_is_stopped():
+  async def run():
+    sm = ServerManager("primary", "srv")
+    config = {"replicas": ["replica"]}
+    first = await sm._get_replicator(config)
+    assert await sm._get_replicator(config) is first
+    stopped = []
+    async def stop():
+      stopped.append(True)
+    first.stop = stop
+    sm.server_name = "other"
+    second = await sm._get_replicator(config)
+    assert stopped == [True] and second is not first and second.server_name == "other"
+    second.stop = stop
+    assert await sm._get_replicator({}) is None
+    assert stopped == [True, True] and sm.replicator is None
+  asyncio.run(run())
@@ -0,0 +1,31 @@
+import json
+
+import pytest
+
+from libraries.Serializer import Serializer, orjson
+
+
+@pytest.fixture
+def restore_backend():
+  use_orjson = Serializer.use_orjson
+  yield
+  Serializer.use_orjson = use_orjson
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_both_backends_write_the_same_json(restore_backend, fast):
+  Serializer.configure(fast)
+  assert Serializer.backend() == ("orjson" if fast and orjson is not None else "json")
+  message = {"console": ["Grüße", "line"], "seq": 3}
+  assert Serializer.dumps(message) == '{"console":["Grüße","line"],"seq":3}'
+  assert json.loads(Serializer.dumps({"big": 2 ** 70})) == {"big": 2 ** 70}   # orjson rejects it, json takes over
+
+
+def test_runtime_setting_is_read_fresh():
+  from fastapi.testclient import TestClient
+  import main
+  client = TestClient(main.app)
+  assert client.post("/config/runtime", json={"fast_runtime": False}).json() == {"status": "restart_required"}
+  assert client.get("/config/runtime").json()["fast_runtime"] is False
+  client.post("/config/runtime", json={"fast_runtime": True})
+  assert client.get("/config/runtime").json()["fast_runtime"] is True
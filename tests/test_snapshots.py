@@ -0,0 +1,169 @@
+import os
+import asyncio
+
+import pytest
+
+from libraries.SnapshotCache import SnapshotCache
+from libraries.ServerManager import ServerManager
+
+SNAPSHOTS = [
+  {"id": "aaaa1111" + "0" * 56, "short_id": "aaaa1111", "time": "2025-01-01T00:00:00Z"},
+  {"id": "aaaa2222" + "0" * 56, "short_id": "aaaa2222", "time": "2025-02-01T00:00:00Z"},
+  {"id": "bbbb3333" + "0" * 56, "short_id": "bbbb3333", "time": "2025-03-01T00:00:00Z"}
+]
+
+
+class FakeRestic:
+  def __init__(self):
+    self.endpoint = "remote"
+    self.snapshots = list(SNAPSHOTS)
+    self.calls = []
+
+  def listSnapshots(self, remote_path: str) -> list:
+    self.calls.append("snapshots")
+    return self.snapshots
+
+  def listDirectory(self, remote_path: str, snapshot_id: str, path: str):
+    self.calls.append(path)
+    return None if path == "/missing" else [{"name": "level.dat", "type": "file", "path": path.rstrip("/") + "/level.dat"}]
+
+
+@pytest.fixture
+def restic():
+  return FakeRestic()
+
+
+def test_lookup_by_full_and_short_id(restic):
+  cache = SnapshotCache(restic, "srv")
+  async def run():
+    assert (await cache.find_snapshot("bbbb3333"))["id"] == SNAPSHOTS[2]["id"]
+    assert (await cache.find_snapshot(SNAPSHOTS[0]["id"].upper()))["id"] == SNAPSHOTS[0]["id"]
+    assert await cache.find_snapshot("cccc4444") is None
+  asyncio.run(run())
+
+
+@pytest.mark.parametrize("snapshot_id", ["", "   ", "bbbb"])
+def test_short_ids_are_rejected(restic, snapshot_id):
+  with pytest.raises(ValueError, match="invalid_snapshot_id"):
+    asyncio.run(SnapshotCache(restic, "srv").find_snapshot(snapshot_id))
+
+
+def test_ambiguous_ids_are_rejected(restic):
+  restic.snapshots.append({"id": "bbbb3333" + "f" * 56, "short_id": "bbbb3333", "time": "2025-04-01T00:00:00Z"})
+  with pytest.raises(ValueError, match="ambiguous_snapshot_id"):
+    asyncio.run(SnapshotCache(restic, "srv").find_snapshot("bbbb3333"))
+
+
+def test_listing_is_cached_until_invalidated(restic):
+  cache = SnapshotCache(restic, "srv")
+  async def run():
+    assert [snapshot["short_id"] for snapshot in await cache.get_snapshots()] == ["bbbb3333", "aaaa2222", "aaaa1111"]
+    await cache.get_snapshots()
+    assert restic.calls == ["snapshots"]
+    cache.invalidate()
+    await cache.get_snapshots()
+    assert restic.calls == ["snapshots", "snapshots"]
+  asyncio.run(run())
+
+
+def test_trees_are_cached_on_disk_and_pruned(restic):
+  snapshot_id = SNAPSHOTS[0]["id"]
+  async def run():
+    cache = SnapshotCache(restic, "srv")
+    assert await cache.list_directory(snapshot_id, "world/") == await cache.list_directory(snapshot_id, "/world")
+    assert await cache.list_directory(snapshot_id, "/missing") is None
+    assert restic.calls == ["/world", "/missing"]
+    assert await SnapshotCache(restic, "srv").list_directory(snapshot_id, "/world") is not None
+    assert restic.calls == ["/world", "/missing"]   # read from disk by the new instance
+
+    restic.snapshots = SNAPSHOTS[1:]   # the snapshot was forgotten
+    await SnapshotCache(restic, "srv").get_snapshots()
+    assert not os.path.exists(cache._tree_path(snapshot_id))
+  asyncio.run(run())
+
+
+def manager(restic) -> tuple:
+  sm = ServerManager("remote", "srv")
+  sm.restic = restic
+  config = {"commands": []}
+  restores = []
+  async def get_server_config():
+    return {key: list(value) if isinstance(value, list) else value for key, value in config.items()}
+  async def save_server_config(conf_json):
+    config.clear()
+    config.update(conf_json)
+  async def restore_paths(snapshot_id, paths, callback_function=None):
+    restores.append((snapshot_id, paths))
+    return paths != ["/broken"]
+  sm.get_server_config = get_server_config
+  sm._save_server_config = save_server_config
+  sm._restore_paths = restore_paths
+  return sm, config, restores
+
+
+def test_restores_are_queued_while_not_running(restic):
+  sm, config, restores = manager(restic)
+  async def run():
+    assert await sm.restore_snapshot("aaaa1111", ["server.properties/", "/world"]) == "queued"
+    assert await sm.restore_snapshot("bbbb3333", ["/ops.json"]) == "queued"
+    assert [entry["paths"] for entry in config["pending_restores"]] == [["/server.properties", "/world"], ["/ops.json"]]
+    assert await sm.restore_snapshot("aaaa2222", []) == "queued"   # a full rollback replaces the queue
+    assert [(entry["snapshot"], entry["paths"]) for entry in config["pending_restores"]] == [(SNAPSHOTS[1]["id"], [])]
+    assert await sm.restore_snapshot("cccc4444", ["/x"]) is None
+  asyncio.run(run())
+  assert restores == []
+
+
+def test_restores_are_applied_right_away_while_running(restic):
+  sm, config, restores = manager(restic)
+  sm.server_process = object()
+  async def run():
+    assert await sm.restore_snapshot("aaaa1111", ["/server.properties"]) == "restored"
+    assert await sm.restore_snapshot("aaaa1111", ["/broken"]) == "failed"
+    assert await sm.restore_snapshot("aaaa1111", ["/"]) == "queued"   # a full rollback waits for the next start
+  asyncio.run(run())
+  assert restores == [(SNAPSHOTS[0]["id"], ["/server.properties"]), (SNAPSHOTS[0]["id"], ["/broken"])]
+
+
+def test_applying_the_queue_keeps_failed_restores(restic):
+  sm, config, restores = manager(restic)
+  async def run():
+    await sm.restore_snapshot("aaaa1111", [])
+    await sm.restore_snapshot("aaaa1111", ["/broken"])
+    await sm.restore_snapshot("bbbb3333", ["/ops.json"])
+    await sm._apply_pending_restores(list(config["pending_restores"]))
+  asyncio.run(run())
+  assert restores == [(SNAPSHOTS[0]["id"], ["/broken"]), (SNAPSHOTS[2]["id"], ["/ops.json"])]   # the rollback was the download
+  assert [entry["paths"] for entry in config["pending_restores"]] == [["/broken"]]
+
+
+@pytest.mark.parametrize("backup_filter, delete", [
+  (None, True),
+  ({"exclude": ["logs"]}, False)   # a rollback must not remove the files the filter keeps out of the backup
+])
+def test_rollback_deletes_only_without_filter(restic, backup_filter, delete):
+  sm, config, restores = manager(restic)
+  downloads = []
+  async def did_newest_host_upload():
+    return True
+  async def hold_lease(callback_function=None):
+    return True
+  async def download_server(callback_function, snapshot, delete, server_config):
+    downloads.append((snapshot, delete))
+  async def stop_after_download():
+    raise RuntimeError("download finished")
+  async def release_lease():
+    pass
+  sm.did_newest_host_upload = did_newest_host_upload
+  sm._hold_lease = hold_lease
+  sm._download_server = download_server
+  sm.wait_till_restic_done = stop_after_download
+  sm._release_lease = release_lease
+  if backup_filter is not None:
+    config["backup_filter"] = backup_filter
+  async def run():
+    await sm.restore_snapshot("aaaa1111", [])
+    await sm.start_server()
+  with pytest.raises(RuntimeError):
+    asyncio.run(run())
+  assert downloads == [(SNAPSHOTS[0]["id"], delete)]
@@ -0,0 +1,51 @@
+import os
+import asyncio
+
+import pytest
+
+from libraries import TransferProfile as transfer_profile_module
+from libraries.TransferProfile import TransferProfile
+from libraries.ServerManager import ServerManager
+
+
+@pytest.fixture(autouse=True)
+def tools(monkeypatch):
+  monkeypatch.setattr(transfer_profile_module.shutil, "which", lambda name: f"/usr/bin/{name}")
+  monkeypatch.setattr(transfer_profile_module.os, "name", "posix")
+
+
+def test_gentle_defaults_and_overrides():
+  profile = TransferProfile.from_config({"transfer": {"gentle": {"bwlimit": "08:00,1M 23:00,off", "unknown": 1}}}, "gentle")
+  assert profile.prefix() == ["nice", "-n", "19", "ionice", "-c", "2", "-n", "7"]
+  assert profile.env() == {"RCLONE_BWLIMIT": "08:00,1M 23:00,off", "GOMAXPROCS": str(max(1, (os.cpu_count() or 1) // 4))}
+
+
+def test_full_profile_is_unrestricted():
+  profile = TransferProfile.from_config({}, "full")
+  assert profile.prefix() == [] and profile.env() == {}
+
+
+@pytest.mark.parametrize("settings, prefix", [
+  ({"ionice_class": 3, "ionice_level": 4}, ["ionice", "-c", "3"]),
+  ({"ionice_class": 1, "ionice_level": 0}, []),   # realtime needs root
+  ({"nice": -5}, [])
+])
+def test_settings_that_need_root_are_ignored(settings, prefix):
+  profile = TransferProfile("custom", **settings)
+  assert profile.prefix() == prefix
+
+
+def test_standby_follows_the_server_profile():
+  async def run():
+    sm = ServerManager("remote", "srv")
+    config = {"transfer": {"gentle": {"bwlimit": "1M"}}}
+    async def get_server_config():
+      return config
+    sm.get_server_config = get_server_config
+    sm.restic.uploadPath = lambda local_path, remote_path: None
+    await sm.enable_standby(3600)
+    assert sm.standby.profile.bwlimit == "1M"
+    await sm._save_server_config({"transfer": {"gentle": {"bwlimit": "2M"}}})
+    assert sm.standby.profile.bwlimit == "2M"
+    await sm.disable_standby()
+  asyncio.run(run())